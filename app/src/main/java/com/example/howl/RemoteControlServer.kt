@@ -22,13 +22,23 @@ import kotlinx.serialization.json.JsonElement
 import kotlinx.serialization.json.JsonNull
 import kotlinx.serialization.json.JsonPrimitive
 import kotlinx.serialization.json.encodeToJsonElement
+import java.io.ByteArrayOutputStream
+import java.io.EOFException
+import java.io.InputStream
 import java.util.Base64
+import java.util.zip.InflaterInputStream
+import java.util.zip.ZipException
 import kotlin.random.Random
 import kotlin.time.Duration
 import kotlin.time.Duration.Companion.seconds
 
 const val CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
 
+// Largest upload_hwl body we accept once decompressed (around 30 hours of pulses)
+const val MAX_HWL_UPLOAD_BYTES = 256 * 1024 * 1024
+
+class UploadTooLargeException : Exception()
+
 fun generateApiKey(length: Int = 12): String {
     return buildString(length) {
         repeat(length) {
@@ -314,14 +324,29 @@ class RequestHandler {
             "RequestHandler",
             "Handling command load_hwl(title='${request.title}', loop=${request.loop}, play=${request.play}, hwl size=${hwlData.size} bytes)"
         )
+        return loadHwl(hwlData, request.title, request.loop, request.play)
+    }
+
+    /**
+     * Handles a binary HWL upload (POST /upload_hwl). Unlike the other endpoints the parameters
+     * come from the query string and the HWL data is the raw (already decompressed) request body.
+     */
+    suspend fun handleUploadHwl(title: String, loop: Boolean, play: Boolean, hwlData: ByteArray, uploadSize: Long): HandlerResult {
+        HLog.i(
+            "RequestHandler",
+            "Handling command upload_hwl(title='$title', loop=$loop, play=$play, hwl size=${hwlData.size} bytes, upload size=$uploadSize bytes)"
+        )
+        return loadHwl(hwlData, title, loop, play)
+    }
 
+    private suspend fun loadHwl(hwlData: ByteArray, title: String, loop: Boolean, play: Boolean): HandlerResult {
         try {
             val pulseSource = HWLPulseSource()
-            pulseSource.loadFromBytes(data = hwlData, title = request.title, loop = request.loop)
+            pulseSource.loadFromBytes(data = hwlData, title = title, loop = loop)
 
             withContext(Dispatchers.Main) {
                 Player.switchPulseSource(pulseSource)
-                if (request.play) Player.startPlayer()
+                if (play) Player.startPlayer()
             }
 
             return HandlerResult(HttpStatusCode.OK, buildStatusResponse())
@@ -433,6 +458,51 @@ class RequestHandler {
     }
 }
 
+// --- Binary Uploads ---
+
+/**
+ * Counts the bytes read through it, so we can log the size of an upload as sent.
+ */
+private class CountingInputStream(private val source: InputStream) : InputStream() {
+    var count = 0L
+        private set
+
+    override fun read(): Int {
+        val value = source.read()
+        if (value >= 0) count++
+        return value
+    }
+
+    override fun read(b: ByteArray, off: Int, len: Int): Int {
+        val read = source.read(b, off, len)
+        if (read > 0) count += read
+        return read
+    }
+
+    override fun close() = source.close()
+}
+
+/**
+ * Reads a whole request body, inflating it if it was sent with Content-Encoding: deflate.
+ * Returns the body and its size as sent.
+ * Throws UploadTooLargeException past MAX_HWL_UPLOAD_BYTES, or ZipException for bad compressed data.
+ */
+private fun readUploadBody(body: InputStream, deflate: Boolean): Pair<ByteArray, Long> {
+    val counter = CountingInputStream(body)
+    val input = if (deflate) InflaterInputStream(counter) else counter
+    val output = ByteArrayOutputStream()
+    val buffer = ByteArray(64 * 1024)
+    input.use {
+        while (true) {
+            val read = it.read(buffer)
+            if (read < 0) break
+            if (output.size() + read > MAX_HWL_UPLOAD_BYTES) throw UploadTooLargeException()
+            output.write(buffer, 0, read)
+        }
+    }
+    return Pair(output.toByteArray(), counter.count)
+}
+
 // --- Remote Control Server ---
 
 object RemoteControlServer {
@@ -519,6 +589,43 @@ object RemoteControlServer {
                         val result = requestHandler.handleRequest("load_hwl", call.receive<JsonElement>())
                         call.respond(result.status, result.body)
                     }
+                    // Binary HWL upload, streamed and optionally deflate compressed, avoiding base64 in JSON
+                    post("/upload_hwl") {
+                        val encoding = call.request.headers[HttpHeaders.ContentEncoding]?.lowercase() ?: "identity"
+                        if (encoding != "identity" && encoding != "deflate") {
+                            call.respond(HttpStatusCode.UnsupportedMediaType, ErrorResponse(ErrorBody("Unsupported Content-Encoding: $encoding")))
+                            return@post
+                        }
+                        val query = call.request.queryParameters
+                        val loop = query["loop"]?.toBooleanStrictOrNull()
+                        val play = query["play"]?.toBooleanStrictOrNull()
+                        if ((query["loop"] != null && loop == null) || (query["play"] != null && play == null)) {
+                            call.respond(HttpStatusCode.BadRequest, ErrorResponse(ErrorBody("Invalid parameters")))
+                            return@post
+                        }
+                        val (hwlData, uploadSize) = try {
+                            val body = call.receiveStream()
+                            withContext(Dispatchers.IO) { readUploadBody(body, encoding == "deflate") }
+                        } catch (_: UploadTooLargeException) {
+                            call.respond(HttpStatusCode.PayloadTooLarge, ErrorResponse(ErrorBody("HWL upload too large")))
+                            return@post
+                        } catch (_: ZipException) {
+                            call.respond(HttpStatusCode.BadRequest, ErrorResponse(ErrorBody("Invalid compressed data")))
+                            return@post
+                        } catch (_: EOFException) {
+                            // Truncated deflate stream
+                            call.respond(HttpStatusCode.BadRequest, ErrorResponse(ErrorBody("Invalid compressed data")))
+                            return@post
+                        }
+                        val result = requestHandler.handleUploadHwl(
+                            title = query["title"] ?: "",
+                            loop = loop ?: true,
+                            play = play ?: false,
+                            hwlData = hwlData,
+                            uploadSize = uploadSize
+                        )
+                        call.respond(result.status, result.body)
+                    }
                     post("/start_stream") {
                         val result = requestHandler.handleRequest("start_stream", call.receive<JsonElement>())
                         call.respond(result.status, result.body)
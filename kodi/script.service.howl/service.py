@@ -10,10 +10,18 @@ import time
 import queue
 import threading
 import base64
+import zlib
+import hashlib
+from collections import OrderedDict
 
 LOG_TAG = "Howl"
 REMOTE_PORT = 4695
 MAX_QUEUE_SIZE = 5 # Maximum pending API requests
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UNSUPPORTED_PROTOCOLS = ('pvr://', 'dvd://', 'bluray://')
+PLAYLIST_WARM_COUNT = 2 # Playlist items after the current one to prepare in the background
+# Funscript axes (besides the main actions) used by Howl, others are left out of cached payloads
+PLAYED_AXES = ("L1", "L2", "R0", "R1", "R2")
 
 def log(msg, level=xbmc.LOGINFO):
     xbmc.log(f"[{LOG_TAG}] {msg}", level)
@@ -26,6 +34,7 @@ class HowlAPI:
         self.timeout = 3
         self.auth_header = None
         self._update_auth_header()
+        self.upload_supported = True # Older Howl versions don't have /upload_hwl
         
         self.request_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
         self.callback_queue = queue.Queue()
@@ -34,6 +43,7 @@ class HowlAPI:
     
     def update_ip_address(self, new_ip):
         self.ip_address = new_ip
+        self.upload_supported = True
         
     def update_api_key(self, api_key):
         self.api_key = api_key
@@ -90,6 +100,72 @@ class HowlAPI:
             log(f"Unexpected API error: {str(e)}", xbmc.LOGERROR)
         return False
         
+    @staticmethod
+    def _compressed_chunks(content):
+        """Compress content a chunk at a time, so the upload is never built as one big string"""
+        compressor = zlib.compressobj()
+        view = memoryview(content)
+        for start in range(0, len(view), UPLOAD_CHUNK_SIZE):
+            chunk = compressor.compress(view[start:start + UPLOAD_CHUNK_SIZE])
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+
+    def _send_upload(self, data, timeout=None):
+        """
+        Send a HWL file as a compressed binary upload (chunked transfer encoding), instead of
+        base64 inside JSON. Falls back to /load_hwl if the device doesn't support uploads.
+        """
+        if not self.upload_supported:
+            return self._send_json_hwl(data, timeout)
+        if timeout is None:
+            timeout = self.timeout
+        query = urllib.parse.urlencode({"title": data["title"]})
+        url = f"http://{self.ip_address}:{self.port}/upload_hwl?{query}"
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Encoding': 'deflate',
+            'Transfer-Encoding': 'chunked'
+        }
+        if self.auth_header:
+            headers['Authorization'] = self.auth_header
+
+        if data.get("compressed"):
+            view = memoryview(data["hwl"])
+            body = (view[start:start + UPLOAD_CHUNK_SIZE] for start in range(0, len(view), UPLOAD_CHUNK_SIZE))
+        else:
+            body = self._compressed_chunks(data["hwl"])
+        req = urllib.request.Request(url, data=body, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                response.read()
+                if response.status == 200:
+                    log(f"API request to {url} succeeded")
+                    return True
+                else:
+                    log(f"API request to {url} failed with status {response.status}", xbmc.LOGERROR)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                log("Howl device does not support HWL uploads, falling back to load_hwl")
+                self.upload_supported = False
+                return self._send_json_hwl(data, timeout)
+            log(f"API request to {url} failed: {str(e)}", xbmc.LOGERROR)
+        except urllib.error.URLError as e:
+            log(f"API request to {url} failed: {str(e)}", xbmc.LOGERROR)
+        except Exception as e:
+            log(f"Unexpected API error: {str(e)}", xbmc.LOGERROR)
+        return False
+
+    def _send_json_hwl(self, data, timeout=None):
+        # HWL is binary, so we base64 encode it for JSON transport
+        hwl = zlib.decompress(data["hwl"]) if data.get("compressed") else data["hwl"]
+        encoded_content = base64.b64encode(hwl).decode('utf-8')
+        json_data = {
+            "title": data["title"],
+            "hwl": encoded_content
+        }
+        return self._send_request("/load_hwl", json_data, timeout)
+
     def _worker(self):
         """Worker thread processing API requests"""
         while True:
@@ -102,7 +178,10 @@ class HowlAPI:
                 endpoint, data, timeout, callback = item
                 
                 # Process request
-                success = self._send_request(endpoint, data, timeout)
+                if endpoint == "/upload_hwl":
+                    success = self._send_upload(data, timeout)
+                else:
+                    success = self._send_request(endpoint, data, timeout)
                 
                 # Queue callback for main thread if provided
                 if callback is not None:
@@ -159,22 +238,196 @@ class HowlAPI:
         }
         return self._enqueue_request("/load_funscript", data, callback, timeout=6)
     
-    def load_hwl(self, title, hwl_content, callback=None):
-        # HWL is binary, so we base64 encode it for JSON transport
-        encoded_content = base64.b64encode(hwl_content).decode('utf-8')
+    def load_hwl(self, title, hwl_content, callback=None, compressed=False):
+        # Encoded on the worker thread, as a compressed upload where the device supports it.
+        # If compressed, hwl_content is already zlib compressed (e.g. from the payload cache).
         data = {
             "title": title,
-            "hwl": encoded_content
+            "hwl": hwl_content,
+            "compressed": compressed
         }
-        return self._enqueue_request("/load_hwl", data, callback, timeout=6)
+        return self._enqueue_request("/upload_hwl", data, callback, timeout=6)
+
+def find_haptics_file(video_path):
+    """Return (file type, path) of the haptics file for a video, or None. HWL files take priority."""
+    if any(video_path.startswith(proto) for proto in UNSUPPORTED_PROTOCOLS):
+        return None
+    base, _ = os.path.splitext(video_path)
+    for file_type in ('hwl', 'funscript'):
+        path = f"{base}.{file_type}"
+        if xbmcvfs.exists(path):
+            return file_type, path
+    return None
+
+def read_haptics_file(file_type, file_path):
+    # xbmcvfs.File does not support the standard 'rb' binary mode flag
+    # We open in text mode 'r' and use specific read methods for content type.
+    with xbmcvfs.File(file_path, 'r') as f:
+        if file_type == 'hwl':
+            # readBytes returns a bytearray
+            return f.readBytes()
+        else:
+            # read returns a string
+            return f.read()
+
+def compact_funscript(content):
+    """
+    Reduce a funscript to just what Howl uses: the actions (at and pos only) and the axes it plays,
+    without whitespace. Raises ValueError or KeyError if it isn't a valid funscript.
+    """
+    funscript = json.loads(content)
+    compact = {"actions": [{"at": a["at"], "pos": a["pos"]} for a in funscript["actions"]]}
+    axes = [
+        {"id": axis["id"], "actions": [{"at": a["at"], "pos": a["pos"]} for a in axis["actions"]]}
+        for axis in funscript.get("axes") or [] if axis.get("id") in PLAYED_AXES
+    ]
+    if axes:
+        compact["axes"] = axes
+    return json.dumps(compact, separators=(',', ':'))
+
+class PayloadCache:
+    """
+    Local cache of haptics files converted to compact payloads, so that replaying a video
+    doesn't read its script from a (possibly slow network) share again. Funscripts are stored as
+    compact_funscript JSON and HWL files as they are, both zlib compressed (the form HWL uploads
+    are sent in). Entries are keyed by the script's path, modification time and size, so an edited
+    script is converted again. The least recently used entries are removed to keep the cache under
+    max_bytes. Used from the player and the background warming thread.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # file name: size, least recently used first
+        self.total_bytes = 0
+        self.warm_pending = []
+        self.warm_thread = None
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                # Left by an interrupted write
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        # Call with lock held
+        while self.entries and self.total_bytes > self.max_bytes:
+            name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                log(f"Failed to remove cached payload {name}: {e}", xbmc.LOGWARNING)
+
+    @staticmethod
+    def _entry_name(file_type, file_path):
+        stat = xbmcvfs.Stat(file_path)
+        key = f"{file_path}|{stat.st_mtime()}|{stat.st_size()}"
+        return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.{file_type}.z"
+
+    def _get(self, name):
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path) # Keeps the LRU order across restarts
+            return payload
+        except OSError:
+            # Removed from under us, convert it again
+            with self.lock:
+                self.total_bytes -= self.entries.pop(name, 0)
+            return None
+
+    def _put(self, name, payload):
+        path = os.path.join(self.directory, name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.total_bytes += len(payload) - self.entries.pop(name, 0)
+            self.entries[name] = len(payload)
+            self._evict()
+
+    def load(self, file_type, file_path):
+        """
+        Return the zlib compressed payload for a haptics file, from the cache if possible.
+        A funscript that can't be compacted is returned as it is (compressed, but not cached),
+        so Howl reports the problem as usual.
+        """
+        name = self._entry_name(file_type, file_path)
+        payload = self._get(name)
+        if payload is not None:
+            log(f"Loaded {file_path} from cache", xbmc.LOGDEBUG)
+            return payload
+        content = read_haptics_file(file_type, file_path)
+        if file_type == 'hwl':
+            payload = zlib.compress(bytes(content))
+        else:
+            try:
+                payload = zlib.compress(compact_funscript(content).encode('utf-8'))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                log(f"Not caching {file_path}, it is not a valid funscript: {e}", xbmc.LOGWARNING)
+                return zlib.compress(content.encode('utf-8'))
+        try:
+            self._put(name, payload)
+            log(f"Cached {file_path} ({len(payload)} bytes)", xbmc.LOGDEBUG)
+        except OSError as e:
+            log(f"Failed to cache {file_path}: {e}", xbmc.LOGWARNING)
+        return payload
+
+    def warm(self, video_paths):
+        """Prepare the payloads for these videos in a background thread, replacing any not yet started"""
+        with self.lock:
+            self.warm_pending = list(video_paths)
+            if self.warm_thread is not None and self.warm_thread.is_alive():
+                return
+            self.warm_thread = threading.Thread(target=self._warm_worker, daemon=True)
+            self.warm_thread.start()
+
+    def _warm_worker(self):
+        while True:
+            with self.lock:
+                if not self.warm_pending:
+                    return
+                video_path = self.warm_pending.pop(0)
+            try:
+                haptics = find_haptics_file(video_path)
+                if haptics is not None:
+                    self.load(*haptics)
+            except Exception as e:
+                log(f"Failed to prepare haptics for {video_path}: {e}", xbmc.LOGWARNING)
 
 class HowlPlayer(xbmc.Player):
-    def __init__(self, api, sync_delay):
+    def __init__(self, api, sync_delay, cache, warm_enabled):
         super().__init__()
         self.active = False
         self.paused = False
         self.api = api
         self.sync_delay = sync_delay
+        self.cache = cache
+        self.warm_enabled = warm_enabled
         self.sync_requested_time = None  # Monotonic timestamp of last sync request
         self.sync_start_player = False   # Whether to start player with sync
         self.current_video_path = None   # Track current video for callback validation
@@ -235,15 +488,11 @@ class HowlPlayer(xbmc.Player):
         file_type: 'funscript' or 'hwl'
         """
         try:
-            # xbmcvfs.File does not support the standard 'rb' binary mode flag
-            # We open in text mode 'r' and use specific read methods for content type.
-            with xbmcvfs.File(file_path, 'r') as f:
-                if file_type == 'hwl':
-                    # readBytes returns a bytearray
-                    content = f.readBytes()
-                else:
-                    # read returns a string
-                    content = f.read()
+            compressed = self.cache.enabled
+            if compressed:
+                content = self.cache.load(file_type, file_path)
+            else:
+                content = read_haptics_file(file_type, file_path)
             
             base_name = os.path.basename(file_path)
             title = os.path.splitext(base_name)[0]
@@ -251,8 +500,10 @@ class HowlPlayer(xbmc.Player):
             callback = lambda success: self.haptics_loaded_callback(file_type, video_path, success)
             queued = False
             if file_type == 'hwl':
-                queued = self.api.load_hwl(title, content, callback=callback)
+                queued = self.api.load_hwl(title, content, callback=callback, compressed=compressed)
             else:
+                if compressed:
+                    content = zlib.decompress(content).decode('utf-8')
                 queued = self.api.load_funscript(title, content, callback=callback)
                 
             if not queued:
@@ -281,26 +532,33 @@ class HowlPlayer(xbmc.Player):
                 return
             video_path = self.getPlayingFile()
             self.current_video_path = video_path
-            if any(video_path.startswith(proto) for proto in ('pvr://', 'dvd://', 'bluray://')):
+            if any(video_path.startswith(proto) for proto in UNSUPPORTED_PROTOCOLS):
                 return
             
-            base, _ = os.path.splitext(video_path)
-            hwl_path = base + ".hwl"
-            funscript_path = base + ".funscript"
-            
-            # Prioritize HWL file if it exists
-            if xbmcvfs.exists(hwl_path):
-                log(f"HWL file found for {video_path}")
-                self.load_haptics_file('hwl', hwl_path, video_path)
-            elif xbmcvfs.exists(funscript_path):
-                log(f"Funscript found for {video_path}")
-                self.load_haptics_file('funscript', funscript_path, video_path)
-            else:
+            haptics = find_haptics_file(video_path)
+            if haptics is None:
                 log(f"No haptics file found for {video_path}")
-                return
+            else:
+                file_type, file_path = haptics
+                log(f"{'HWL file' if file_type == 'hwl' else 'Funscript'} found for {video_path}")
+                self.load_haptics_file(file_type, file_path, video_path)
+            self.warm_playlist()
         except Exception as e:
             log(f"onAVStarted crashed: {str(e)}", xbmc.LOGERROR)
     
+    def warm_playlist(self):
+        """Prepare the haptics for the next few videos in the playlist, so they start quickly"""
+        if not self.cache.enabled or not self.warm_enabled:
+            return
+        playlist = xbmc.PlayList(xbmc.PLAYLIST_VIDEO)
+        position = playlist.getposition()
+        if position < 0:
+            return
+        end = min(position + 1 + PLAYLIST_WARM_COUNT, playlist.size())
+        video_paths = [playlist[i].getPath() for i in range(position + 1, end)]
+        if video_paths:
+            self.cache.warm(video_paths)
+    
     def stopped(self):
         active = self.active
         self.clear()
@@ -342,7 +600,9 @@ class HowlService(xbmc.Monitor):
         super().__init__()
         self._get_settings()
         self.api = HowlAPI(self.ip_address, self.api_key)
-        self.player = HowlPlayer(self.api, self.sync_delay)
+        cache_dir = os.path.join(xbmcvfs.translatePath(xbmcaddon.Addon().getAddonInfo('profile')), "cache")
+        self.cache = PayloadCache(cache_dir, self.cache_size * 1024 * 1024)
+        self.player = HowlPlayer(self.api, self.sync_delay, self.cache, self.warm_enabled)
         log("Service started")
     
     def _get_settings(self):
@@ -355,11 +615,19 @@ class HowlService(xbmc.Monitor):
         except (TypeError, ValueError):
             self.sync_delay = 500
             log(f"Using default sync_delay: {self.sync_delay}", xbmc.LOGWARNING)
+        # Payload cache size in MB, 0 disables the cache
+        try:
+            self.cache_size = int(addon.getSetting("cache_size"))
+        except (TypeError, ValueError):
+            self.cache_size = 100
+            log(f"Using default cache_size: {self.cache_size}", xbmc.LOGWARNING)
+        self.warm_enabled = addon.getSettingBool("warm_playlist")
         
     def onSettingsChanged(self):
         old_ip = self.ip_address
         old_api_key = self.api_key
         old_delay = self.sync_delay
+        old_cache_size = self.cache_size
         self._get_settings()
         
         if self.ip_address != old_ip:
@@ -374,6 +642,12 @@ class HowlService(xbmc.Monitor):
             self.player.update_sync_delay(self.sync_delay)
             log(f"Updated sync_delay to: {self.sync_delay}ms")
             
+        if self.cache_size != old_cache_size:
+            self.cache.set_max_bytes(self.cache_size * 1024 * 1024)
+            log(f"Updated cache_size to: {self.cache_size}MB")
+            
+        self.player.warm_enabled = self.warm_enabled
+            
     def run(self):
         """Main service loop with periodic sync checks"""
         while not self.abortRequested():
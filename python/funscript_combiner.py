@@ -30,12 +30,18 @@ You can specify the "--delete" command line flag to nuke the original funscripts
 if you like to live dangerously.
 
 The script can also be used to add additional axes to an existing multi-axis main funscript.
+
+Large libraries can be combined with "--recursive", which also searches subdirectories (each
+directory's files are grouped separately). Sets are combined in parallel, and sets whose
+combined file is newer than all of their source files are skipped, so re-running after adding
+a few scripts only combines the new ones. Pass "--force" to combine everything again.
 """
 
 import argparse
-import sys
 import json
-import uuid
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from collections import defaultdict
 
@@ -54,9 +60,16 @@ AXIS_MAP = {
     'lube': 'A2'
 }
 
-def scan_and_group_files(scripts_dir: Path):
-    """Scans the directory for funscripts and groups them logically by their base filename."""
-    all_files = [f for f in scripts_dir.iterdir() if f.is_file()]
+class CombineError(Exception):
+    """A group could not be combined, and the run should fail"""
+
+def scan_and_group_files(scripts_dir: Path, recursive: bool = False):
+    """
+    Scans the directory (and its subdirectories if recursive) for funscripts and groups them
+    logically by their directory and base filename.
+    """
+    candidates = scripts_dir.rglob('*') if recursive else scripts_dir.iterdir()
+    all_files = sorted(f for f in candidates if f.is_file())
     groups = defaultdict(dict)
 
     for f in all_files:
@@ -80,12 +93,12 @@ def scan_and_group_files(scripts_dir: Path):
             if axis_name in AXIS_MAP:
                 axis_id = AXIS_MAP[axis_name]
                 base_name = p.stem
-                groups[base_name][axis_id] = f
+                groups[f.parent / base_name][axis_id] = f
                 continue
 
         # If not a recognized axis suffix, it must be a main script
         base_name = stem
-        groups[base_name]['main'] = f
+        groups[f.parent / base_name]['main'] = f
 
     return all_files, groups
 
@@ -111,133 +124,178 @@ def check_for_orphans(all_files, groups):
 
     return orphans
 
-def prepare_data_for_compact_actions(data):
+def write_json(f, obj, level=0, indent=2):
     """
-    Replaces 'actions' lists with unique string placeholders and returns
-    a mapping of placeholders to compact JSON strings.
+    Writes obj to f as JSON indented like json.dump(indent=2), except that any 'actions' lists
+    are kept compact on a single line, as funscript editors expect.
     """
-    placeholders = {}
-
-    def walk(obj):
-        if isinstance(obj, dict):
-            for k, v in obj.items():
-                if k == 'actions' and isinstance(v, list):
-                    compact = json.dumps(v, separators=(',', ':'))
-                    placeholder = f"__ACTIONS_{uuid.uuid4().hex}__"
-                    placeholders[placeholder] = compact
-                    obj[k] = placeholder
-                else:
-                    walk(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                walk(item)
-
-    walk(data)
-    return placeholders
-
-def combine_scripts(groups, axis_order, delete_originals=False, overwrite_axes=False):
-    """Iterates through valid groups, combines the data, and writes the output files."""
-    valid_groups_found = False
+    if isinstance(obj, dict) and obj:
+        inner = ' ' * (indent * (level + 1))
+        f.write('{')
+        for i, (k, v) in enumerate(obj.items()):
+            f.write(f"{',' if i else ''}\n{inner}{json.dumps(k)}: ")
+            if k == 'actions' and isinstance(v, list):
+                f.write(json.dumps(v, separators=(',', ':')))
+            else:
+                write_json(f, v, level + 1, indent)
+        f.write('\n' + ' ' * (indent * level) + '}')
+    elif isinstance(obj, list) and obj:
+        inner = ' ' * (indent * (level + 1))
+        f.write('[')
+        for i, v in enumerate(obj):
+            f.write(f"{',' if i else ''}\n{inner}")
+            write_json(f, v, level + 1, indent)
+        f.write('\n' + ' ' * (indent * level) + ']')
+    else:
+        f.write(json.dumps(obj))
+
+def combined_filename(base_path: Path) -> Path:
+    return base_path.parent / f"{base_path.name}.combined.funscript"
+
+def is_up_to_date(base_path: Path, group) -> bool:
+    """Whether the group's combined script exists and is newer than all of its source files."""
+    try:
+        combined_mtime = combined_filename(base_path).stat().st_mtime_ns
+        return all(f.stat().st_mtime_ns < combined_mtime for f in group.values())
+    except FileNotFoundError:
+        return False
+
+def load_json(path: Path, description: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise CombineError(f"Error: Failed to parse JSON in {description} '{path.name}': {e}")
+    except Exception as e:
+        raise CombineError(f"Error: Failed to read {description} '{path.name}': {e}")
+    if not isinstance(data, dict):
+        raise CombineError(f"Error: {description.capitalize()} '{path.name}' is not a funscript (expected a JSON object)")
+    return data
+
+def combine_group(base_path: Path, group, axis_order, overwrite_axes=False, simplify=None):
+    """
+    Combines one group and writes its output file. Returns the messages to report and whether
+    the combined script was written, raises CombineError if the run should fail.
+    Runs in a worker process, so reports messages rather than printing them.
+    """
+    messages = []
     axis_order_map = {axis_id: i for i, axis_id in enumerate(axis_order)}
-
-    for base_name, group in groups.items():
-        if 'main' not in group or len(group) <= 1:
-            continue
-
-        valid_groups_found = True
-        main_file = group['main']
-
-        try:
-            with open(main_file, 'r', encoding='utf-8') as f:
-                main_data = json.load(f)
-        except json.JSONDecodeError as e:
-            print(f"Error: Failed to parse JSON in main script '{main_file.name}': {e}")
-            sys.exit(1)
-        except Exception as e:
-            print(f"Error: Failed to read main script '{main_file.name}': {e}")
-            sys.exit(1)
-
-        axes_data = []
-        for axis_id in axis_order:
-            if axis_id in group:
-                axis_file = group[axis_id]
-                try:
-                    with open(axis_file, 'r', encoding='utf-8') as f:
-                        axis_json = json.load(f)
-
-                    axes_data.append({
-                        "id": axis_id,
-                        "actions": axis_json.get("actions", [])
-                    })
-                except json.JSONDecodeError as e:
-                    print(f"Error: Failed to parse JSON in axis script '{axis_file.name}': {e}")
-                    sys.exit(1)
-                except Exception as e:
-                    print(f"Error: Failed to read axis script '{axis_file.name}': {e}")
-                    sys.exit(1)
-
-        # Handle existing axes in main script
-        existing_axes = main_data.get("axes", [])
-        if not isinstance(existing_axes, list):
-            existing_axes = []
-
-        # Use a dictionary to easily manage overwrites while preserving order of insertion
-        merged_axes_map = {}
-        for axis in existing_axes:
-            if isinstance(axis, dict) and "id" in axis:
-                merged_axes_map[axis["id"]] = axis
-
-        skip_group = False
-        for new_axis in axes_data:
-            if new_axis["id"] in merged_axes_map:
-                if not overwrite_axes:
-                    print(f"Error: Axis ID '{new_axis['id']}' from '{group[new_axis['id']].name}' clashes with existing axis in main script '{main_file.name}'. Skipping group. Pass --overwrite-axes if you want to destructively merge.")
-                    skip_group = True
-                    break
-                else:
-                    print(f"Info: Overwriting existing axis '{new_axis['id']}' in '{main_file.name}' with data from '{group[new_axis['id']].name}'.")
-            merged_axes_map[new_axis["id"]] = new_axis
-
-        if skip_group:
-            continue
-
-        combined_axes = list(merged_axes_map.values())
-
-        # Sort axes: known axes follow AXIS_ORDER, unknown custom axes are pushed to the end
-        combined_axes.sort(key=lambda x: axis_order_map.get(x.get("id"), len(axis_order)))
-
-        main_data["axes"] = combined_axes
-
-        # Prepare compact actions arrays to keep them on a single line
-        placeholders = prepare_data_for_compact_actions(main_data)
-
-        # Serialize to indented JSON
-        json_str = json.dumps(main_data, indent=2)
-
-        # Inject compact actions arrays
-        for p, c in placeholders.items():
-            json_str = json_str.replace(f'"{p}"', c)
-
-        combined_filename = main_file.parent / f"{base_name}.combined.funscript"
+    main_file = group['main']
+    main_data = load_json(main_file, "main script")
+
+    axes_data = []
+    for axis_id in axis_order:
+        if axis_id in group:
+            axis_json = load_json(group[axis_id], "axis script")
+            axes_data.append({
+                "id": axis_id,
+                "actions": axis_json.get("actions", [])
+            })
+
+    # Handle existing axes in main script
+    existing_axes = main_data.get("axes", [])
+    if not isinstance(existing_axes, list):
+        existing_axes = []
+
+    # Use a dictionary to easily manage overwrites while preserving order of insertion
+    merged_axes_map = {}
+    for axis in existing_axes:
+        if isinstance(axis, dict) and "id" in axis:
+            merged_axes_map[axis["id"]] = axis
+
+    for new_axis in axes_data:
+        if new_axis["id"] in merged_axes_map:
+            if not overwrite_axes:
+                messages.append(f"Error: Axis ID '{new_axis['id']}' from '{group[new_axis['id']].name}' clashes with existing axis in main script '{main_file.name}'. Skipping group. Pass --overwrite-axes if you want to destructively merge.")
+                return messages, False
+            else:
+                messages.append(f"Info: Overwriting existing axis '{new_axis['id']}' in '{main_file.name}' with data from '{group[new_axis['id']].name}'.")
+        merged_axes_map[new_axis["id"]] = new_axis
+
+    combined_axes = list(merged_axes_map.values())
+
+    # Sort axes: known axes follow AXIS_ORDER, unknown custom axes are pushed to the end
+    combined_axes.sort(key=lambda x: axis_order_map.get(x.get("id"), len(axis_order)))
+
+    main_data["axes"] = combined_axes
+
+    if simplify is not None:
+        # Imported here, as simplifying needs NumPy and combining doesn't
+        from funscript_simplify import format_report, simplify_funscript
+        messages.append(f"Info: Simplified '{main_file.name}' (max error {simplify}):")
+        messages.extend(format_report(simplify_funscript(main_data, simplify)))
+
+    # Written to a temporary file and moved into place, so an interrupted run never leaves
+    # a partial combined script that looks newer than its sources
+    output = combined_filename(base_path)
+    temp_output = output.with_name(output.name + '.tmp')
+    try:
+        with open(temp_output, 'w', encoding='utf-8') as f:
+            write_json(f, main_data)
+        os.replace(temp_output, output)
+    except Exception as e:
+        temp_output.unlink(missing_ok=True)
+        raise CombineError(f"Error: Failed to write combined script '{output.name}': {e}")
+
+    messages.append(f"Successfully created: {output}")
+    return messages, True
+
+def delete_group(base_path: Path, group):
+    for f in group.values():
         try:
-            with open(combined_filename, 'w', encoding='utf-8') as f:
-                f.write(json_str)
+            f.unlink()
         except Exception as e:
-            print(f"Error: Failed to write combined script '{combined_filename.name}': {e}")
-            sys.exit(1)
-
-        print(f"Successfully created: {combined_filename.name}")
+            print(f"Warning: Failed to delete '{f.name}': {e}")
+    print(f"Deleted {len(group)} original source files for '{base_path}'.")
 
-        if delete_originals:
-            for f in group.values():
-                try:
-                    f.unlink()
-                except Exception as e:
-                    print(f"Warning: Failed to delete '{f.name}': {e}")
-            print(f"Deleted {len(group)} original source files for '{base_name}'.")
-
-    if not valid_groups_found:
+def combine_scripts(groups, axis_order, delete_originals=False, overwrite_axes=False, force=False, jobs=None,
+                    simplify=None):
+    """
+    Combines all valid groups, in parallel across jobs worker processes (default one per CPU).
+    If simplify is given, the played axes are simplified to within that max error (see funscript_simplify).
+    Groups whose combined script is newer than all of their source files are skipped unless force
+    is set. Exits with an error if any group failed, after the others have been combined.
+    """
+    valid_groups = {base_path: group for base_path, group in groups.items() if 'main' in group and len(group) > 1}
+    if not valid_groups:
         print("No valid funscript sets found to combine.")
+        return
+
+    pending = {}
+    for base_path, group in valid_groups.items():
+        if not force and is_up_to_date(base_path, group):
+            print(f"Up to date: {combined_filename(base_path)}")
+            if delete_originals:
+                delete_group(base_path, group)
+        else:
+            pending[base_path] = group
+
+    failed = False
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            base_path: executor.submit(combine_group, base_path, group, axis_order, overwrite_axes, simplify)
+            for base_path, group in pending.items()
+        }
+        # Reported in scan order, whichever order the workers finish in
+        for base_path, future in futures.items():
+            try:
+                messages, combined = future.result()
+            except CombineError as e:
+                print(e)
+                failed = True
+                continue
+            except Exception as e:
+                # Anything unexpected only fails this set, the others are still combined
+                print(f"Error: Failed to combine '{base_path}': {e!r}")
+                failed = True
+                continue
+            for message in messages:
+                print(message)
+            if combined and delete_originals:
+                delete_group(base_path, pending[base_path])
+
+    if failed:
+        sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(description="Batch combine single-axis JSON funscripts into multi-axis funscripts.")
@@ -257,6 +315,28 @@ def main():
         action="store_true",
         help="Overwrite existing axes in the main script if an axis ID clashes."
     )
+    parser.add_argument(
+        "-r", "--recursive",
+        action="store_true",
+        help="Also combine funscripts in subdirectories (each directory's scripts are grouped separately)."
+    )
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Combine every set, even if its combined script is newer than all of its source files."
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of sets to combine in parallel (default: one per CPU)."
+    )
+    parser.add_argument(
+        "-s", "--simplify",
+        type=float,
+        metavar="MAX_ERROR",
+        help="Remove actions that change how Howl plays each axis by less than MAX_ERROR percent (see funscript_simplify.py, needs NumPy). Use with --force to apply to sets already combined."
+    )
     args = parser.parse_args()
 
     scripts_dir = Path(args.directory)
@@ -266,7 +346,7 @@ def main():
         sys.exit(1)
 
     # 1. Initial file scan and grouping
-    all_files, groups = scan_and_group_files(scripts_dir)
+    all_files, groups = scan_and_group_files(scripts_dir, args.recursive)
 
     # 2. Check for orphaned funscripts
     orphans = check_for_orphans(all_files, groups)
@@ -274,11 +354,11 @@ def main():
     if orphans:
         print("Error: Found orphan funscript files that do not belong to a valid set (missing a main script or axes):")
         for o in orphans:
-            print(f"  - {o.name}")
+            print(f"  - {o.relative_to(scripts_dir)}")
         sys.exit(1)
 
     # 3. Combine valid groups and write output
-    combine_scripts(groups, AXIS_ORDER, args.delete, args.overwrite_axes)
+    combine_scripts(groups, AXIS_ORDER, args.delete, args.overwrite_axes, args.force, args.jobs, args.simplify)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Simplify funscripts by removing actions that make almost no difference to how Howl plays them.
+
+Some generated (especially multi-axis) scripts have an action every 10-20ms on every axis. Those
+are slow to upload and parse, but most of the actions lie on the smooth curve Howl draws through
+their neighbours anyway. This removes actions until removing any more would move the played
+position by more than --max-error (as a percentage of the axis's range, after Howl normalises it),
+measured against the same monotone cubic curve Howl plays.
+
+Only the axes Howl plays (L0, L1, L2, R0, R1, R2) are simplified, others are left as they are.
+Metadata and the layout of the file are kept, as funscript_combiner writes it.
+
+    python funscript_simplify.py example.funscript --out example.small.funscript --max-error 1
+
+The same simplification can be applied while combining, with funscript_combiner's --simplify option.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from funscript_combiner import write_json
+from libfunscript import SUPPORTED_AXES, axis_normalisation, parse_funscript, simplify_actions
+
+DEFAULT_MAX_ERROR = 1.0
+
+def simplify_funscript(data, max_error=DEFAULT_MAX_ERROR, normalise=True):
+    """
+    Simplifies the actions of each axis Howl plays in a decoded funscript, in place.
+    Returns a (axis id, actions before, actions after, max error) tuple for each simplified axis.
+    Axes that Howl would reject (too few actions etc.) are left alone.
+    """
+    reports = []
+    holders = [("L0", data)]
+    for axis in data.get("axes") or []:
+        # An L0 in the axes list is not played, the main actions are
+        if isinstance(axis, dict) and axis.get("id") != "L0":
+            holders.append((axis.get("id"), axis))
+
+    for axis_id, holder in holders:
+        actions = holder.get("actions")
+        if axis_id not in SUPPORTED_AXES or not isinstance(actions, list):
+            continue
+        try:
+            parsed = parse_funscript({"actions": actions})[0]
+            kept, error = simplify_actions(parsed.at, parsed.pos, max_error, axis_normalisation(axis_id, normalise))
+        except ValueError:
+            continue
+        holder["actions"] = [actions[i] for i in kept]
+        reports.append((axis_id, len(actions), len(kept), error))
+    return reports
+
+def format_report(reports):
+    return [f"  {axis_id}: {before} -> {after} actions, max error {error:.2f}"
+            for axis_id, before, after, error in reports]
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove actions from a funscript while keeping how Howl plays it within a maximum error.")
+    parser.add_argument("infile", help="The funscript to simplify")
+    parser.add_argument("--out", required=True, help="Output funscript (may be the same as the input)")
+    parser.add_argument(
+        "-e", "--max-error",
+        type=float,
+        default=DEFAULT_MAX_ERROR,
+        help=f"Maximum change in the played position, as a percentage of the axis's range (default: {DEFAULT_MAX_ERROR})"
+    )
+    parser.add_argument(
+        "--no-normalise",
+        action="store_true",
+        help="Measure the error without normalising axes (match Howl with its normalise setting off)"
+    )
+    args = parser.parse_args()
+
+    try:
+        with open(args.infile, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"Error: Failed to read funscript '{args.infile}': {e}")
+        sys.exit(1)
+    original_size = os.path.getsize(args.infile)
+
+    reports = simplify_funscript(data, args.max_error, not args.no_normalise)
+    if not reports:
+        print(f"Error: No axes in '{args.infile}' could be simplified.")
+        sys.exit(1)
+
+    temp_out = args.out + '.tmp'
+    with open(temp_out, 'w', encoding='utf-8') as f:
+        write_json(f, data)
+    os.replace(temp_out, args.out)
+
+    new_size = os.path.getsize(args.out)
+    print(f"{args.infile}: {original_size} -> {new_size} bytes ({100.0 * (1 - new_size / original_size):.1f}% smaller)")
+    for line in format_report(reports):
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,39 @@
+import asyncio
 import base64
+import http.client
+import inspect
+import io
 import json
-import urllib.request
+import select
+import socket
+import threading
 import urllib.error
+import urllib.parse
+import zlib
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from dataclasses import dataclass
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, BinaryIO, Iterator, List, Sequence, Tuple, Union
+
+from howlws import WebSocketConnection
+
+# A batched command's response: its JSON body, or the HowlAPIError it failed with
+BatchResult = Union[Dict[str, Any], "HowlAPIError"]
+
+# Endpoints that have the same effect however many times they are sent
+IDEMPOTENT_ENDPOINTS = frozenset({
+    "status", "available_activities", "start_player", "stop_player", "seek", "set_power", "set_freq_range",
+    "load_funscript", "load_hwl", "load_activity", "start_stream",
+})
+# Endpoints that toggle a setting when sent without a value, and set it when sent with one
+TOGGLE_ENDPOINTS = frozenset({"set_mute", "set_swap_channels", "set_auto_increase"})
+
+
+def is_idempotent(endpoint: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+    """Whether sending a command twice has the same effect as sending it once"""
+    if endpoint in TOGGLE_ENDPOINTS:
+        return payload is not None and payload.get("value") is not None
+    return endpoint in IDEMPOTENT_ENDPOINTS
 
 
 class HowlAPIError(Exception):
@@ -58,24 +88,134 @@ class HowlAPI:
     Reference implementation of the Howl Remote API for Python.
 
     Provides synchronous methods to control a remote Howl device.
+
+    Requests are sent over persistent HTTP/1.1 keep-alive connections, so that frequent calls
+    (e.g. from a control loop) don't pay for a new TCP connection every time. Connections that
+    the device has closed are replaced automatically, but a command that is not safe to repeat
+    (like increment_power) is never sent a second time if the device may already have received it.
+    The client may be shared between threads, each concurrent request uses its own connection.
+    Call close() (or use the client as a context manager) to close the idle connections when finished.
     """
 
-    def __init__(self, ip_address: str, api_key: str):
+    PORT = 4695
+
+    def __init__(self, ip_address: str, api_key: str, port: int = PORT,
+                 keep_alive: bool = True, max_idle_connections: int = 2):
         """
         Initialize the HowlAPI client.
 
         :param ip_address: The IP address of the remote Howl device.
         :param api_key: The alphanumeric API key for authentication.
+        :param port: Optional; the port of the remote API (default 4695).
+        :param keep_alive: Optional; reuse connections between requests (default true).
+                           If false, every request opens and closes its own connection.
+        :param max_idle_connections: Optional; the number of idle connections kept open for reuse (default 2).
         """
-        self.base_url = f"http://{ip_address}:4695"
+        self.ip_address = ip_address
+        self.port = port
+        self.base_url = f"http://{ip_address}:{self.port}"
         self.api_key = api_key
         self.timeout = 5
+        self.keep_alive = keep_alive
+        self.max_idle_connections = max_idle_connections
 
         self._headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
+        if not keep_alive:
+            self._headers["Connection"] = "close"
+        self._idle_connections: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close any idle connections. The client can still be used afterwards."""
+        with self._lock:
+            connections, self._idle_connections = self._idle_connections, []
+        for connection in connections:
+            connection.close()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        return http.client.HTTPConnection(self.ip_address, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _is_dropped(connection: http.client.HTTPConnection) -> bool:
+        """True if an idle connection has been closed by the device (its socket is readable, at end of file)"""
+        if connection.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _get_connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """Return an idle connection if there is one (and True), otherwise a new connection (and False)"""
+        with self._lock:
+            while self._idle_connections:
+                connection = self._idle_connections.pop()
+                if not self._is_dropped(connection):
+                    return connection, True
+                connection.close()
+        return self._new_connection(), False
+
+    def _release_connection(self, connection: http.client.HTTPConnection):
+        """Keep a connection whose response has been fully read for reuse, or close it"""
+        with self._lock:
+            if self.keep_alive and len(self._idle_connections) < self.max_idle_connections:
+                self._idle_connections.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _error_message(body: Any, default: str) -> str:
+        """Extract the message from an error response body, if it has the expected format"""
+        if isinstance(body, dict) and isinstance(body.get("error"), dict) and "message" in body["error"]:
+            return body["error"]["message"]
+        return default
+
+    def _send(self, connection: http.client.HTTPConnection, endpoint: str,
+              data: bytes) -> Tuple[http.client.HTTPResponse, bytes]:
+        """Send a POST request on a connection and read the complete response"""
+        connection.request("POST", f"/{endpoint}", body=data, headers=self._headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def _request_bytes(self, endpoint: str, data: bytes, headers: Optional[Dict[str, str]] = None) -> bytes:
+        """A complete POST request, for sending several at once on a connection"""
+        headers = self._headers if headers is None else headers
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        return (
+            f"POST /{endpoint} HTTP/1.1\r\nHost: {self.ip_address}:{self.port}\r\n{head}"
+            f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+        )
+
+    def _batch_result(self, status: int, data: bytes) -> BatchResult:
+        try:
+            return self._decode_response(status, data)
+        except HowlAPIError as e:
+            return e
+
+    def _decode_response(self, status: int, data: bytes) -> Dict[str, Any]:
+        """Return the JSON body of a response, or raise HowlAPIError for an error status"""
+        body = data.decode('utf-8')
+        if status >= 400:
+            error_message = body
+            try:
+                error_message = self._error_message(json.loads(body), body)
+            except (ValueError, json.JSONDecodeError):
+                # Error response did not have the expected JSON format
+                pass
+
+            raise HowlAPIError(status, error_message)
+        return json.loads(body)
 
     def _parse_status_response(self, json_data: Dict[str, Any]) -> StatusResponse:
         """Parses the raw JSON dictionary into StatusResponse dataclasses."""
@@ -114,29 +254,111 @@ class HowlAPI:
         :raises TimeoutError: On request timeout (5 seconds).
         :raises urllib.error.URLError: On network connectivity issues.
         """
-        url = f"{self.base_url}/{endpoint}"
-
         json_body = payload if payload is not None else {}
         data = json.dumps(json_body).encode('utf-8')
 
-        req = urllib.request.Request(url, data=data, headers=self._headers, method="POST")
+        connection, reused = self._get_connection()
+        try:
+            try:
+                response, response_data = self._send(connection, endpoint, data)
+            except (http.client.RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                if not reused or not is_idempotent(endpoint, payload):
+                    raise
+                # The device probably closed this connection while it was idle, try once more on a new one.
+                # It might have carried out the command first though, so only commands that are safe to repeat.
+                connection.close()
+                connection = self._new_connection()
+                response, response_data = self._send(connection, endpoint, data)
+        except TimeoutError:
+            connection.close()
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise urllib.error.URLError(e)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        return self._decode_response(response.status, response_data)
+
+    def _batch_bytes(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> bytes:
+        """The requests for a batch, all but the last keep the connection open even without keep_alive"""
+        open_headers = {name: value for name, value in self._headers.items() if name != "Connection"}
+        return b"".join(
+            self._request_bytes(endpoint, json.dumps(payload if payload is not None else {}).encode('utf-8'),
+                                None if i == len(commands) - 1 else open_headers)
+            for i, (endpoint, payload) in enumerate(commands)
+        )
+
+    def _pipeline(self, connection: http.client.HTTPConnection, data: bytes, count: int,
+                  responses: List[Tuple[int, bytes]]) -> bool:
+        """
+        Send several requests at once on a connection, then read their responses in order
+        into responses. Returns True if the device will close the connection afterwards.
+        """
+        if connection.sock is None:
+            connection.connect()
+        connection.sock.sendall(data)
+        # All the responses are read through one buffer, as each may arrive along with the next
+        reader = _PipelineReader(socket.SocketIO(connection.sock, 'rb'))
+        will_close = False
+        while len(responses) < count:
+            if will_close:
+                raise http.client.HTTPException(
+                    f"Connection closed after {len(responses)} of {count} batched commands")
+            response = http.client.HTTPResponse(_PipelineSocket(reader), method="POST")
+            response.begin()
+            responses.append((response.status, response.read()))
+            will_close = response.will_close
+        return will_close
 
+    def _request_batch(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[BatchResult]:
+        """
+        Internal helper to send several POST requests together on one connection (HTTP/1.1 pipelining),
+        without waiting for each response before sending the next.
+
+        :return: For each command, its raw JSON response or the HowlAPIError it failed with.
+        :raises TimeoutError: On request timeout (5 seconds).
+        :raises urllib.error.URLError: On network connectivity issues, some commands may have been carried out.
+        """
+        data = self._batch_bytes(commands)
+        responses: List[Tuple[int, bytes]] = []
+        connection, reused = self._get_connection()
         try:
-            with urllib.request.urlopen(req, timeout=self.timeout) as response:
-                response_data = response.read().decode('utf-8')
-                return json.loads(response_data)
-        except urllib.error.HTTPError as e:
-            body = e.read().decode('utf-8')
-            error_message = body
             try:
-                error_data = json.loads(body)
-                if "error" in error_data and "message" in error_data["error"]:
-                    error_message = error_data["error"]["message"]
-            except (ValueError, json.JSONDecodeError):
-                # Error response did not have the expected JSON format
-                pass
+                will_close = self._pipeline(connection, data, len(commands), responses)
+            except (http.client.RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                if not reused or responses or not all(is_idempotent(*command) for command in commands):
+                    raise
+                # The device probably closed this connection while it was idle, try once more on a new one
+                connection.close()
+                connection = self._new_connection()
+                will_close = self._pipeline(connection, data, len(commands), responses)
+        except TimeoutError:
+            connection.close()
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise urllib.error.URLError(e)
 
-            raise HowlAPIError(e.code, error_message)
+        if will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        return [self._batch_result(status, body) for status, body in responses]
+
+    def batch(self) -> "HowlBatch":
+        """
+        Collect several commands and send them together, see HowlBatch:
+
+            with api.batch() as b:
+                b.set_power(power_a=40, power_b=40)
+                b.set_freq_range(0.2, 0.8)
+                b.load_activity("CHAOS", play=True)
+            status = b.status()
+        """
+        return HowlBatch(self)
 
     def _post(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> StatusResponse:
         """
@@ -227,6 +449,117 @@ class HowlAPI:
             payload["play"] = play
         return self._post("load_hwl", payload)
 
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+
+    @staticmethod
+    def _upload_chunks(hwl: Union[bytes, BinaryIO], compress: bool, chunk_size: int) -> Iterator[bytes]:
+        """Read (and compress) HWL data a chunk at a time"""
+        compressor = zlib.compressobj() if compress else None
+        if isinstance(hwl, (bytes, bytearray, memoryview)):
+            view = memoryview(hwl)
+            chunks = (view[i:i + chunk_size] for i in range(0, len(view), chunk_size))
+        else:
+            chunks = iter(lambda: hwl.read(chunk_size), b"")
+        for chunk in chunks:
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield bytes(chunk)
+        if compressor is not None:
+            yield compressor.flush()
+
+    def upload_hwl(self, hwl: Union[bytes, str, BinaryIO], title: Optional[str] = None,
+                   loop: Optional[bool] = None, play: Optional[bool] = None,
+                   compress: bool = True, chunk_size: int = UPLOAD_CHUNK_SIZE) -> StatusResponse:
+        """
+        Load a HWL file into the player, sending it as a binary upload instead of base64 inside JSON.
+        Corresponds to POST /upload_hwl.
+
+        The HWL data is read, compressed and sent in chunks (HTTP chunked transfer encoding),
+        so a long file is never held in memory as one encoded string. Compared to load_hwl this saves
+        the third added by base64, and compression typically saves a fifth or more of what is left
+        (much more for files with silent or steady stretches). Needs a Howl version with the upload_hwl
+        endpoint, older versions answer HowlAPIError 404, in which case use load_hwl.
+
+        :param hwl: The raw binary content of the HWL file, a binary file object to read it from, or its filename.
+        :param title: Optional display title for the file.
+        :param loop: Optional; automatically loop when reaching the end (default true).
+        :param play: Optional; true to start playback immediately (default false).
+        :param compress: Optional; zlib compress the upload (default true).
+        :param chunk_size: Optional; bytes of HWL data read at a time (default 64KiB).
+        """
+        if isinstance(hwl, str):
+            with open(hwl, 'rb') as f:
+                return self.upload_hwl(f, title, loop, play, compress, chunk_size)
+
+        query = {}
+        if title is not None:
+            query["title"] = title
+        if loop is not None:
+            query["loop"] = "true" if loop else "false"
+        if play is not None:
+            query["play"] = "true" if play else "false"
+        path = "/upload_hwl"
+        if query:
+            path += "?" + urllib.parse.urlencode(query)
+        headers = dict(self._headers, **{"Content-Type": "application/octet-stream", "Transfer-Encoding": "chunked"})
+        if compress:
+            headers["Content-Encoding"] = "deflate"
+
+        # The body can't be replayed, so uploads always use a new connection rather than risk a stale one
+        connection = self._new_connection()
+        try:
+            connection.request("POST", path, body=self._upload_chunks(hwl, compress, chunk_size),
+                               headers=headers, encode_chunked=True)
+            response = connection.getresponse()
+            response_data = response.read()
+        except TimeoutError:
+            connection.close()
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            raise urllib.error.URLError(e)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        return self._parse_status_response(self._decode_response(response.status, response_data))
+
+    def start_stream(self, buffer_size: Optional[int] = None, title: Optional[str] = None) -> StatusResponse:
+        """
+        Switch the player to a live stream of pulses sent with stream_pulse, and start playback.
+        Corresponds to POST /start_stream.
+
+        :param buffer_size: Optional; the number of pulses the device buffers (default 4). When the buffer
+                            is full the oldest pulse is overwritten, when it is empty the last pulse repeats.
+        :param title: Optional display title for the stream.
+        """
+        payload = {}
+        if buffer_size is not None:
+            payload["buffer_size"] = buffer_size
+        if title is not None:
+            payload["title"] = title
+        return self._post("start_stream", payload)
+
+    def stream_pulse(self, pulses: Sequence[Any]) -> StatusResponse:
+        """
+        Add pulses to the buffer of a stream started with start_stream. The device plays 40 pulses per second.
+        Corresponds to POST /stream_pulse.
+
+        :param pulses: The pulses to add, each a libhwl Pulse or a (left_amp, right_amp, left_freq, right_freq)
+                       tuple (the HWL field order). All values range from 0.0 to 1.0, left is channel A.
+        """
+        return self._post("stream_pulse", {"pulses": [self._pulse_json(pulse) for pulse in pulses]})
+
+    @staticmethod
+    def _pulse_json(pulse: Any) -> Dict[str, float]:
+        if hasattr(pulse, "left_amp"):
+            left_amp, right_amp, left_freq, right_freq = pulse.left_amp, pulse.right_amp, pulse.left_freq, pulse.right_freq
+        else:
+            left_amp, right_amp, left_freq, right_freq = pulse
+        return {"ampA": float(left_amp), "ampB": float(right_amp), "freqA": float(left_freq), "freqB": float(right_freq)}
+
     def load_activity(self, name: str, play: Optional[bool] = None) -> StatusResponse:
         """
         Load one of Howl's built-in activities.
@@ -342,4 +675,545 @@ class HowlAPI:
         :param max: The maximum frequency value (0.0 to 1.0). Must be greater than min,
                     with a minimum difference of 0.01.
         """
-        return self._post("set_freq_range", {"min": min, "max": max})
\ No newline at end of file
+        return self._post("set_freq_range", {"min": min, "max": max})
+
+
+class _PipelineReader(io.BufferedReader):
+    """Buffered socket reader shared by several pipelined HTTPResponses, which each try to close it"""
+    def close(self):
+        pass
+
+
+class _PipelineSocket:
+    """Hands an existing reader to HTTPResponse, which expects a socket to call makefile() on"""
+    def __init__(self, reader: _PipelineReader):
+        self._reader = reader
+
+    def makefile(self, mode: str, *args, **kwargs) -> _PipelineReader:
+        return self._reader
+
+
+class HowlBatch(HowlAPI):
+    """
+    Commands for a client, collected and then sent together by batch().
+
+    Has the same command methods as the client (set_power, set_freq_range, load_activity...),
+    but they only record the command and return None. When the with block ends the commands are
+    sent in order without waiting for each response in turn: pipelined on one connection for HTTP,
+    or one after another on the connection for HowlWebSocketAPI. Nothing is sent if the block raises.
+
+    Afterwards results holds each command's raw JSON response, and status() parses the last one. If
+    any command failed, the first HowlAPIError is raised once all the responses are in (results
+    holds the error in place of that response). Over HTTP the device starts handling the commands
+    in order but may overlap them, use HowlWebSocketAPI where one command relies on the last.
+
+    With AsyncHowlAPI use "async with", the commands are still recorded without await.
+    """
+    def __init__(self, api: HowlAPI):
+        # Deliberately not HowlAPI.__init__, a batch records commands rather than connecting anywhere
+        self.api = api
+        self.commands: List[Tuple[str, Optional[Dict[str, Any]]]] = []
+        self.results: Optional[List[BatchResult]] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if inspect.iscoroutinefunction(self.api._request_batch):
+            raise TypeError("Use async with for an AsyncHowlAPI batch")
+        if exc_type is None:
+            self._finish(self.api._request_batch(self.commands))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._finish(await self.api._request_batch(self.commands))
+
+    def _finish(self, results: List[BatchResult]):
+        self.results = results
+        for result in results:
+            if isinstance(result, HowlAPIError):
+                raise result
+
+    def close(self):
+        pass
+
+    def _post(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        if self.results is not None:
+            raise RuntimeError("This batch has already been sent")
+        self.commands.append((endpoint, payload))
+
+    def available_activities(self) -> None:
+        self._post("available_activities")
+
+    def upload_hwl(self, *args, **kwargs):
+        raise TypeError("upload_hwl can't be batched, use load_hwl")
+
+    def batch(self):
+        raise TypeError("Batches can't be nested")
+
+    def status(self) -> StatusResponse:
+        """The device status from the last command's response"""
+        if not self.results:
+            raise RuntimeError("This batch has not been sent")
+        for result in reversed(self.results):
+            if isinstance(result, dict) and "player" in result:
+                return self._parse_status_response(result)
+        raise ValueError("No command in this batch returned the device status")
+
+
+class _WebSocketSession:
+    """A connected and authenticated WebSocket, with the requests still waiting for a response in send order"""
+    def __init__(self, connection: WebSocketConnection):
+        self.connection = connection
+        self.pending: deque = deque()  # (endpoint, Future) pairs
+        self.lock = threading.Lock()  # held while sending, so that pending stays in send order
+
+
+class HowlWebSocketAPI(HowlAPI):
+    """
+    Howl Remote API client using the WebSocket server (port 4696) instead of HTTP.
+
+    Provides the same methods as HowlAPI. It authenticates once, then sends every command over
+    a single connection, which avoids the per-request HTTP overhead for high rate control such as
+    power ramps or live sync. The device answers the commands on a connection in the order they
+    were sent, so responses are matched to requests in order (and checked against their endpoint).
+    A background thread receives the responses and answers the device's keep-alive pings.
+
+    The client may be shared between threads. It connects on the first request (or connect()),
+    and reconnects on the next request if the connection breaks. Call close() when finished.
+    """
+
+    PORT = 4696
+    PATH = "/ws"
+
+    def __init__(self, ip_address: str, api_key: str, port: int = PORT, http_port: int = HowlAPI.PORT):
+        """
+        Initialize the HowlWebSocketAPI client.
+
+        :param ip_address: The IP address of the remote Howl device.
+        :param api_key: The alphanumeric API key for authentication.
+        :param port: Optional; the port of the remote WebSocket API (default 4696).
+        :param http_port: Optional; the port of the remote HTTP API, used by upload_hwl (default 4695).
+        """
+        super().__init__(ip_address, api_key, port=port)
+        self.http_port = http_port
+        self._session: Optional[_WebSocketSession] = None
+        self._session_lock = threading.Lock()
+
+    def connect(self):
+        """
+        Connect and authenticate, if not already connected.
+
+        :raises HowlAPIError: If the API key is rejected.
+        :raises TimeoutError: On connection or authentication timeout (5 seconds).
+        :raises urllib.error.URLError: On network connectivity issues.
+        """
+        self._get_session()
+
+    def close(self):
+        """Close the connection, any requests still waiting for a response fail"""
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            self._end_session(session, ConnectionError("Connection closed by client"))
+        super().close()
+
+    def upload_hwl(self, hwl: Union[bytes, str, BinaryIO], title: Optional[str] = None,
+                   loop: Optional[bool] = None, play: Optional[bool] = None,
+                   compress: bool = True, chunk_size: int = HowlAPI.UPLOAD_CHUNK_SIZE) -> StatusResponse:
+        """Load a HWL file with a binary upload, see HowlAPI.upload_hwl. Uploads are always sent over HTTP."""
+        with HowlAPI(self.ip_address, self.api_key, port=self.http_port, keep_alive=False) as api:
+            api.timeout = self.timeout
+            return api.upload_hwl(hwl, title, loop, play, compress, chunk_size)
+
+    def _get_session(self) -> _WebSocketSession:
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._open_session()
+            return self._session
+
+    def _open_session(self) -> _WebSocketSession:
+        try:
+            connection = WebSocketConnection.connect(self.ip_address, self.port, self.PATH, self.timeout)
+        except TimeoutError:
+            raise
+        except OSError as e:
+            raise urllib.error.URLError(e)
+        try:
+            # The first message must be authentication, which is answered before any commands
+            connection.sock.settimeout(self.timeout)
+            connection.send_text(json.dumps({"api_key": self.api_key}))
+            reply = connection.recv_text()
+            connection.sock.settimeout(None)
+            if reply is None:
+                raise urllib.error.URLError("Connection closed during authentication")
+            response = json.loads(reply)
+            if response.get("status") != 200:
+                raise HowlAPIError(response.get("status", 0),
+                                   self._error_message(response.get("body"), "Authentication failed"))
+        except BaseException as e:
+            connection.close()
+            if isinstance(e, OSError) and not isinstance(e, (TimeoutError, urllib.error.URLError)):
+                raise urllib.error.URLError(e)
+            raise
+
+        session = _WebSocketSession(connection)
+        threading.Thread(target=self._receive_responses, args=(session,), daemon=True).start()
+        return session
+
+    def _end_session(self, session: _WebSocketSession, error: Exception):
+        """Close a session's connection and fail its outstanding requests"""
+        with self._session_lock:
+            if self._session is session:
+                self._session = None
+        session.connection.close()
+        with session.lock:
+            pending, session.pending = session.pending, deque()
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(urllib.error.URLError(error))
+
+    def _receive_responses(self, session: _WebSocketSession):
+        """Background thread: hand each response to the oldest request still waiting for one"""
+        error: Exception = ConnectionError("Connection closed by device")
+        try:
+            while True:
+                message = session.connection.recv_text()
+                if message is None:
+                    break
+                response = json.loads(message)
+                with session.lock:
+                    if not session.pending:
+                        continue
+                    endpoint, future = session.pending.popleft()
+                # Commands the device could not parse are answered with the endpoint "error"
+                if response.get("endpoint") not in (endpoint, "error"):
+                    error = ConnectionError(f"Response for {response.get('endpoint')} received while waiting for {endpoint}")
+                    future.set_exception(urllib.error.URLError(error))
+                    break
+                if not future.done():
+                    future.set_result((response.get("status", 0), response.get("body")))
+        except (OSError, ValueError) as e:
+            error = e
+        self._end_session(session, error)
+
+    def _submit(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[_WebSocketSession, Future]:
+        """Send a command without waiting, returning its session and a Future for (status, body)"""
+        session = self._get_session()
+        future: Future = Future()
+        message = json.dumps({"endpoint": endpoint, "params": payload if payload is not None else {}})
+        with session.lock:
+            session.pending.append((endpoint, future))
+            try:
+                session.connection.send_text(message)
+            except OSError as e:
+                session.pending.pop()
+                error = e
+            else:
+                return session, future
+        self._end_session(session, error)
+        raise urllib.error.URLError(error)
+
+    def _request(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Internal helper to send a command and return the raw JSON response body.
+
+        :param endpoint: The API endpoint name (e.g., 'start_player').
+        :param payload: Optional dictionary to send as the command parameters.
+        :return: Raw JSON dictionary on success.
+        :raises HowlAPIError: On 400-599 response statuses.
+        :raises TimeoutError: On response timeout (5 seconds).
+        :raises urllib.error.URLError: On network connectivity issues.
+        """
+        session, future = self._submit(endpoint, payload)
+        try:
+            status, body = future.result(self.timeout)
+        except FutureTimeoutError:
+            # Responses arrive in order, so nothing more can be received until this one is. Start afresh.
+            self._end_session(session, TimeoutError(f"No response to {endpoint}"))
+            raise TimeoutError(f"No response to {endpoint} within {self.timeout} seconds")
+        if status >= 400:
+            raise HowlAPIError(status, self._error_message(body, json.dumps(body)))
+        return body
+
+    def _request_batch(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[BatchResult]:
+        """
+        Internal helper to send several commands without waiting for each response in turn.
+
+        :return: For each command, its raw JSON response body or the HowlAPIError it failed with.
+        :raises TimeoutError: On response timeout (5 seconds per command).
+        :raises urllib.error.URLError: On network connectivity issues, some commands may have been carried out.
+        """
+        submitted = [(endpoint, *self._submit(endpoint, payload)) for endpoint, payload in commands]
+        results: List[BatchResult] = []
+        for endpoint, session, future in submitted:
+            try:
+                status, body = future.result(self.timeout)
+            except FutureTimeoutError:
+                self._end_session(session, TimeoutError(f"No response to {endpoint}"))
+                raise TimeoutError(f"No response to {endpoint} within {self.timeout} seconds")
+            if status >= 400:
+                results.append(HowlAPIError(status, self._error_message(body, json.dumps(body))))
+            else:
+                results.append(body)
+        return results
+
+
+class AsyncHowlAPI(HowlAPI):
+    """
+    asyncio version of the Howl Remote API client, using asyncio streams.
+
+    Provides the same methods as HowlAPI, but they must be awaited:
+
+        async with AsyncHowlAPI(ip_address, api_key) as api:
+            status = await api.set_power(power_a=50)
+
+    Any number of requests (to any number of devices) can be in flight on one event loop. Each device
+    gets a small pool of keep-alive connections, with max_connections requests sent concurrently and
+    the rest waiting for a free connection. Every call is limited to the client's timeout (5 seconds),
+    shorter per-call timeouts and cancellation work as usual, e.g. asyncio.wait_for(api.get_status(), 0.5).
+    A cancelled or timed out request closes its connection, so its late response can't be mistaken
+    for the answer to another request.
+    """
+
+    def __init__(self, ip_address: str, api_key: str, port: int = HowlAPI.PORT, max_connections: int = 4):
+        """
+        Initialize the AsyncHowlAPI client.
+
+        :param ip_address: The IP address of the remote Howl device.
+        :param api_key: The alphanumeric API key for authentication.
+        :param port: Optional; the port of the remote API (default 4695).
+        :param max_connections: Optional; the number of requests sent to the device at once (default 4).
+        """
+        super().__init__(ip_address, api_key, port=port, max_idle_connections=max_connections)
+        self.max_connections = max_connections
+        self._idle_streams: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._connection_slots: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    def close(self):
+        """Close any idle connections. The client can still be used afterwards."""
+        streams, self._idle_streams = self._idle_streams, []
+        for _, writer in streams:
+            writer.close()
+        super().close()
+
+    async def aclose(self):
+        """Close any idle connections and wait for them to finish closing"""
+        streams, self._idle_streams = self._idle_streams, []
+        for _, writer in streams:
+            writer.close()
+        for _, writer in streams:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _open_stream(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await asyncio.open_connection(self.ip_address, self.port)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer
+
+    async def _exchange(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        endpoint: str, data: bytes) -> Tuple[int, bytes, bool]:
+        """Send a POST request on a connection and read the response, returning (status, body, will close)"""
+        writer.write(self._request_bytes(endpoint, data))
+        await writer.drain()
+        return await self._read_response(reader)
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader) -> Tuple[int, bytes, bool]:
+        """Read a response from a connection, returning (status, body, will close)"""
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status, *_ = status_line.decode('latin-1').split(None, 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        will_close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip any trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            will_close = True
+        return int(status), body, will_close
+
+    def _take_idle_stream(self) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """Return an idle connection that the device hasn't closed, if there is one"""
+        while self._idle_streams:
+            reader, writer = self._idle_streams.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _request_on_pool(self, endpoint: str, data: bytes, idempotent: bool) -> Tuple[int, bytes]:
+        stream = self._take_idle_stream()
+        reused = stream is not None
+        reader, writer = stream if reused else await self._open_stream()
+        try:
+            try:
+                status, body, will_close = await self._exchange(reader, writer, endpoint, data)
+            except (http.client.RemoteDisconnected, asyncio.IncompleteReadError,
+                    ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                if not reused or not idempotent:
+                    raise
+                # The device probably closed this connection while it was idle, try once more on a new one
+                writer.close()
+                reader, writer = await self._open_stream()
+                status, body, will_close = await self._exchange(reader, writer, endpoint, data)
+        except BaseException:
+            # Includes cancellation, the connection is in an unknown state
+            writer.close()
+            raise
+
+        if will_close or len(self._idle_streams) >= self.max_idle_connections:
+            writer.close()
+        else:
+            self._idle_streams.append((reader, writer))
+        return status, body
+
+    async def _pipeline(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Tuple[int, bytes]]:
+        """Send several requests at once on one of the pool's connections, then read their responses in order"""
+        stream = self._take_idle_stream()
+        reused = stream is not None
+        reader, writer = stream if reused else await self._open_stream()
+        idempotent = all(is_idempotent(*command) for command in commands)
+        responses: List[Tuple[int, bytes]] = []
+        will_close = False
+        try:
+            data = self._batch_bytes(commands)
+            while True:
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                    while len(responses) < len(commands):
+                        if will_close:
+                            raise http.client.HTTPException(
+                                f"Connection closed after {len(responses)} of {len(commands)} batched commands")
+                        status, body, will_close = await self._read_response(reader)
+                        responses.append((status, body))
+                    break
+                except (http.client.RemoteDisconnected, asyncio.IncompleteReadError,
+                        ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
+                    if not reused or responses or not idempotent:
+                        raise
+                    # The device probably closed this connection while it was idle, try once more on a new one
+                    writer.close()
+                    reader, writer = await self._open_stream()
+                    reused = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if will_close or len(self._idle_streams) >= self.max_idle_connections:
+            writer.close()
+        else:
+            self._idle_streams.append((reader, writer))
+        return responses
+
+    async def _request_batch(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[BatchResult]:
+        """
+        Internal helper to send several POST requests together on one connection (HTTP/1.1 pipelining).
+        The whole batch is limited to the client's timeout.
+
+        :return: For each command, its raw JSON response or the HowlAPIError it failed with.
+        """
+        if self._connection_slots is None:
+            self._connection_slots = asyncio.Semaphore(self.max_connections)
+        async with self._connection_slots:
+            try:
+                responses = await asyncio.wait_for(self._pipeline(commands), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No response to batch within {self.timeout} seconds")
+            except (OSError, http.client.HTTPException, asyncio.IncompleteReadError, ValueError) as e:
+                raise urllib.error.URLError(e)
+        return [self._batch_result(status, body) for status, body in responses]
+
+    async def _request(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Internal helper to make a POST request and return the raw JSON response.
+
+        :param endpoint: The API endpoint path (e.g., 'start_player').
+        :param payload: Optional dictionary to send as the JSON body.
+        :return: Raw JSON dictionary on success.
+        :raises HowlAPIError: On HTTP 400-599 responses.
+        :raises TimeoutError: On request timeout (5 seconds).
+        :raises urllib.error.URLError: On network connectivity issues.
+        """
+        json_body = payload if payload is not None else {}
+        data = json.dumps(json_body).encode('utf-8')
+
+        if self._connection_slots is None:
+            self._connection_slots = asyncio.Semaphore(self.max_connections)
+        async with self._connection_slots:
+            try:
+                status, response_data = await asyncio.wait_for(
+                    self._request_on_pool(endpoint, data, is_idempotent(endpoint, payload)), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"No response to {endpoint} within {self.timeout} seconds")
+            except (OSError, http.client.HTTPException, asyncio.IncompleteReadError, ValueError) as e:
+                raise urllib.error.URLError(e)
+        return self._decode_response(status, response_data)
+
+    async def _post(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> StatusResponse:
+        return self._parse_status_response(await self._request(endpoint, payload))
+
+    async def upload_hwl(self, hwl: Union[bytes, str, BinaryIO], title: Optional[str] = None,
+                         loop: Optional[bool] = None, play: Optional[bool] = None,
+                         compress: bool = True, chunk_size: int = HowlAPI.UPLOAD_CHUNK_SIZE) -> StatusResponse:
+        """
+        Load a HWL file with a binary upload, see HowlAPI.upload_hwl.
+        The upload runs in the default executor, as reading the HWL data may block.
+        """
+        def upload():
+            # Open a filename here, as HowlAPI.upload_hwl would pass the file to our (async) upload_hwl
+            if isinstance(hwl, str):
+                with open(hwl, 'rb') as f:
+                    return HowlAPI.upload_hwl(self, f, title, loop, play, compress, chunk_size)
+            return HowlAPI.upload_hwl(self, hwl, title, loop, play, compress, chunk_size)
+
+        event_loop = asyncio.get_running_loop()
+        return await event_loop.run_in_executor(None, upload)
+
+    async def available_activities(self) -> List[Activity]:
+        """
+        Retrieve a list of all available built-in activities.
+        Corresponds to POST /available_activities.
+
+        :return: List of Activity objects.
+        """
+        raw = await self._request("available_activities")
+        activities_data = raw.get("activities", [])
+        return [
+            Activity(name=a.get("name"), display_name=a.get("display_name"))
+            for a in activities_data
+        ]
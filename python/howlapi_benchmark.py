@@ -0,0 +1,66 @@
+"""
+Measures Howl API per-call latency over HTTP (with and without connection keep-alive) and WebSocket.
+
+By default this runs against a local stand-in server (see howlstub.py), so it mostly measures
+client and connection overhead. Pass --ip and --api-key to benchmark a real device instead.
+"""
+import argparse
+import statistics
+import time
+
+from howlapi import HowlAPI, HowlWebSocketAPI
+from howlstub import StubServer
+
+
+def time_calls(api: HowlAPI, calls: int):
+    """Return the latency of each of a number of get_status/set_power calls, in milliseconds"""
+    latencies = []
+    for i in range(calls):
+        start_time = time.perf_counter()
+        if i % 2:
+            api.set_power(power_a=i % 50)
+        else:
+            api.get_status()
+        latencies.append((time.perf_counter() - start_time) * 1000.0)
+    return latencies
+
+
+def describe(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (f"mean {statistics.mean(latencies):.3f}ms, median {statistics.median(latencies):.3f}ms, "
+            f"p95 {p95:.3f}ms, max {ordered[-1]:.3f}ms")
+
+
+def run(ip_address: str, api_key: str, port: int, ws_port: int, calls: int):
+    clients = (
+        ("HTTP, connection per call", lambda: HowlAPI(ip_address, api_key, port=port, keep_alive=False)),
+        ("HTTP, keep-alive", lambda: HowlAPI(ip_address, api_key, port=port)),
+        ("WebSocket", lambda: HowlWebSocketAPI(ip_address, api_key, port=ws_port)),
+    )
+    for label, make_client in clients:
+        with make_client() as api:
+            time_calls(api, min(calls, 20))  # warm up
+            print(f"{label:<26} {describe(time_calls(api, calls))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Howl API per-call latency over HTTP and WebSocket.")
+    parser.add_argument("-n", "--calls", type=int, default=1000, help="Number of calls per mode (default 1000).")
+    parser.add_argument("--ip", help="Benchmark a real device at this address instead of a local stand-in server.")
+    parser.add_argument("--port", type=int, default=HowlAPI.PORT, help="HTTP port of the real device (default 4695).")
+    parser.add_argument("--ws-port", type=int, default=HowlWebSocketAPI.PORT, help="WebSocket port of the real device (default 4696).")
+    parser.add_argument("--api-key", default="benchmark", help="API key of the real device.")
+    args = parser.parse_args()
+
+    if args.ip:
+        print(f"Benchmarking {args.calls} calls per mode against {args.ip}:{args.port}")
+        run(args.ip, args.api_key, args.port, args.ws_port, args.calls)
+    else:
+        with StubServer(args.api_key, port=0, ws_port=0) as server:
+            print(f"Benchmarking {args.calls} calls per mode against a local stand-in server")
+            run(server.host, args.api_key, server.port, server.ws_port, args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Shared status polling for the Howl remote API.
+
+A StatusMonitor polls a device's status from one background thread and keeps the latest
+StatusResponse, so any number of dashboards, scripts or threads can read it (monitor.status)
+without each sending their own requests. Reads are a plain attribute access, no lock is taken.
+
+Callbacks can be registered to run when particular fields change, or when the player position
+passes a point, instead of comparing statuses by hand:
+
+    with HowlAPI(ip_address, api_key) as api, StatusMonitor(api, interval=0.2) as monitor:
+        monitor.on_change(lambda changes, status: print(changes), fields=["power_a", "power_b", "mute"])
+        monitor.on_position(60.0, lambda status: print("One minute in"))
+        ...
+"""
+import dataclasses
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from howlapi import HowlAPI, MainOptionsStatus, PlayerStatus, StatusResponse
+
+# Field changes as {"options.power_a": (old value, new value), ...}
+Changes = Dict[str, Tuple[Any, Any]]
+
+
+def flatten_status(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a raw status response to {"options.power_a": 10, "player.position": 1.5, ...}"""
+    return {
+        f"{section}.{name}": value
+        for section in ("options", "player")
+        for name, value in raw.get(section, {}).items()
+    }
+
+
+class _Subscription:
+    def __init__(self, callback: Callable, fields: Optional[Tuple[str, ...]] = None, threshold: Optional[float] = None):
+        self.callback = callback
+        self.fields = fields
+        self.threshold = threshold
+
+
+class StatusMonitor:
+    """
+    Polls a device's status in the background and keeps the latest StatusResponse.
+
+    Polling uses the client's usual requests from a single thread, so with HowlAPI it stays on one
+    keep-alive connection (and with HowlWebSocketAPI shares its WebSocket). A StatusResponse is only
+    built when something in the status has changed, otherwise the previous one is kept.
+
+    Callbacks run on the polling thread, so they should return quickly. Exceptions they raise are
+    printed and otherwise ignored. A failed poll leaves status unchanged and is kept in error until
+    a poll succeeds again.
+    """
+    # Fields that change on every poll while playing, and so are left out of on_change by default
+    CONTINUOUS_FIELDS = ("player.position",)
+
+    def __init__(self, api: HowlAPI, interval: float = 0.1):
+        """
+        :param api: The (synchronous) client to poll with.
+        :param interval: Optional; seconds between polls (default 0.1, the device's own update rate).
+        """
+        self.api = api
+        self.interval = interval
+        self.status: Optional[StatusResponse] = None
+        self.updated: Optional[float] = None  # time.monotonic() of the last successful poll
+        self.error: Optional[Exception] = None
+        self.polls = 0
+        self._flat: Dict[str, Any] = {}
+        self._subscriptions: List[_Subscription] = []
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start polling, if not already started"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop polling and wait for the polling thread to finish"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def _field_name(name: str) -> str:
+        """Accept short field names like "power_a" as well as "options.power_a" """
+        if "." in name:
+            return name
+        for section, cls in (("options", MainOptionsStatus), ("player", PlayerStatus)):
+            if name in {field.name for field in dataclasses.fields(cls)}:
+                return f"{section}.{name}"
+        raise ValueError(f"Unknown status field: {name}")
+
+    def on_change(self, callback: Callable[[Changes, StatusResponse], Any],
+                  fields: Optional[Iterable[str]] = None) -> _Subscription:
+        """
+        Call callback(changes, status) whenever any of the given fields change, where changes maps
+        each changed field ("options.power_a" etc.) to its (old, new) values. Fields may be given
+        without their section, e.g. "mute". By default all fields except the player position are
+        watched, use on_position to follow that. The first poll counts as a change from None.
+
+        :return: A handle for unsubscribe().
+        """
+        names = tuple(self._field_name(name) for name in fields) if fields is not None else None
+        return self._subscribe(_Subscription(callback, fields=names))
+
+    def on_position(self, threshold: float, callback: Callable[[StatusResponse], Any]) -> _Subscription:
+        """
+        Call callback(status) whenever the player position passes threshold (in seconds) going
+        forwards, by playing or seeking. It fires again if the position goes back and passes it again.
+
+        :return: A handle for unsubscribe().
+        """
+        return self._subscribe(_Subscription(callback, threshold=threshold))
+
+    def _subscribe(self, subscription: _Subscription) -> _Subscription:
+        with self._lock:
+            # Copied rather than changed in place, so the polling thread can iterate without the lock
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: _Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+
+    def wait_for_update(self, timeout: Optional[float] = None) -> Optional[StatusResponse]:
+        """Wait for the next poll that changes the status, returning the new status (or None on timeout)"""
+        with self._updated:
+            status = self.status
+            self._updated.wait_for(lambda: self.status is not status, timeout)
+            return self.status if self.status is not status else None
+
+    def _poll_loop(self):
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            self._poll()
+            next_poll = max(next_poll + self.interval, time.monotonic())
+            self._stop.wait(next_poll - time.monotonic())
+
+    def _poll(self):
+        try:
+            raw = self.api._request("status")
+        except Exception as e:
+            self.error = e
+            return
+        self.error = None
+        self.polls += 1
+        self.updated = time.monotonic()
+
+        flat = flatten_status(raw)
+        previous = self._flat
+        changes = {name: (previous.get(name), value) for name, value in flat.items()
+                   if name not in previous or previous[name] != value}
+        if not changes:
+            return
+        status = self.api._parse_status_response(raw)
+        self._flat = flat
+        with self._updated:
+            self.status = status
+            self._updated.notify_all()
+
+        old_position = previous.get("player.position")
+        new_position = flat.get("player.position")
+        for subscription in self._subscriptions:
+            try:
+                if subscription.threshold is not None:
+                    if (old_position is not None and new_position is not None
+                            and old_position < subscription.threshold <= new_position):
+                        subscription.callback(status)
+                else:
+                    fields = subscription.fields
+                    if fields is None:
+                        watched = {name: change for name, change in changes.items()
+                                   if name not in self.CONTINUOUS_FIELDS}
+                    else:
+                        watched = {name: change for name, change in changes.items() if name in fields}
+                    if watched:
+                        subscription.callback(watched, status)
+            except Exception:
+                # A broken callback shouldn't stop the others, or the polling
+                traceback.print_exc()
@@ -0,0 +1,232 @@
+"""
+Retries, backoff and a circuit breaker for the Howl remote API, for unreliable networks.
+
+ResilientHowlAPI wraps a HowlAPI (or HowlWebSocketAPI) client and provides the same methods.
+Commands that are safe to repeat (status, seek, set_power...) are retried after connection
+errors and timeouts, with jittered exponential backoff. Commands that are not (increment_power,
+stream_pulse, toggling mute...) are never retried, as a timed out request may still have been
+carried out. While the device is unreachable a circuit breaker fails calls straight away
+instead of leaving every one of them to time out.
+
+    api = ResilientHowlAPI(HowlAPI(ip_address, api_key), RetryPolicy(max_attempts=4))
+    api.set_power(power_a=30)
+    print(api.metrics.summary())
+"""
+import random
+import threading
+import time
+import urllib.error
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from howlapi import IDEMPOTENT_ENDPOINTS, TOGGLE_ENDPOINTS, BatchResult, HowlAPI, is_idempotent
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """Raised without contacting the device while the circuit breaker is open"""
+
+
+class RetryPolicy:
+    """
+    How often and how soon to retry a failed command.
+
+    Attempt n (from 1) is followed by a random delay of up to base_delay * 2^(n-1) seconds, capped
+    at max_delay ("full jitter", so that several clients don't retry in step). Only connection
+    errors and timeouts are retried, errors reported by the device (HowlAPIError) are not.
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.1, max_delay: float = 2.0,
+                 endpoints: Optional[Iterable[str]] = None):
+        """
+        :param max_attempts: Optional; attempts per command, including the first (default 3).
+        :param base_delay: Optional; upper limit of the delay after the first attempt, in seconds (default 0.1).
+        :param max_delay: Optional; upper limit of any delay, in seconds (default 2.0).
+        :param endpoints: Optional; the endpoints to retry (default all the idempotent ones). Toggles are
+                          only retried when they are sent with a value. Raises ValueError for an endpoint
+                          that is not idempotent.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        if endpoints is None:
+            self.endpoints = IDEMPOTENT_ENDPOINTS | TOGGLE_ENDPOINTS
+        else:
+            self.endpoints = frozenset(endpoints)
+            for endpoint in self.endpoints:
+                if endpoint not in IDEMPOTENT_ENDPOINTS and endpoint not in TOGGLE_ENDPOINTS:
+                    raise ValueError(f"{endpoint} is not idempotent, so can't be retried")
+
+    def should_retry(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> bool:
+        return endpoint in self.endpoints and is_idempotent(endpoint, payload)
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after a failed attempt (numbered from 1)"""
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while a device is unreachable.
+
+    After failure_threshold attempts in a row fail with connection errors or timeouts the circuit
+    opens, and calls raise CircuitOpenError without being sent. After reset_timeout seconds one
+    call is let through as a trial: if it succeeds the circuit closes again, if not it stays open
+    for another reset_timeout. If the trial ends without a result (e.g. it is interrupted), the next
+    call is the trial instead.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if the call should not be sent, otherwise return True if it is the trial call"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let this call through as the trial
+                self.state = self.HALF_OPEN
+                return True
+            raise CircuitOpenError("Device unreachable, not sending (circuit breaker open)")
+
+    def end_trial(self):
+        """Call when the trial call has finished, in case it neither succeeded nor failed"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # Still open, but the reset timeout has passed, so the next call becomes the trial
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RetryMetrics:
+    """Counts of calls, retries and failures, and the latencies of recent calls"""
+    def __init__(self, latency_samples: int = 1000):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0  # calls that failed after any retries
+        self.rejected = 0  # calls failed fast by the circuit breaker
+        self.latencies: deque = deque(maxlen=latency_samples)  # seconds per successful call, retries included
+        self._lock = threading.Lock()
+
+    def record(self, attempts: int, latency: Optional[float]):
+        """Record a finished call, latency is None if it failed"""
+        with self._lock:
+            self.calls += 1
+            self.attempts += attempts
+            self.retries += max(0, attempts - 1)
+            if latency is None:
+                self.failures += 1
+            else:
+                self.latencies.append(latency)
+
+    def record_rejected(self):
+        with self._lock:
+            self.calls += 1
+            self.rejected += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Latency percentile (0-100) of the recent successful calls, in seconds (nearest rank)"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        rank = max(1, -(-len(latencies) * percent // 100))
+        return latencies[int(min(rank, len(latencies))) - 1]
+
+    def summary(self) -> str:
+        text = (f"{self.calls} calls, {self.retries} retries, {self.failures} failed, "
+                f"{self.rejected} rejected by circuit breaker")
+        if self.latencies:
+            text += ", latency " + " ".join(f"p{p} {self.percentile(p) * 1000.0:.1f}ms" for p in (50, 90, 99))
+        return text
+
+
+class ResilientHowlAPI(HowlAPI):
+    """
+    Wraps a synchronous client (HowlAPI or HowlWebSocketAPI) with retries and a circuit breaker.
+    Provides the same methods as the client, including batch() (retried as a whole only if every
+    command in it is idempotent) and upload_hwl (not retried, as its data may not be readable twice).
+    """
+    def __init__(self, api: HowlAPI, retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None, metrics: Optional[RetryMetrics] = None):
+        # Deliberately not HowlAPI.__init__, requests are sent by the wrapped client
+        self.api = api
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.metrics = metrics if metrics is not None else RetryMetrics()
+
+    @property
+    def timeout(self):
+        return self.api.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.api.timeout = value
+
+    def close(self):
+        self.api.close()
+
+    def _call(self, retry: bool, send):
+        """Send a request with send(), retrying connection errors and timeouts if retry is true"""
+        try:
+            trial = self.breaker.before_call()
+        except CircuitOpenError:
+            self.metrics.record_rejected()
+            raise
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                try:
+                    result = send()
+                except (urllib.error.URLError, TimeoutError):
+                    self.breaker.record_failure()
+                    if not retry or attempt >= self.retry.max_attempts or self.breaker.state == CircuitBreaker.OPEN:
+                        self.metrics.record(attempt, None)
+                        raise
+                    time.sleep(self.retry.delay(attempt))
+                    continue
+                except Exception:
+                    # The device answered (e.g. HowlAPIError), so it is reachable
+                    self.breaker.record_success()
+                    self.metrics.record(attempt, None)
+                    raise
+                self.breaker.record_success()
+                self.metrics.record(attempt, time.perf_counter() - start)
+                return result
+        finally:
+            if trial:
+                # E.g. interrupted by KeyboardInterrupt, don't leave the breaker waiting for this trial forever
+                self.breaker.end_trial()
+
+    def _request(self, endpoint: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self._call(self.retry.should_retry(endpoint, payload), lambda: self.api._request(endpoint, payload))
+
+    def _request_batch(self, commands: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[BatchResult]:
+        retry = all(self.retry.should_retry(endpoint, payload) for endpoint, payload in commands)
+        return self._call(retry, lambda: self.api._request_batch(commands))
+
+    def upload_hwl(self, *args, **kwargs):
+        return self._call(False, lambda: self.api.upload_hwl(*args, **kwargs))
@@ -0,0 +1,386 @@
+"""
+Real-time pulse streaming to a Howl device (start_stream / stream_pulse).
+
+PulseStreamer sends pulses from any iterable (a generator computing a live signal, or an
+HWL file via hwl_file_pulses) in batches timed to the device's playback rate of 40 pulses
+per second, keeping the device's pulse buffer topped up without overrunning it.
+
+The device does not report how full its buffer is, so the streamer estimates it from the
+pulses sent so far and the time since the stream started. If it falls behind (e.g. a slow
+request or a source that can't keep up) the device repeats its last pulse until more arrive.
+This is reported as an underrun, and streaming resumes from the new position.
+
+For long streams, SyncedPulseStreamer also follows the device's clock, which will run slightly
+fast or slow compared to ours. It estimates the device's playback rate from the player position
+in each response, and paces itself to match, holding the device's buffer at a target depth.
+
+Example, a one minute 1Hz amplitude wobble on both channels:
+
+    def wobble():
+        for i in range(60 * 40):
+            amp = 0.5 + 0.5 * math.sin(2 * math.pi * i / 40.0)
+            yield (amp, amp, 0.5, 0.5)
+
+    with HowlWebSocketAPI(ip_address, api_key) as api:
+        stats = PulseStreamer(api).stream(wobble())
+        print(stats.summary())
+"""
+import argparse
+import itertools
+import math
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+from howlapi import HowlAPI, HowlWebSocketAPI
+from libhwl import HWL_PULSES_PER_SECOND, HwlFile
+
+# Number of recent batches whose send jitter and request latency are kept, for the mean values in the stats
+STATS_SAMPLES = 1000
+
+
+@dataclass
+class StreamStats:
+    """Timing statistics for a stream"""
+    pulses_sent: int = 0
+    batches_sent: int = 0
+    underruns: int = 0  # times the device's buffer ran dry
+    underrun_pulses: float = 0.0  # total pulses the device had to fill in by repeating its last pulse
+    min_buffer_level: Optional[float] = None  # lowest estimated number of pulses queued when a batch was sent
+    max_request_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    # Seconds each recent batch was sent after it was due, and the most for any batch
+    jitter: deque = field(default_factory=lambda: deque(maxlen=STATS_SAMPLES))
+    max_jitter: float = 0.0
+
+    def record_jitter(self, seconds: float):
+        self.jitter.append(seconds)
+        self.max_jitter = max(self.max_jitter, seconds)
+
+    def summary(self) -> str:
+        text = (f"Sent {self.pulses_sent} pulses in {self.batches_sent} batches over {self.elapsed_seconds:.1f}s, "
+                f"{self.underruns} underruns ({self.underrun_pulses / HWL_PULSES_PER_SECOND:.3f}s of repeated pulses)")
+        if self.jitter:
+            text += (f", send jitter mean {statistics.mean(self.jitter) * 1000.0:.2f}ms "
+                     f"max {self.max_jitter * 1000.0:.2f}ms")
+        if self.min_buffer_level is not None:
+            text += f", min buffer level {self.min_buffer_level:.1f} pulses"
+        return text + f", slowest request {self.max_request_seconds * 1000.0:.1f}ms"
+
+
+def hwl_file_pulses(filename: str, block_pulses: int = 4096) -> Iterator[tuple]:
+    """
+    Iterate over the pulses of an HWL file as (left_amp, right_amp, left_freq, right_freq) tuples,
+    reading block_pulses at a time from a memory mapping rather than loading the whole file.
+    """
+    with HwlFile(filename) as hwl:
+        for start in range(0, len(hwl), block_pulses):
+            yield from hwl.read_array(start, min(start + block_pulses, len(hwl))).tolist()
+
+
+class PulseStreamer:
+    """
+    Streams pulses to a device in real time.
+
+    Pulses are sent batch_size at a time, each batch as soon as there is room for it in the device's
+    buffer of buffer_size pulses, so the buffer is refilled well before it runs dry. A larger buffer
+    tolerates slower or more variable requests, at the cost of more delay between computing a pulse
+    and it being played. HowlWebSocketAPI is recommended, as its requests are much quicker.
+    """
+    def __init__(self, api: HowlAPI, buffer_size: int = 8, batch_size: int = 4, title: str = "Streaming"):
+        if not 0 < batch_size <= buffer_size:
+            raise ValueError("batch_size must be between 1 and buffer_size")
+        self.api = api
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.title = title
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop streaming (from another thread), stream() returns after its current batch"""
+        self._stop.set()
+
+    def stream(self, pulses: Iterable[Any], drain: bool = True) -> StreamStats:
+        """
+        Start a stream and send pulses until the iterable is exhausted or stop() is called.
+        Pulses are libhwl Pulse objects or (left_amp, right_amp, left_freq, right_freq) tuples.
+
+        :param drain: Optional; wait for the device to play the pulses still in its buffer before returning.
+        :return: StreamStats for the stream.
+        """
+        self._stop.clear()
+        source = iter(pulses)
+        stats = StreamStats()
+        rate = float(HWL_PULSES_PER_SECOND)
+
+        self.api.start_stream(buffer_size=self.buffer_size, title=self.title)
+        # The device starts playing (and so emptying its buffer) as soon as the stream starts
+        start_time = time.perf_counter()
+        stream_start = start_time
+        due_time = None
+        sent = 0
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            level = sent - (now - stream_start) * rate
+            if level < 0.0 and sent:
+                stats.underruns += 1
+                stats.underrun_pulses -= level
+                # Playback resumes from the next pulse we send
+                stream_start = now - sent / rate
+                level = 0.0
+            batch = list(itertools.islice(source, int(self.buffer_size - level)))
+            if not batch:
+                break
+            if due_time is not None:
+                stats.record_jitter(max(0.0, now - due_time))
+            if sent:
+                stats.min_buffer_level = level if stats.min_buffer_level is None else min(stats.min_buffer_level, level)
+
+            request_start = time.perf_counter()
+            self.api.stream_pulse(batch)
+            stats.max_request_seconds = max(stats.max_request_seconds, time.perf_counter() - request_start)
+            stats.pulses_sent += len(batch)
+            stats.batches_sent += 1
+            sent += len(batch)
+
+            # The next batch is due once there is room for it
+            due_time = stream_start + (sent - (self.buffer_size - self.batch_size)) / rate
+            self._stop.wait(max(0.0, due_time - time.perf_counter()))
+
+        if drain and not self._stop.is_set():
+            self._stop.wait(max(0.0, stream_start + sent / rate - time.perf_counter()))
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        return stats
+
+
+class DeviceClock:
+    """
+    Estimates a device's playback position (in seconds) from our monotonic clock.
+
+    Fits a line through (our time, device position) observations by least squares, with old
+    observations gradually forgotten so that the fit can follow slow changes. The device only
+    advances its position in whole player ticks, the fit averages this quantisation away.
+    """
+    # Observations needed to span this many seconds before the fitted rate is used
+    MIN_FIT_SECONDS = 5.0
+    # Fitted rates are limited to within this fraction of nominal
+    MAX_RATE_ERROR = 0.05
+
+    def __init__(self, forgetting: float = 0.9995):
+        """
+        :param forgetting: Optional; weight kept by each observation when a new one is added.
+                           Around 1 / (1 - forgetting) of the most recent observations are used.
+        """
+        self.forgetting = forgetting
+        self._reference_time: Optional[float] = None
+        self._first_time = 0.0
+        self._last_time = 0.0
+        self._sums = [0.0] * 5  # weights, x, y, x*x, x*y
+
+    def observe(self, local_time: float, position: float):
+        """Add an observation of the device's position at one of our perf_counter() times"""
+        if self._reference_time is None:
+            self._reference_time = local_time
+            self._first_time = local_time
+        self._last_time = local_time
+        x = local_time - self._reference_time
+        for i, value in enumerate((1.0, x, position, x * x, x * position)):
+            self._sums[i] = self._sums[i] * self.forgetting + value
+
+    @property
+    def rate(self) -> float:
+        """Device seconds per second of ours"""
+        weights, sum_x, sum_y, sum_xx, sum_xy = self._sums
+        denominator = weights * sum_xx - sum_x * sum_x
+        if self._last_time - self._first_time < self.MIN_FIT_SECONDS or denominator <= 0.0:
+            return 1.0
+        rate = (weights * sum_xy - sum_x * sum_y) / denominator
+        return min(max(rate, 1.0 - self.MAX_RATE_ERROR), 1.0 + self.MAX_RATE_ERROR)
+
+    @property
+    def drift_ppm(self) -> float:
+        """How fast the device clock runs compared to ours, in parts per million"""
+        return (self.rate - 1.0) * 1e6
+
+    def position_at(self, local_time: float) -> float:
+        """Estimated device position at one of our perf_counter() times"""
+        weights, sum_x, sum_y = self._sums[:3]
+        if not weights:
+            raise ValueError("No observations yet")
+        # The fitted line passes through the weighted mean of the observations
+        mean_x, mean_y = sum_x / weights, sum_y / weights
+        return mean_y + (local_time - self._reference_time - mean_x) * self.rate
+
+    def time_at(self, position: float) -> float:
+        """Our perf_counter() time at which the device is estimated to reach a position"""
+        weights, sum_x, sum_y = self._sums[:3]
+        mean_x, mean_y = sum_x / weights, sum_y / weights
+        return self._reference_time + mean_x + (position - mean_y) / self.rate
+
+
+@dataclass
+class SyncedStreamStats(StreamStats):
+    """Timing statistics for a clock synchronised stream"""
+    drift_ppm: float = 0.0  # final estimate of how fast the device clock runs compared to ours
+    late_batches: int = 0  # batches that arrived after the device's buffer ran dry
+    dropped_batches: int = 0  # batches that arrived to a buffer too full for them, overwriting pulses
+    dropped_pulses: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=STATS_SAMPLES))  # recent request round trip times, in seconds
+
+    def summary(self) -> str:
+        text = super().summary()
+        mean_latency = statistics.mean(self.latencies) * 1000.0 if self.latencies else 0.0
+        return (text + f", drift {self.drift_ppm:+.0f}ppm, mean latency {mean_latency:.2f}ms, "
+                f"{self.late_batches} late batches, {self.dropped_batches} dropped batches ({self.dropped_pulses} pulses)")
+
+
+class SyncedPulseStreamer(PulseStreamer):
+    """
+    Streams pulses to a device in real time, following the device's clock.
+
+    Every response includes the device's player position, which advances with the device's own
+    clock as it plays. A DeviceClock fitted to these positions (each taken to be from halfway
+    through its request) gives the device's playback rate and so how many pulses it has played.
+    Each batch is sent when the buffer is estimated to fall to target_depth pulses by the time the
+    batch arrives (half a round trip later), and tops it up to target_depth + batch_size pulses.
+    The batch size grows with the round trip time, so that slow connections send fewer, larger
+    batches, but never beyond the room left in the buffer.
+    """
+    def __init__(self, api: HowlAPI, buffer_size: int = 16, target_depth: int = 6, min_batch_size: int = 2,
+                 title: str = "Streaming", clock: Optional[DeviceClock] = None):
+        """
+        :param buffer_size: Optional; the device's buffer size in pulses (default 16).
+        :param target_depth: Optional; pulses to keep queued on the device (default 6). The device plays
+                             4 pulses at a time, so this should be comfortably above 4.
+        :param min_batch_size: Optional; the smallest batch to send (default 2).
+        :param clock: Optional; the DeviceClock to use, e.g. to change its forgetting factor.
+        """
+        if not 0 < target_depth < buffer_size:
+            raise ValueError("target_depth must be between 1 and buffer_size - 1")
+        max_batch_size = buffer_size - target_depth
+        super().__init__(api, buffer_size, min(min_batch_size, max_batch_size), title)
+        self.target_depth = target_depth
+        self.min_batch_size = self.batch_size
+        self.max_batch_size = max_batch_size
+        self.clock = clock if clock is not None else DeviceClock()
+
+    def _timed_request(self, request, stats: SyncedStreamStats, rtt: Optional[float]):
+        """Make a request and observe the device position in its response, returning (response, midpoint, new rtt)"""
+        request_start = time.perf_counter()
+        response = request()
+        request_end = time.perf_counter()
+        latency = request_end - request_start
+        stats.latencies.append(latency)
+        stats.max_request_seconds = max(stats.max_request_seconds, latency)
+        midpoint = (request_start + request_end) / 2.0
+        self.clock.observe(midpoint, response.player.position)
+        # Smoothed round trip time
+        rtt = latency if rtt is None else rtt + (latency - rtt) * 0.1
+        return response, midpoint, rtt
+
+    def stream(self, pulses: Iterable[Any], drain: bool = True) -> SyncedStreamStats:
+        """
+        Start a stream and send pulses until the iterable is exhausted or stop() is called.
+        Pulses are libhwl Pulse objects or (left_amp, right_amp, left_freq, right_freq) tuples.
+
+        :param drain: Optional; wait for the device to play the pulses still in its buffer before returning.
+        :return: SyncedStreamStats for the stream.
+        """
+        self._stop.clear()
+        source = iter(pulses)
+        stats = SyncedStreamStats()
+        rate = float(HWL_PULSES_PER_SECOND)
+
+        start_time = time.perf_counter()
+        response, _, rtt = self._timed_request(
+            lambda: self.api.start_stream(buffer_size=self.buffer_size, title=self.title), stats, None)
+        start_position = response.player.position
+        # Pulses the device has played from its buffer are (position - start_position) * rate + adjustment,
+        # the adjustment accounting for pulses it repeated when the buffer ran dry or lost to overwriting
+        adjustment = 0.0
+        sent = 0
+        batch_size = self.min_batch_size
+        due_time = None
+
+        def buffer_level(local_time):
+            return sent + adjustment - (self.clock.position_at(local_time) - start_position) * rate
+
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            level = max(0.0, buffer_level(now + rtt / 2.0))
+            count = min(int(round(self.target_depth + batch_size - level)), int(self.buffer_size - level))
+            if count <= 0:
+                self._stop.wait(1.0 / rate)
+                continue
+            batch = list(itertools.islice(source, count))
+            if not batch:
+                break
+            if due_time is not None:
+                stats.record_jitter(max(0.0, now - due_time))
+            if sent:
+                stats.min_buffer_level = level if stats.min_buffer_level is None else min(stats.min_buffer_level, level)
+
+            _, arrival, rtt = self._timed_request(lambda: self.api.stream_pulse(batch), stats, rtt)
+            # Account for the batch using the updated clock, at the time it is estimated to have arrived
+            level = buffer_level(arrival)
+            if level < 0.0 and sent:
+                stats.late_batches += 1
+                stats.underruns += 1
+                stats.underrun_pulses -= level
+                adjustment -= level
+                level = 0.0
+            overflow = int(math.floor(level + len(batch) - self.buffer_size))
+            if overflow > 0:
+                stats.dropped_batches += 1
+                stats.dropped_pulses += overflow
+                adjustment -= overflow
+            sent += len(batch)
+            stats.pulses_sent += len(batch)
+            stats.batches_sent += 1
+
+            # Larger batches when requests are slow, so that we are never waiting on more than one at a time
+            batch_size = min(max(self.min_batch_size, math.ceil(rtt * rate * 2.0)), self.max_batch_size)
+            # The next batch is due when the buffer would fall to the target depth as it arrives
+            played_at_due = sent + adjustment - self.target_depth
+            due_time = self.clock.time_at(start_position + played_at_due / rate) - rtt / 2.0
+            self._stop.wait(max(0.0, due_time - time.perf_counter()))
+
+        if drain and not self._stop.is_set():
+            self._stop.wait(max(0.0, self.clock.time_at(start_position + (sent + adjustment) / rate) - time.perf_counter()))
+        stats.drift_ppm = self.clock.drift_ppm
+        stats.elapsed_seconds = time.perf_counter() - start_time
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream an HWL file to a Howl device in real time.")
+    parser.add_argument("file", help="HWL file to stream.")
+    parser.add_argument("--ip", required=True, help="IP address of the Howl device.")
+    parser.add_argument("--api-key", required=True, help="API key of the Howl device.")
+    parser.add_argument("--http", action="store_true", help="Use the HTTP API instead of the WebSocket API.")
+    parser.add_argument("--buffer-size", type=int, default=16, help="Device buffer size in pulses (default 16).")
+    parser.add_argument("--batch-size", type=int, default=4, help="Pulses sent per request (default 4).")
+    parser.add_argument("--sync", action="store_true",
+                        help="Follow the device's clock, holding its buffer at a target depth (for long streams).")
+    parser.add_argument("--target-depth", type=int, default=6, help="Buffer depth to hold with --sync (default 6).")
+    args = parser.parse_args()
+
+    api = HowlAPI(args.ip, args.api_key) if args.http else HowlWebSocketAPI(args.ip, args.api_key)
+    with api:
+        if args.sync:
+            streamer = SyncedPulseStreamer(api, args.buffer_size, args.target_depth, title=args.file)
+        else:
+            streamer = PulseStreamer(api, args.buffer_size, args.batch_size, title=args.file)
+        try:
+            stats = streamer.stream(hwl_file_pulses(args.file))
+        except KeyboardInterrupt:
+            print("Interrupted")
+            return
+    print(stats.summary())
+
+
+if __name__ == "__main__":
+    main()
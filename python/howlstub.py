@@ -0,0 +1,533 @@
+"""
+Local stand-in for the Howl remote control server.
+
+Implements the same endpoints, authentication and response format as the app's remote
+API, over both HTTP (port 4695) and WebSocket (port 4696, /ws), backed by an in-memory
+device state instead of real hardware. Useful for developing and benchmarking clients
+without a phone. Run directly to serve on the usual port:
+
+    python howlstub.py --api-key changeme
+"""
+import argparse
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from howlws import WebSocketConnection, accept_key
+
+HWL_HEADER = b"YEAHBOI!"
+HWL_PULSES_PER_SECOND = 40
+HWL_PULSE_SIZE = 16
+# Largest upload_hwl body accepted once decompressed, like the app
+MAX_HWL_UPLOAD_BYTES = 256 * 1024 * 1024
+
+
+class StubDevice:
+    """
+    In-memory state of a stand-in Howl device.
+
+    handle_request mirrors the app's RequestHandler: it takes an endpoint name and its JSON
+    parameters and returns (HTTP status code, response body), so it can sit behind any transport.
+    """
+    ACTIVITIES = [
+        ("CALIBRATION1", "Calibration 1"),
+        ("CHAOS", "Chaos"),
+    ]
+    DEFAULT_PULSE_BUFFER_SIZE = 5
+    # Like the app's player loop, streams are played in ticks of OUTPUT_TIMER seconds, 4 pulses per tick
+    OUTPUT_TIMER = 0.1
+    PULSES_PER_TICK = 4
+
+    def __init__(self, clock_ppm: float = 0.0):
+        """
+        :param clock_ppm: Optional; how fast the simulated device clock runs compared to ours, in parts per million.
+        """
+        self.lock = threading.Lock()
+        self.clock_ppm = clock_ppm
+        self.power_a = 0
+        self.power_b = 0
+        self.power_a_limit = 100
+        self.power_b_limit = 100
+        self.mute = False
+        self.auto_increase_power = False
+        self.swap_channels = False
+        self.freq_range_min = 0.0
+        self.freq_range_max = 1.0
+        self.playing = False
+        self.position = 0.0
+        self.title = ""
+        self.duration = 0.0
+        self.source: Optional[str] = None  # "funscript", "hwl", "stream" or "activity"
+        self.stream_buffer: deque = deque(maxlen=self.DEFAULT_PULSE_BUFFER_SIZE)
+        self.stream_start = 0.0
+        self.stream_ticks = 0
+        self.stream_stats = {"played": 0, "repeated": 0, "overwritten": 0}
+        self.request_counts: Dict[str, int] = {}
+        self.uploads: List[Tuple[int, int]] = []  # (bytes received, HWL bytes) for each upload_hwl
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "options": {
+                "power_a": self.power_a,
+                "power_b": self.power_b,
+                "power_a_limit": self.power_a_limit,
+                "power_b_limit": self.power_b_limit,
+                "mute": self.mute,
+                "auto_increase_power": self.auto_increase_power,
+                "swap_channels": self.swap_channels,
+                "freq_range_min": self.freq_range_min,
+                "freq_range_max": self.freq_range_max
+            },
+            "player": {
+                "playing": self.playing,
+                "position": self.position,
+                "title": self.title,
+                "duration": self.duration
+            }
+        }
+
+    @staticmethod
+    def error(status_code: int, message: str) -> Tuple[int, Dict[str, Any]]:
+        return status_code, {"error": {"message": message}}
+
+    def handle_request(self, endpoint: str, params: Any) -> Tuple[int, Dict[str, Any]]:
+        """Dispatch a request, returning (status code, body)"""
+        handler = getattr(self, f"_handle_{endpoint}", None)
+        if handler is None:
+            return self.error(404, f"Unknown endpoint: {endpoint}")
+        if params is None:
+            params = {}
+        try:
+            with self.lock:
+                self._advance_stream()
+                self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+                result = handler(params)
+                return result if result is not None else (200, self.status())
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return self.error(400, "Invalid parameters")
+
+    def _switch_source(self, source: str, title: str, duration: float):
+        self.playing = False
+        self.position = 0.0
+        self.source = source
+        self.title = title
+        self.duration = duration
+
+    def _handle_status(self, params):
+        pass
+
+    def _handle_start_player(self, params):
+        if params.get("from") is not None:
+            self.position = float(params["from"])
+        self.playing = True
+
+    def _handle_seek(self, params):
+        self.position = float(params["position"])
+
+    def _handle_stop_player(self, params):
+        self.playing = False
+
+    def _handle_load_funscript(self, params):
+        try:
+            actions = json.loads(params["funscript"])["actions"]
+            duration = max(float(a["at"]) for a in actions) / 1000.0
+        except (ValueError, KeyError, TypeError):
+            return self.error(400, "Invalid funscript file")
+        self._switch_source("funscript", params.get("title", ""), duration)
+        self.playing = bool(params.get("play", False))
+
+    def _load_hwl_data(self, data: bytes, title: str, play: bool):
+        if not data.startswith(HWL_HEADER) or (len(data) - len(HWL_HEADER)) % HWL_PULSE_SIZE:
+            return self.error(400, "Invalid HWL file")
+        num_pulses = (len(data) - len(HWL_HEADER)) // HWL_PULSE_SIZE
+        self._switch_source("hwl", title, num_pulses / float(HWL_PULSES_PER_SECOND))
+        self.playing = play
+
+    def _handle_load_hwl(self, params):
+        return self._load_hwl_data(base64.b64decode(params["hwl"]), params.get("title", ""), bool(params.get("play", False)))
+
+    def upload_hwl(self, query: Dict[str, str], data: bytes, received: int) -> Tuple[int, Dict[str, Any]]:
+        """
+        Handle POST /upload_hwl, whose parameters are in the query string and body is the HWL file
+        (already decompressed), returning (status code, body). received is the size of the body as sent.
+        """
+        with self.lock:
+            self._advance_stream()
+            self.request_counts["upload_hwl"] = self.request_counts.get("upload_hwl", 0) + 1
+            self.uploads.append((received, len(data)))
+            play = query.get("play", "false")
+            if play not in ("true", "false") or query.get("loop", "true") not in ("true", "false"):
+                return self.error(400, "Invalid parameters")
+            result = self._load_hwl_data(data, query.get("title", ""), play == "true")
+            return result if result is not None else (200, self.status())
+
+    def _advance_stream(self):
+        """
+        Play any stream ticks that are due by now. The buffer only empties between requests,
+        so advancing at the start of each request gives the same result as playing in real time.
+        """
+        if self.source != "stream" or not self.playing:
+            return
+        elapsed = (time.perf_counter() - self.stream_start) * (1.0 + self.clock_ppm * 1e-6)
+        ticks_due = int(elapsed / self.OUTPUT_TIMER)
+        for _ in range(ticks_due - self.stream_ticks):
+            played = min(self.PULSES_PER_TICK, len(self.stream_buffer))
+            for _ in range(played):
+                self.stream_buffer.popleft()
+            self.stream_stats["played"] += played
+            # An empty buffer repeats the last pulse
+            self.stream_stats["repeated"] += self.PULSES_PER_TICK - played
+        self.stream_ticks = max(self.stream_ticks, ticks_due)
+        self.position = self.stream_ticks * self.OUTPUT_TIMER
+
+    def _handle_start_stream(self, params):
+        self._switch_source("stream", params.get("title", ""), 0.0)
+        self.stream_buffer = deque(maxlen=int(params.get("buffer_size", 4)))
+        self.stream_start = time.perf_counter()
+        self.stream_ticks = 0
+        self.stream_stats = {"played": 0, "repeated": 0, "overwritten": 0}
+        self.playing = True
+
+    def _handle_stream_pulse(self, params):
+        for pulse in params["pulses"]:
+            # A full buffer overwrites its oldest pulse, like the app's circular buffer
+            if len(self.stream_buffer) == self.stream_buffer.maxlen:
+                self.stream_stats["overwritten"] += 1
+            self.stream_buffer.append((float(pulse["ampA"]), float(pulse["ampB"]),
+                                       float(pulse["freqA"]), float(pulse["freqB"])))
+
+    def _clamp_power(self, power: int, limit: int) -> int:
+        return max(0, min(int(power), limit))
+
+    def _handle_set_power(self, params):
+        if params.get("power_a") is not None:
+            self.power_a = self._clamp_power(params["power_a"], self.power_a_limit)
+        if params.get("power_b") is not None:
+            self.power_b = self._clamp_power(params["power_b"], self.power_b_limit)
+
+    def _change_power(self, params, sign: int):
+        channel = int(params["channel"])
+        step = int(params.get("step", 0)) or 1
+        if channel in (0, -1):
+            self.power_a = self._clamp_power(self.power_a + sign * step, self.power_a_limit)
+        if channel in (1, -1):
+            self.power_b = self._clamp_power(self.power_b + sign * step, self.power_b_limit)
+
+    def _handle_increment_power(self, params):
+        self._change_power(params, 1)
+
+    def _handle_decrement_power(self, params):
+        self._change_power(params, -1)
+
+    def _handle_set_mute(self, params):
+        value = params.get("value")
+        self.mute = (not self.mute) if value is None else bool(value)
+
+    def _handle_set_swap_channels(self, params):
+        value = params.get("value")
+        self.swap_channels = (not self.swap_channels) if value is None else bool(value)
+
+    def _handle_set_auto_increase(self, params):
+        value = params.get("value")
+        self.auto_increase_power = (not self.auto_increase_power) if value is None else bool(value)
+
+    def _handle_set_freq_range(self, params):
+        min_value, max_value = float(params["min"]), float(params["max"])
+        if not 0.0 <= min_value <= 1.0:
+            return self.error(400, "min must be between 0.0 and 1.0")
+        if not 0.0 <= max_value <= 1.0:
+            return self.error(400, "max must be between 0.0 and 1.0")
+        if max_value <= min_value:
+            return self.error(400, "max must be greater than min")
+        if max_value - min_value < 0.01:
+            return self.error(400, "min and max must differ by at least 0.01")
+        self.freq_range_min, self.freq_range_max = min_value, max_value
+
+    def _handle_available_activities(self, params):
+        activities = [{"name": name, "display_name": display_name} for name, display_name in self.ACTIVITIES]
+        return 200, {"activities": sorted(activities, key=lambda a: a["display_name"].lower())}
+
+    def _handle_load_activity(self, params):
+        names = dict(self.ACTIVITIES)
+        if params["name"] not in names:
+            return self.error(400, f"Unknown activity: {params['name']}")
+        self._switch_source("activity", names[params["name"]], 0.0)
+        self.playing = bool(params.get("play", False))
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 front end for a StubDevice, connections are kept alive between requests.
+    GET /ws upgrades the connection to the WebSocket protocol used by the app's WebSocket server.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle's algorithm hold the body back
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Idle keep-alive connections are closed after this many seconds (None to keep them open)
+        self.timeout = self.server.idle_timeout
+        super().setup()
+        self.server.track_connection(self.connection, True)
+
+    def finish(self):
+        super().finish()
+        self.server.track_connection(self.connection, False)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, status_code: int, body: Optional[Dict[str, Any]]):
+        data = json.dumps(body).encode('utf-8') if body is not None else b""
+        self.send_response(status_code)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> Iterator[bytes]:
+        """Read the request body a piece at a time, with or without chunked transfer encoding"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    # Skip any trailers, up to the blank line ending the body
+                    while self.rfile.readline().strip():
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            length = int(self.headers.get("Content-Length", 0))
+            if length:
+                yield self.rfile.read(length)
+
+    def _upload_hwl(self, query: Dict[str, str]):
+        encoding = self.headers.get("Content-Encoding", "identity").lower()
+        if encoding not in ("identity", "deflate"):
+            self.close_connection = True
+            self._respond(*StubDevice.error(415, f"Unsupported Content-Encoding: {encoding}"))
+            return
+        decompressor = zlib.decompressobj() if encoding == "deflate" else None
+        chunks = []
+        received = 0
+        size = 0
+        try:
+            for chunk in self._read_body():
+                received += len(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk, MAX_HWL_UPLOAD_BYTES + 1 - size)
+                size += len(chunk)
+                if size > MAX_HWL_UPLOAD_BYTES or (decompressor is not None and decompressor.unconsumed_tail):
+                    self.close_connection = True
+                    self._respond(*StubDevice.error(413, "HWL upload too large"))
+                    return
+                chunks.append(chunk)
+            if decompressor is not None:
+                chunks.append(decompressor.flush())
+                if not decompressor.eof:
+                    raise zlib.error("incomplete deflate stream")
+        except zlib.error:
+            self.close_connection = True
+            self._respond(*StubDevice.error(400, "Invalid compressed data"))
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self._respond(*self.server.device.upload_hwl(query, b"".join(chunks), received))
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        authorised = self.headers.get("Authorization") == f"Bearer {self.server.api_key}"
+        if path == "/upload_hwl" and authorised:
+            self._upload_hwl(dict(urllib.parse.parse_qsl(query)))
+            return
+        data = b"".join(self._read_body())
+        if not authorised:
+            self._respond(401, None)
+            return
+        try:
+            params = json.loads(data) if data else None
+        except ValueError:
+            self._respond(*StubDevice.error(400, "Invalid parameters"))
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self._respond(*self.server.device.handle_request(path.lstrip("/"), params))
+
+    def do_GET(self):
+        if self.path != "/ws" or self.headers.get("Upgrade", "").lower() != "websocket":
+            self._respond(*StubDevice.error(404, "Not found"))
+            return
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept_key(self.headers["Sec-WebSocket-Key"]))
+        self.end_headers()
+        self.close_connection = True
+        self.connection.settimeout(None)
+        self._serve_websocket(WebSocketConnection(self.connection, self.rfile, mask=False))
+
+    def _send_ws_response(self, ws: WebSocketConnection, status_code: int, endpoint: str, body: Any):
+        ws.send_text(json.dumps({"status": status_code, "endpoint": endpoint, "body": body}))
+
+    def _serve_websocket(self, ws: WebSocketConnection):
+        """Authenticate with the first message, then answer each command in order"""
+        try:
+            message = ws.recv_text()
+            if message is None:
+                return
+            try:
+                api_key = json.loads(message)["api_key"]
+            except (ValueError, KeyError, TypeError):
+                self._send_ws_response(ws, 400, "auth", StubDevice.error(400, "Invalid authentication message format")[1])
+                ws.close(1008)
+                return
+            if api_key != self.server.api_key:
+                self._send_ws_response(ws, 401, "auth", StubDevice.error(401, "Invalid API key")[1])
+                ws.close(1008)
+                return
+            self._send_ws_response(ws, 200, "auth", "Authenticated")
+
+            while True:
+                message = ws.recv_text()
+                if message is None:
+                    return
+                try:
+                    command = json.loads(message)
+                    endpoint = command["endpoint"]
+                    params = command.get("params")
+                except (ValueError, KeyError, TypeError):
+                    self._send_ws_response(ws, 400, "error", StubDevice.error(400, "Invalid command format")[1])
+                    continue
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                status_code, body = self.server.device.handle_request(endpoint, params)
+                self._send_ws_response(ws, status_code, endpoint, body)
+        except OSError:
+            pass
+        finally:
+            ws.close()
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that keeps track of its open connections, so they can be closed on shutdown"""
+    daemon_threads = True
+
+    def __init__(self, address, device: StubDevice, api_key: str, latency: float,
+                 idle_timeout: Optional[float], verbose: bool):
+        super().__init__(address, StubRequestHandler)
+        self.device = device
+        self.api_key = api_key
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.verbose = verbose
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid-request (e.g. after timing out or being cancelled) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def track_connection(self, connection: socket.socket, is_open: bool):
+        with self._connections_lock:
+            if is_open:
+                self._connections.add(connection)
+            else:
+                self._connections.discard(connection)
+
+    def close_connections(self):
+        """Close every open client connection, as a device that stopped or lost its network would"""
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class StubServer:
+    """
+    Serves a StubDevice over HTTP on a background thread.
+    Use port 0 to pick a free port, the chosen port is available as .port once started.
+    """
+    def __init__(self, api_key: str, host: str = "127.0.0.1", port: int = 4695, ws_port: Optional[int] = 4696,
+                 device: Optional[StubDevice] = None, latency: float = 0.0,
+                 idle_timeout: Optional[float] = None, verbose: bool = False):
+        """
+        :param ws_port: Optional; port for the WebSocket API (None to only serve HTTP).
+        :param latency: Optional; seconds each request is delayed before being handled, to emulate a device.
+        :param idle_timeout: Optional; seconds after which idle keep-alive connections are closed.
+        """
+        self.device = device if device is not None else StubDevice()
+        self._servers = [StubHTTPServer((host, port), self.device, api_key, latency, idle_timeout, verbose)]
+        self.host, self.port = self._servers[0].server_address[:2]
+        self.ws_port = None
+        if ws_port is not None:
+            self._servers.append(StubHTTPServer((host, ws_port), self.device, api_key, latency, None, verbose))
+            self.ws_port = self._servers[1].server_address[1]
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        for httpd in self._servers:
+            thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close_connections(self):
+        """Close every open client connection, the server keeps accepting new ones"""
+        for httpd in self._servers:
+            httpd.close_connections()
+
+    def stop(self):
+        for httpd in self._servers:
+            httpd.shutdown()
+            httpd.server_close()
+            httpd.close_connections()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Howl remote control server.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=4695, help="Port to listen on (default 4695).")
+    parser.add_argument("--ws-port", type=int, default=4696, help="Port to listen on for WebSocket connections (default 4696).")
+    parser.add_argument("--api-key", default="changeme", help="API key clients must present.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay each request by.")
+    args = parser.parse_args()
+
+    server = StubServer(args.api_key, args.host, args.port, args.ws_port, latency=args.latency, verbose=True)
+    print(f"Serving stand-in Howl API on {server.host}:{server.port} (WebSocket {server.ws_port}), press Ctrl+C to stop.")
+    server.start()
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
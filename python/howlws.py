@@ -0,0 +1,175 @@
+"""
+Minimal WebSocket (RFC 6455) connections, using only the standard library.
+
+Supports what the Howl remote API needs: text messages (fragmented or not), ping/pong and
+closing. Used by the Python client (howlapi.HowlWebSocketAPI) and the stand-in server (howlstub).
+"""
+import base64
+import hashlib
+import os
+import socket
+import struct
+import threading
+from typing import BinaryIO, Optional, Tuple
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class WebSocketError(ConnectionError):
+    """Raised when the WebSocket handshake fails or the connection is closed or broken"""
+
+
+def accept_key(key: str) -> str:
+    """The Sec-WebSocket-Accept value a server must return for a client's Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def mask_payload(payload: bytes, mask: bytes) -> bytes:
+    """XOR a payload with a 4 byte masking key (masking and unmasking are the same operation)"""
+    if not payload:
+        return payload
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(payload), 'big')
+
+
+class WebSocketConnection:
+    """
+    One end of an established WebSocket connection.
+
+    Clients must mask the frames they send and servers must not, so pass mask=True on the client side.
+    Sending is thread safe, but only one thread should receive.
+    """
+    def __init__(self, sock: socket.socket, rfile: BinaryIO, mask: bool):
+        self.sock = sock
+        self.rfile = rfile
+        self.mask = mask
+        self.closed = False
+        self._send_lock = threading.Lock()
+        self._close_sent = False
+
+    @classmethod
+    def connect(cls, host: str, port: int, path: str, timeout: Optional[float] = None) -> "WebSocketConnection":
+        """
+        Open a client connection. timeout applies to connecting and the handshake,
+        afterwards the socket blocks until data arrives.
+        """
+        sock = socket.create_connection((host, port), timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            key = base64.b64encode(os.urandom(16)).decode('ascii')
+            sock.sendall((
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                "\r\n"
+            ).encode('ascii'))
+            rfile = sock.makefile('rb')
+            status_line = rfile.readline().decode('latin-1').split()
+            headers = {}
+            while True:
+                line = rfile.readline().decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(status_line) < 2 or status_line[1] != "101":
+                raise WebSocketError(f"WebSocket handshake refused: {' '.join(status_line)}")
+            if headers.get("sec-websocket-accept") != accept_key(key):
+                raise WebSocketError("WebSocket handshake failed: bad Sec-WebSocket-Accept")
+            sock.settimeout(None)
+            return cls(sock, rfile, mask=True)
+        except BaseException:
+            sock.close()
+            raise
+
+    def _read_exact(self, count: int) -> bytes:
+        data = self.rfile.read(count)
+        if len(data) < count:
+            raise WebSocketError("WebSocket connection closed")
+        return data
+
+    def _read_frame(self) -> Tuple[bool, int, bytes]:
+        """Read one frame, returning (final fragment, opcode, unmasked payload)"""
+        first, second = self._read_exact(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", self._read_exact(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", self._read_exact(8))
+        mask = self._read_exact(4) if second & 0x80 else None
+        payload = self._read_exact(length)
+        if mask is not None:
+            payload = mask_payload(payload, mask)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def send_frame(self, opcode: int, payload: bytes = b""):
+        length = len(payload)
+        mask_bit = 0x80 if self.mask else 0
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, mask_bit | length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, mask_bit | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, mask_bit | 127, length)
+        if self.mask:
+            mask = os.urandom(4)
+            header += mask
+            payload = mask_payload(payload, mask)
+        with self._send_lock:
+            if self._close_sent:
+                raise WebSocketError("WebSocket connection closed")
+            if opcode == OP_CLOSE:
+                self._close_sent = True
+            self.sock.sendall(header + payload)
+
+    def send_text(self, text: str):
+        self.send_frame(OP_TEXT, text.encode('utf-8'))
+
+    def recv_text(self) -> Optional[str]:
+        """
+        Return the next text (or binary, decoded as UTF-8) message, answering any pings on the way.
+        Returns None once the other end has closed the connection.
+        """
+        fragments = []
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OP_PING:
+                self.send_frame(OP_PONG, payload)
+            elif opcode == OP_PONG:
+                pass
+            elif opcode == OP_CLOSE:
+                try:
+                    self.send_frame(OP_CLOSE, payload[:2])
+                except OSError:
+                    pass
+                self.closed = True
+                return None
+            else:
+                fragments.append(payload)
+                if fin:
+                    return b"".join(fragments).decode('utf-8')
+
+    def close(self, code: int = 1000):
+        """Send a close frame (if we haven't already) and close the socket"""
+        if not self.closed:
+            self.closed = True
+            try:
+                self.send_frame(OP_CLOSE, struct.pack("!H", code))
+            except OSError:
+                pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
@@ -1,159 +1,449 @@
 import os
+import sys
+import time
+import argparse
 import numpy as np
-import struct
+import math
 import itertools
 import gc
+import json
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from aubio import source, pitch
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+from libhwl import HwlFile, HwlWriter, empty_hwl_array, set_default_permissions, write_hwl_array
+
+# Increase whenever a change to the conversion code changes its output, so that cached conversions are redone
+CONVERTER_VERSION = 1
+# Conversion cache index, stored in the top level audio directory
+CACHE_FILENAME = ".hwl_cache.json"
+# Sidecar file saved next to each audio file, holding its binned (unnormalised) analysis data
+SIDECAR_SUFFIX = ".bins.npz"
+# Normalisation settings. Changes to these can be applied to existing conversions quickly with --renormalise
+MAX_FREQ_LOWER_LIMIT = 800.0
+MISSING_FREQ_DEFAULT = 400.0  # Frequency used for a channel that has no detectable pitch at all
+# Number of hops decoded per read by the streaming pipeline (--stream)
+STREAM_BLOCK_HOPS = 64
+# Number of binned samples normalised per block, so long files are never normalised all at once
+NORMALISE_BLOCK_SIZE = 65536
 
 @dataclass
-class Sample:
+class PitchSettings:
+    """
+    Pitch detector configuration.
+    Passed to every worker that analyses part of a file, so that all segments are analysed identically.
     """
-    Represents audio sample data with left and right channel frequencies and amplitudes.
-    Used to store our final aggregated data, which we normalise and then write to a file.
+    algorithm: str
+    window_size: int
+    hop_size: int
+    sample_rate: int
+    silence_threshold: float
+    discard_low_confidence: bool
+    confidence_threshold: float
+
+# Per-hop data columns and their types
+HOP_COLUMNS = (
+    ("frames", np.int64),  # start frame of each hop
+    ("left_freq", np.float32),
+    ("right_freq", np.float32),
+    ("left_sq", np.float32),
+    ("right_sq", np.float32),
+    ("num_samples", np.int64),
+)
+
+@dataclass
+class HopBlock:
     """
-    left_freq: float
-    right_freq: float
-    left_amp: float
-    right_amp: float
+    Per-hop analysis results for a contiguous range of audio frames, stored as column arrays.
+    Produced by detect_segment, blocks for consecutive segments are stitched back together in frame order.
+    """
+    frames: np.ndarray  # start frame of each hop
+    left_freq: np.ndarray
+    right_freq: np.ndarray
+    left_sq: np.ndarray
+    right_sq: np.ndarray
+    num_samples: np.ndarray
+    count_pitch_values: int = 0
+    count_zero_values: int = 0
+    count_low_confidence: int = 0
+    count_nyquist: int = 0
+
+    @property
+    def end_frame(self):
+        """The frame immediately after the last hop"""
+        return int(self.frames[-1] + self.num_samples[-1]) if len(self.frames) else None
+
+    def counts(self):
+        """Detection stats, as keyword arguments for HopBlock"""
+        return dict(
+            count_pitch_values=self.count_pitch_values,
+            count_zero_values=self.count_zero_values,
+            count_low_confidence=self.count_low_confidence,
+            count_nyquist=self.count_nyquist
+        )
+
+    @classmethod
+    def empty(cls):
+        """A block containing no hops"""
+        return cls(*(np.zeros(0, dtype=dtype) for _, dtype in HOP_COLUMNS))
+
+class HopBuffer:
+    """
+    Growable column storage for per-hop data.
+    Preallocated (and grown by doubling when needed), so that no objects are created per hop.
+    """
+    def __init__(self, capacity=1024):
+        self.length = 0
+        self.capacity = max(1, capacity)
+        for name, dtype in HOP_COLUMNS:
+            setattr(self, name, np.zeros(self.capacity, dtype=dtype))
+
+    def reserve(self, needed):
+        """Make sure there is room for at least needed hops in total"""
+        if needed <= self.capacity:
+            return
+        self.capacity = max(needed, self.capacity * 2)
+        for name, dtype in HOP_COLUMNS:
+            grown = np.zeros(self.capacity, dtype=dtype)
+            grown[:self.length] = getattr(self, name)[:self.length]
+            setattr(self, name, grown)
+
+    def append(self, frame, left_freq, right_freq, left_sq, right_sq, num_samples):
+        """Add the data for a single hop"""
+        i = self.length
+        self.reserve(i + 1)
+        self.frames[i] = frame
+        self.left_freq[i] = left_freq
+        self.right_freq[i] = right_freq
+        self.left_sq[i] = left_sq
+        self.right_sq[i] = right_sq
+        self.num_samples[i] = num_samples
+        self.length += 1
+
+    def extend(self, block):
+        """Add every hop from a HopBlock"""
+        count = len(block.frames)
+        self.reserve(self.length + count)
+        for name, _ in HOP_COLUMNS:
+            getattr(self, name)[self.length:self.length + count] = getattr(block, name)
+        self.length += count
+
+    def column(self, name):
+        """View of the filled part of a column"""
+        return getattr(self, name)[:self.length]
+
+    def take(self, count):
+        """Remove the first count hops, returning them as a HopBlock"""
+        block = HopBlock(*(self.column(name)[:count].copy() for name, _ in HOP_COLUMNS))
+        for name, _ in HOP_COLUMNS:
+            values = getattr(self, name)
+            values[:self.length - count] = values[count:self.length]
+        self.length -= count
+        return block
+
+    def to_block(self, **counts):
+        """Return the stored hops as a HopBlock, along with any detection stats supplied"""
+        return HopBlock(*(self.column(name).copy() for name, _ in HOP_COLUMNS), **counts)
 
 @dataclass
-class HopData:
+class ConversionResult:
     """
-    Represents audio data for a single processing hop.
-    Our TimeBinner will aggregate several of these (8 with the default config) into a Sample.
+    Outcome of converting a single audio file.
+    Returned by convert_audio_file so that batch runs (including parallel ones) can report on every file.
+    """
+    audio_file: Path
+    status: str  # "converted", "skipped", "empty" or "failed"
+    message: str = ""
+    audio_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    timings: Optional[dict] = None  # seconds spent in each StageTimings stage (streaming conversions only)
+
+class StageTimings:
     """
-    left_freq: float
-    right_freq: float
-    left_sq: float
-    right_sq: float
-    num_samples: int
+    Wall clock time spent in each stage of a streaming conversion.
+    Stages measure only their own work, not time spent waiting for the stage before them.
+    """
+    STAGES = ("decode", "pitch", "binning", "normalise", "write")
+
+    def __init__(self, seconds=None):
+        self.seconds = dict(seconds) if seconds is not None else dict.fromkeys(self.STAGES, 0.0)
+
+    @contextmanager
+    def measure(self, stage):
+        """Add the time spent in the with block to a stage"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - start_time
+
+    @staticmethod
+    def format(seconds, audio_seconds):
+        """Describe a dict of stage timings, along with the overall realtime factor"""
+        total = sum(seconds.values())
+        stages = ", ".join(f"{stage} {seconds[stage]:.2f}s" for stage in StageTimings.STAGES)
+        realtime = f", {audio_seconds / total:.1f}x realtime" if total > 0 else ""
+        return f"{stages} (total {total:.2f}s{realtime})"
+
+def median_ignoring_zeros(grid):
+    """
+    Row-wise median of a 2D float32 array, ignoring any 0.0 values (and padding, which must be +inf).
+    Rows with no usable values give 0.0.
+    Matches np.median of each row's values exactly, including its float32 rounding.
+    """
+    grid = np.where(grid == 0.0, np.float32(np.inf), grid)
+    counts = np.sum(grid != np.inf, axis=1)
+    grid.sort(axis=1)
+    rows = np.arange(len(grid))
+    lower = grid[rows, np.maximum(counts - 1, 0) // 2]
+    upper = grid[rows, np.minimum(counts // 2, grid.shape[1] - 1)]
+    # np.median averages the middle pair in float32 (an odd count averages the middle value with itself)
+    return np.where(counts > 0, (lower + upper) / np.float32(2.0), np.float32(0.0))
+
+def fill_missing_frequencies(freqs, default=400.0):
+    """
+    Sensibly fill in any missing frequency values our pitch detector was unable to estimate (any
+    that were set to 0.0).
+    Gaps are filled by the last valid frequency we had. For gaps at the beginning of the audio, we
+    instead use the first valid frequency. If there are no valid frequencies at all, default is used.
+    """
+    valid = freqs != 0.0
+    if not valid.any():
+        return np.full_like(freqs, default)
+    # Index of the last valid value at or before each position, with leading gaps using the first valid value
+    first_valid = np.argmax(valid)
+    source_index = np.where(valid, np.arange(len(freqs)), 0)
+    source_index[:first_valid] = first_valid
+    np.maximum.accumulate(source_index, out=source_index)
+    return freqs[source_index]
+
+def fill_missing_sample_frequencies(samples, default=MISSING_FREQ_DEFAULT):
+    """Return a copy of our binned samples with missing frequencies filled in on both channels"""
+    samples = samples.copy()
+    samples["left_freq"] = fill_missing_frequencies(samples["left_freq"], default)
+    samples["right_freq"] = fill_missing_frequencies(samples["right_freq"], default)
+    return samples
 
 class TimeBinner:
     """
     Manages time-based binning (via audio frames) of amplitudes and frequencies.
-    Collects HopData into fixed-duration bins and computes aggregate Samples
-    when bins are complete.
+    Collects hop data into preallocated arrays, and computes the aggregate samples
+    for every fixed-duration bin at once when finalised.
     """
-    def __init__(self, bin_interval, sample_rate):
+    def __init__(self, bin_interval, sample_rate, expected_hops=1024):
         self.bin_interval = bin_interval
         self.frames_per_bin = int(bin_interval * sample_rate)
-        self.current_bin_end_frame = self.frames_per_bin
-        self.hop_data = []  # Stores HopData objects for current bin
-        self.binned_data = []  # Stores aggregated Sample objects
-    
-    def add_hop(self, current_frame, hop_data):
+        self.hops = HopBuffer(expected_hops)
+
+    def add_hop(self, current_frame, left_freq, right_freq, left_sq, right_sq, num_samples):
+        """Add the data for a single hop, hops must be added in frame order"""
+        self.hops.append(current_frame, left_freq, right_freq, left_sq, right_sq, num_samples)
+
+    def add_hops(self, block):
+        """Add every hop from a HopBlock, hops must be added in frame order"""
+        self.hops.extend(block)
+
+    def bin_hops(self):
         """
-        Add the hop data to the current bin if within time window,
-        otherwise finalise current bin and start new one
+        Aggregate the hops into bins, returning arrays of
+        (left median frequency, right median frequency, left RMS amplitude, right RMS amplitude).
+        Frequencies of 0.0 (where our pitch detector could not produce an acceptable estimate) are
+        ignored in the medians, and a bin with no valid frequencies gets 0.0.
         """
-        if current_frame < self.current_bin_end_frame:
-            self.hop_data.append(hop_data)
-            return False # Bin not finalised
-        
-        # Finalise current bin
-        self.finalise_bin()
-        
-        # Start new bin with current sample
-        self.hop_data = [hop_data]
-        self.current_bin_end_frame += self.frames_per_bin
-        return True # Bin was finalised
-    
-    def finalise_bin(self):
-        """Compute aggregate values for current bin and reset collection"""
-        if not self.hop_data:
-            # Handle empty bin by creating zero-value entry
-            binned_sample = Sample(0.0, 0.0, 0.0, 0.0)
-        else:
-            # print(f"Binning {len(self.hop_data)} samples")
-            
-            # Extract frequencies for median calculation, ignoring 0.0 values
-            # where our pitch detector could not produce an acceptable estimate
-            left_freqs = [h.left_freq for h in self.hop_data if h.left_freq != 0.0]
-            right_freqs = [h.right_freq for h in self.hop_data if h.right_freq != 0.0]
-            
-            # Sum squared amplitudes and sample counts
-            total_left_sq = sum(h.left_sq for h in self.hop_data)
-            total_right_sq = sum(h.right_sq for h in self.hop_data)
-            total_samples = sum(h.num_samples for h in self.hop_data)
-            
-            # Compute median frequencies
-            left_freq_med = np.median(left_freqs) if left_freqs else 0.0
-            right_freq_med = np.median(right_freqs) if right_freqs else 0.0
-            
-            # Calculate RMS amplitudes
-            left_amp = np.sqrt(total_left_sq / total_samples) if total_samples > 0 else 0.0
-            right_amp = np.sqrt(total_right_sq / total_samples) if total_samples > 0 else 0.0
-            
-            binned_sample = Sample(left_freq_med, right_freq_med, left_amp, right_amp)
-        
-        self.binned_data.append(binned_sample)
-        self.hop_data = []  # Reset current bin
-    
-    def finalise_all(self):
-        """Finalise any remaining samples in current bin and return binned data"""
-        if self.hop_data:
-            self.finalise_bin()
-        self.estimate_missing_frequencies()
-        return self.binned_data
-        
-    def estimate_missing_frequencies(self):
+        num_hops = self.hops.length
+        if num_hops == 0:
+            empty = np.zeros(0, dtype=np.float32)
+            return empty, empty, empty, empty
+
+        # Each bin is a run of consecutive hops starting within the same bin interval
+        bin_ids = self.hops.column("frames") // self.frames_per_bin
+        starts = np.flatnonzero(np.concatenate(([True], bin_ids[1:] != bin_ids[:-1])))
+        hops_per_bin = np.diff(np.append(starts, num_hops))
+        num_bins = len(starts)
+
+        # Lay the hops out in a (bins x hops per bin) grid, padding short bins
+        rows = np.repeat(np.arange(num_bins), hops_per_bin)
+        cols = np.arange(num_hops) - np.repeat(starts, hops_per_bin)
+        def to_grid(name, padding):
+            grid = np.full((num_bins, hops_per_bin.max()), padding, dtype=np.float32)
+            grid[rows, cols] = self.hops.column(name)
+            return grid
+
+        left_freq = median_ignoring_zeros(to_grid("left_freq", np.inf))
+        right_freq = median_ignoring_zeros(to_grid("right_freq", np.inf))
+
+        # Sum squared amplitudes hop by hop in float32, in the same order a sequential sum would
+        left_sq = to_grid("left_sq", 0.0)
+        right_sq = to_grid("right_sq", 0.0)
+        total_left_sq = left_sq[:, 0].copy()
+        total_right_sq = right_sq[:, 0].copy()
+        for col in range(1, left_sq.shape[1]):
+            total_left_sq += left_sq[:, col]
+            total_right_sq += right_sq[:, col]
+        total_samples = np.add.reduceat(self.hops.column("num_samples"), starts).astype(np.float32)
+
+        # Calculate RMS amplitudes
+        left_amp = np.sqrt(total_left_sq / total_samples)
+        right_amp = np.sqrt(total_right_sq / total_samples)
+
+        return left_freq, right_freq, left_amp, right_amp
+
+    def bin_samples(self):
         """
-        Sensibly fill in any missing frequency values our pitch detector was unable to estimate (any
-        that were set to 0.0).
-        Gaps are filled by the last valid frequency we had. For gaps at the beginning of the audio, we
-        instead use the first valid frequency.
+        Bin all of the hops and return the binned samples.
+        These use the HWL pulse layout, but hold frequencies in Hz (0.0 where missing) and RMS amplitudes.
         """
-        if not self.binned_data:
-            return
-        # Figure out what our initial fallback frequencies will be so that we can also replace leading zeros
-        last_valid_left = next((b.left_freq for b in self.binned_data if b.left_freq != 0.0), 400.0)
-        last_valid_right = next((b.right_freq for b in self.binned_data if b.right_freq != 0.0), 400.0)
-        
-        for bin in self.binned_data:
-            if bin.left_freq == 0.0:
-                bin.left_freq = last_valid_left
-            else:
-                last_valid_left = bin.left_freq
-            if bin.right_freq == 0.0:
-                bin.right_freq = last_valid_right
-            else:
-                last_valid_right = bin.right_freq
+        left_freq, right_freq, left_amp, right_amp = self.bin_hops()
+        samples = empty_hwl_array(len(left_freq))
+        samples["left_freq"] = left_freq
+        samples["right_freq"] = right_freq
+        samples["left_amp"] = left_amp
+        samples["right_amp"] = right_amp
+        return samples
+
+    def finalise_all(self):
+        """Bin all of the hops, fill in any missing frequencies and return the binned samples, ready to be normalised"""
+        return fill_missing_sample_frequencies(self.bin_samples())
 
-def get_percentile_maximum(samples, attr_name, percent):
+class SampleBlocks:
     """
-    Calculate the percentile maximum for a given attribute 
-    across left and right channels in a list of Samples.
+    Binned samples (see TimeBinner.bin_samples) read a block at a time, with missing frequencies filled in as
+    each block is read, exactly as fill_missing_sample_frequencies would fill them.
+    The samples may be an HwlArray or a view of a memory mapped HwlFile, so a long streaming conversion can be
+    normalised from its binned file without the whole of it ever being held in memory.
     """
-    left_vals = [getattr(s, f"left_{attr_name}") for s in samples]
-    right_vals = [getattr(s, f"right_{attr_name}") for s in samples]
-    max_val = np.maximum(np.percentile(left_vals, percent), 
-                         np.percentile(right_vals, percent))
-    return max_val
+    FREQ_NAMES = ("left_freq", "right_freq")
+
+    def __init__(self, samples, block_size=NORMALISE_BLOCK_SIZE, default=MISSING_FREQ_DEFAULT):
+        self.samples = samples
+        self.block_size = block_size
+        # Gaps at the beginning are filled with the first valid frequency, found by reading until every channel has one
+        self.first_freqs = dict.fromkeys(self.FREQ_NAMES, np.float32(default))
+        missing = set(self.FREQ_NAMES)
+        for block in self._raw_blocks():
+            for name in list(missing):
+                valid = np.flatnonzero(block[name] != 0.0)
+                if len(valid):
+                    self.first_freqs[name] = block[name][valid[0]]
+                    missing.discard(name)
+            if not missing:
+                break
+
+    def __len__(self):
+        return len(self.samples)
+
+    def _raw_blocks(self):
+        for start in range(0, len(self.samples), self.block_size):
+            yield self.samples[start:start + self.block_size]
+
+    def column_blocks(self, name):
+        """Yield the values of a single field (e.g. "left_amp") a block at a time, with missing frequencies filled in"""
+        last_freq = self.first_freqs.get(name)
+        for block in self._raw_blocks():
+            values = block[name]
+            if last_freq is not None:
+                # Starting from the last frequency of the previous block carries it across gaps that span blocks
+                values = fill_missing_frequencies(np.concatenate(([last_freq], values)))[1:]
+                last_freq = values[-1]
+            yield values
 
-def get_maximum(samples, attr_name):
+    def blocks(self):
+        """Yield the samples a block at a time, with missing frequencies filled in"""
+        names = self.samples.dtype.names
+        for columns in zip(*(self.column_blocks(name) for name in names)):
+            block = empty_hwl_array(len(columns[0]))
+            for name, values in zip(names, columns):
+                block[name] = values
+            yield block
+
+def float_sort_keys(values):
+    """Map float32 values to uint32 keys that sort in the same order as the values"""
+    bits = np.asarray(values, dtype=np.float32).view(np.uint32)
+    return np.where(bits >= 0x80000000, ~bits, bits | np.uint32(0x80000000))
+
+def floats_from_sort_keys(keys):
+    """The float32 values for keys from float_sort_keys"""
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.where(keys >= 0x80000000, keys & np.uint32(0x7FFFFFFF), ~keys).view(np.float32)
+
+def select_ranks(read_blocks, ranks):
     """
-    Calculate the maximum for a given attribute 
-    across left and right channels in a list of Samples.
+    Return the values at the given ranks (indexes into the values in ascending order) of the float32 values in
+    the blocks yielded by read_blocks(). Instead of sorting every value, this takes two passes over the blocks,
+    counting the values' sort keys by their high 16 bits, then counting the low 16 bits of just those keys that
+    share their high bits with one of the ranks' values.
     """
-    left_vals = [getattr(s, f"left_{attr_name}") for s in samples]
-    right_vals = [getattr(s, f"right_{attr_name}") for s in samples]
-    return max(max(left_vals), max(right_vals))
-    
-def get_minimum(samples, attr_name):
+    ranks = np.asarray(ranks, dtype=np.int64)
+    num_buckets = 1 << 16
+    high_counts = np.zeros(num_buckets, dtype=np.int64)
+    for block in read_blocks():
+        high_counts += np.bincount(float_sort_keys(block) >> 16, minlength=num_buckets)
+    high_totals = np.cumsum(high_counts)
+    highs = np.searchsorted(high_totals, ranks, side="right")
+    ranks_within_high = ranks - (high_totals[highs] - high_counts[highs])
+
+    selected_highs, rows = np.unique(highs, return_inverse=True)
+    low_counts = np.zeros((len(selected_highs), num_buckets), dtype=np.int64)
+    for block in read_blocks():
+        keys = float_sort_keys(block)
+        for row, high in enumerate(selected_highs):
+            low_counts[row] += np.bincount(keys[(keys >> 16) == high] & 0xFFFF, minlength=num_buckets)
+    lows = [np.searchsorted(np.cumsum(low_counts[row]), rank, side="right") for row, rank in zip(rows, ranks_within_high)]
+    return floats_from_sort_keys((selected_highs[rows] << 16) | np.array(lows, dtype=np.int64))
+
+def percentile_positions(count, percents):
+    """
+    Where np.percentile (with its default linear method) finds each percentile of count values: the ranks of
+    the values either side of it, and the weight given to the upper one.
+    """
+    quantiles = np.asarray(percents, dtype=np.float64) / 100.0
+    positions = count * quantiles + (1.0 - quantiles) - 1.0
+    lower = np.floor(positions)
+    weights = positions - lower
+    at_end = positions >= count - 1
+    lower = np.where(at_end, count - 1, lower).astype(np.int64)
+    upper = np.where(at_end, count - 1, lower + 1)
+    return lower, upper, weights
+
+def interpolate_percentiles(lower_values, upper_values, weights):
     """
-    Calculate the maximum for a given attribute 
-    across left and right channels in a list of Samples.
+    Interpolate between the float32 values either side of each percentile, rounding exactly as
+    np.percentile does when asked for a single percentile of float32 values.
     """
-    left_vals = [getattr(s, f"left_{attr_name}") for s in samples]
-    right_vals = [getattr(s, f"right_{attr_name}") for s in samples]
-    return min(min(left_vals), min(right_vals))
+    difference = upper_values - lower_values
+    return np.where(weights >= 0.5,
+                    upper_values - difference * (1.0 - weights).astype(np.float32),
+                    lower_values + difference * weights.astype(np.float32))
+
+def get_percentile_maxima(samples, attr_name, percents):
+    """
+    Calculate the maximum of the left and right channel percentiles, for several percentiles at once.
+    Reads the SampleBlocks a block at a time, returning (minimum, maximum, percentile maxima) of both channels.
+    """
+    count = len(samples)
+    lower, upper, weights = percentile_positions(count, percents)
+    ranks = np.concatenate(([0, count - 1], lower, upper))
+    minimum, maximum, maxima = None, None, None
+    for channel in ("left", "right"):
+        values = select_ranks(lambda: samples.column_blocks(f"{channel}_{attr_name}"), ranks)
+        percentiles = interpolate_percentiles(values[2:2 + len(lower)], values[2 + len(lower):], weights)
+        if maxima is None:
+            minimum, maximum, maxima = values[0], values[1], percentiles
+        else:
+            minimum, maximum, maxima = min(minimum, values[0]), max(maximum, values[1]), np.maximum(maxima, percentiles)
+    return minimum, maximum, maxima
 
 def choose_normalisation_maximum(samples, attr_name):
     """
     Try to figure out a good maximum value for normalisation that ensures
     outlier values won't blow out the scale.
+    samples is a SampleBlocks, or an HwlArray of binned samples.
     """
     max_outlier_percent = 2.0 # maximum percentage of outliers in our data
     # "known good" percentile threshold that definitely isn't outlier data
@@ -162,46 +452,107 @@ def choose_normalisation_maximum(samples, attr_name):
     max_allowed_ratio = 1.1
     # How much to step down the percentile by on each attempt to find a good value
     percentile_step = 0.5
-    
-    min = get_minimum(samples, attr_name)
-    max = get_maximum(samples, attr_name)
-    known_good_max = get_percentile_maximum(samples, attr_name, threshold_percentile)
-    print(f"{attr_name} min={min:.3f}, max={max:.3f}, {threshold_percentile:.0f}th percentile={known_good_max:.3f}")
-    
+
+    if not isinstance(samples, SampleBlocks):
+        samples = SampleBlocks(samples)
+
+    # Every percentile we might try, from 100 down to (but not including) our threshold
+    candidate_percentiles = []
     percentile = 100.0
     while percentile > threshold_percentile:
-        percentile_max = get_percentile_maximum(samples, attr_name, percentile)
-        # print(f"  Testing percentile {percentile} max = {percentile_max}")
+        candidate_percentiles.append(percentile)
+        percentile -= percentile_step
+
+    min, max, maxima = get_percentile_maxima(samples, attr_name, [threshold_percentile] + candidate_percentiles)
+    known_good_max = maxima[0]
+    print(f"{attr_name} min={min:.3f}, max={max:.3f}, {threshold_percentile:.0f}th percentile={known_good_max:.3f}")
+
+    for percentile_max in maxima[1:]:
         if percentile_max <= known_good_max * max_allowed_ratio:
             return percentile_max
-        percentile -= 0.5
     return known_good_max * max_allowed_ratio
 
-def normalise_value(value, min_val, max_val):
+def normalise_values(values, min_val, max_val):
     """
-    Normalise a single value to the range [0.0, 1.0] based on min_val and max_val.
+    Normalise an array of values to the range [0.0, 1.0] based on min_val and max_val.
     Clamps values outside the range to 0.0 or 1.0.
     """
     if max_val <= min_val:
-        return 0.0  # Avoid division by zero or negative range
-    
-    normalised = (value - min_val) / (max_val - min_val)
-    return max(0.0, min(1.0, normalised))
+        return np.zeros(len(values))  # Avoid division by zero or negative range
+
+    return np.clip((values - min_val) / (max_val - min_val), 0.0, 1.0)
 
 def normalise_samples(samples, min_amp, max_amp, min_freq, max_freq):
     """
-    Normalise amplitude and frequency values of Samples to the range [0.0, 1.0].
+    Normalise amplitude and frequency values of our binned samples to the range [0.0, 1.0],
+    returning an HwlArray of pulses.
     Values are clamped to [0.0, 1.0] if outside the provided ranges.
     """
-    return [
-        Sample(
-            left_freq=normalise_value(s.left_freq, min_freq, max_freq),
-            right_freq=normalise_value(s.right_freq, min_freq, max_freq),
-            left_amp=normalise_value(s.left_amp, min_amp, max_amp),
-            right_amp=normalise_value(s.right_amp, min_amp, max_amp)
-        )
-        for s in samples
-    ]
+    pulses = empty_hwl_array(len(samples))
+    for channel in ("left", "right"):
+        pulses[f"{channel}_freq"] = normalise_values(samples[f"{channel}_freq"], min_freq, max_freq)
+        pulses[f"{channel}_amp"] = normalise_values(samples[f"{channel}_amp"], min_amp, max_amp)
+    return pulses
+
+def render_hwl(binned_samples, destination_filename, timings = None):
+    """
+    Fill in missing frequencies, normalise our binned samples and write them as an HWL file.
+    This is done a block at a time (see SampleBlocks), with two passes over the samples for each
+    normalisation maximum and one more to write them. With StageTimings, the time spent is added to
+    its normalise and write stages.
+    """
+    if len(binned_samples) == 0:
+        raise ValueError("No samples to write")
+    if timings is None:
+        timings = StageTimings()
+
+    samples = SampleBlocks(binned_samples)
+    with timings.measure("normalise"):
+        max_amp = choose_normalisation_maximum(samples, "amp")
+        max_freq = choose_normalisation_maximum(samples, "freq")
+        if max_freq < MAX_FREQ_LOWER_LIMIT:
+            max_freq = MAX_FREQ_LOWER_LIMIT
+    print(f"Normalising amplitudes using 0-{max_amp:.3f} range, frequencies using 0-{max_freq:.3f}Hz range.")
+
+    print(f"Writing output file {destination_filename}")
+    writer = HwlWriter(destination_filename)
+    try:
+        blocks = samples.blocks()
+        while True:
+            # Reading each block and filling in its missing frequencies is part of normalising it
+            with timings.measure("normalise"):
+                block = next(blocks, None)
+                if block is None:
+                    break
+                pulses = normalise_samples(block, 0.0, max_amp, 0.0, max_freq)
+            with timings.measure("write"):
+                writer.write_array(pulses)
+        with timings.measure("write"):
+            writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+def save_sidecar(sidecar_filename, binned_samples, audio_file, params, content_hash=None):
+    """
+    Save our binned samples (before frequency gap filling and normalisation) to a compressed .npz sidecar,
+    along with what is needed to check it is still current: the analysis parameters and the audio's hash.
+    """
+    metadata = {"audio_file": audio_file.name, "params": params, "sha256": content_hash}
+    fd, temp_filename = tempfile.mkstemp(suffix=".npz", dir=sidecar_filename.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, samples=binned_samples, metadata=np.array(json.dumps(metadata)))
+        set_default_permissions(temp_filename)
+        os.replace(temp_filename, sidecar_filename)
+    except Exception:
+        os.unlink(temp_filename)
+        raise
+
+def load_sidecar(sidecar_filename):
+    """Load a sidecar saved by save_sidecar, returning (binned samples, metadata dict)"""
+    with np.load(sidecar_filename) as data:
+        return data["samples"], json.loads(str(data["metadata"]))
 
 def get_audio_files(folder_path):
     """
@@ -228,66 +579,223 @@ def write_output_file(destination_filename, samples):
     left_channel_frequency: 0.0 to 1.0
     right_channel_frequency: 0.0 to 1.0
     """
-    if not samples:
+    if len(samples) == 0:
         raise ValueError("No samples to write")
-    
-    with open(destination_filename, 'wb') as file:
-       file.write("YEAHBOI!".encode('utf-8'))
-       for s in samples:
-           file.write(struct.pack('<ffff', s.left_amp, s.right_amp, s.left_freq, s.right_freq))
 
-def convert_audio_file(audio_file, pulses_per_second = 40, pitch_detector_algorithm = "yinfft"):
+    write_hwl_array(destination_filename, samples)
+
+def hash_file(filename, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ConversionCache:
     """
-    Converts a single audio file into an HWL file
+    Persistent index of converted files, stored as JSON next to the audio library.
+
+    Each audio file's entry records the SHA-256 of its content and the conversion parameters used.
+    A conversion is up to date if both still match and its output exists. The file size and mtime
+    are also recorded, so unchanged files can be recognised without hashing them again.
+    Changes are saved at most every SAVE_INTERVAL seconds, call save() when finished to save the rest.
+    Safe to share between the threads that drive conversions.
     """
-    desired_interval = 1.0/pulses_per_second
-    window_size = 4096
-    hop_size = 128
-    discard_low_confidence = False  # Seems to work with "yin", confidence is broken for most other detectors
-    confidence_threshold = 0.3
-    pitch_detector_tolerance = 0.15
-    pitch_detector_silence_threshold = -50.0  # Docs say the Aubio default is -90, actually seems to be -50
-    sample_rate = 40960  # Gives exactly 8 hops per bin
-    # sample_rate = 44100
-    # sample_rate = 96000
-    max_freq_lower_limit = 800.0
-    nyquist_limit = sample_rate/2.0
+    SAVE_INTERVAL = 30.0
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+        self.root = self.filename.parent
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save_time = time.monotonic()
+        if self.filename.exists():
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (ValueError, OSError) as e:
+                print(f"Warning: Ignoring unreadable conversion cache {self.filename}: {e}")
+
+    def _key(self, audio_file):
+        return Path(os.path.relpath(audio_file, self.root)).as_posix()
+
+    def has_entry(self, audio_file):
+        with self.lock:
+            return self._key(audio_file) in self.entries
+
+    def content_hash(self, audio_file, stat):
+        """
+        Hash of an audio file, reusing the cached hash if its size and mtime are unchanged.
+        Returns (hash, True if the file had to be hashed).
+        """
+        with self.lock:
+            entry = self.entries.get(self._key(audio_file))
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"], False
+        return hash_file(audio_file), True
+
+    def is_fresh(self, audio_file, content_hash, params):
+        """True if audio_file was last converted from the same content with the same parameters"""
+        with self.lock:
+            entry = self.entries.get(self._key(audio_file))
+        return (entry is not None and entry["sha256"] == content_hash and entry["params"] == params
+                and audio_file.with_suffix('.hwl').exists())
+
+    def record(self, audio_file, content_hash, params, stat):
+        """Record a conversion (or confirm an existing one), saving the index if it is due"""
+        with self.lock:
+            self.entries[self._key(audio_file)] = {
+                "sha256": content_hash,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "params": params
+            }
+            self.dirty = True
+            if time.monotonic() - self.last_save_time >= self.SAVE_INTERVAL:
+                self._save()
+
+    def prune(self, audio_files):
+        """Remove the entries for any audio files not in audio_files, returning how many were removed"""
+        keep = {self._key(audio_file) for audio_file in audio_files}
+        with self.lock:
+            stale = [key for key in self.entries if key not in keep]
+            for key in stale:
+                del self.entries[key]
+            self.dirty = self.dirty or bool(stale)
+        return len(stale)
+
+    def save(self):
+        """Save any unsaved changes to the index"""
+        with self.lock:
+            if self.dirty:
+                self._save()
+
+    def _save(self):
+        # Write via a temporary file so an interrupted run can never leave a corrupted index
+        fd, temp_filename = tempfile.mkstemp(suffix=".json", dir=self.root)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "entries": self.entries}, f, indent=1, sort_keys=True)
+            set_default_permissions(temp_filename)
+            os.replace(temp_filename, self.filename)
+        except Exception:
+            os.unlink(temp_filename)
+            raise
+        self.dirty = False
+        self.last_save_time = time.monotonic()
+
+class HopAnalyser:
+    """
+    Pitch detection for both channels of an audio file, one full hop at a time.
+    Keeps the detection stats for every hop it has analysed.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.nyquist_limit = settings.sample_rate/2.0
+        self.pitch_detector_left = self._make_detector()
+        self.pitch_detector_right = self._make_detector()
+        self.count_pitch_values = 0
+        self.count_zero_values = 0
+        self.count_low_confidence = 0
+        self.count_nyquist = 0
+
+    def _make_detector(self):
+        detector = pitch(self.settings.algorithm, self.settings.window_size, self.settings.hop_size, self.settings.sample_rate)
+        detector.set_unit("Hz")
+        detector.set_silence(self.settings.silence_threshold)
+        return detector
+
+    def warm_up(self, left_frames, right_frames):
+        """Feed a hop through the detectors without using the results"""
+        self.pitch_detector_left(left_frames)
+        self.pitch_detector_right(right_frames)
+
+    def detect(self, left_frames, right_frames):
+        """
+        Return the (left, right) pitch of a full hop.
+        A pitch of 0.0 means our pitch detector could not produce an acceptable estimate.
+        """
+        settings = self.settings
+        left_pitch = self.pitch_detector_left(left_frames)[0]
+        right_pitch = self.pitch_detector_right(right_frames)[0]
+        self.count_pitch_values += 2
+        self.count_zero_values += (left_pitch == 0.0) + (right_pitch == 0.0)
+        if settings.discard_low_confidence:
+            # Set any pitch values we aren't confident in to 0.0
+            # Our binner will fill these gaps in later using the last valid value
+            left_confidence = self.pitch_detector_left.get_confidence()
+            right_confidence = self.pitch_detector_right.get_confidence()
+            if(left_confidence < settings.confidence_threshold and left_pitch != 0.0):
+                left_pitch = 0.0
+                self.count_low_confidence += 1
+            if(right_confidence < settings.confidence_threshold and right_pitch != 0.0):
+                right_pitch = 0.0
+                self.count_low_confidence += 1
+        # prune some occasional obviously broken frequency detector results
+        if(left_pitch > self.nyquist_limit):
+           left_pitch = 0.0
+           self.count_nyquist += 1
+        if(right_pitch > self.nyquist_limit):
+           right_pitch = 0.0
+           self.count_nyquist += 1
+        return left_pitch, right_pitch
+
+    def counts(self):
+        """Detection stats, as HopBlock fields"""
+        return dict(
+            count_pitch_values=int(self.count_pitch_values),
+            count_zero_values=int(self.count_zero_values),
+            count_low_confidence=self.count_low_confidence,
+            count_nyquist=self.count_nyquist
+        )
+
+def detect_segment(audio_file, settings, start_frame=0, stop_frame=None):
+    """
+    Run pitch detection and amplitude measurement over frames [start_frame, stop_frame) of an
+    audio file (to the end of the file if stop_frame is None), returning a HopBlock.
+
+    start_frame and stop_frame must be multiples of segment_alignment(), so that every hop starts on the
+    same frame as it would in a single pass over the whole file. Before start_frame the detectors are
+    warmed up on at least the preceding window_size frames, whose results are discarded. The detectors'
+    analysis windows then hold exactly the same audio as in a single pass.
+
+    Tolerance: for sources that seek sample accurately at the target sample rate (e.g. uncompressed WAV
+    at 40960Hz) the results are identical to a single pass. For resampled or compressed sources, decoding
+    after a seek can differ very slightly from continuous decoding. Any difference is confined to the
+    warm-up and the first window_size frames of the segment, which is at most the first 5 bins (0.1s)
+    after each segment boundary with the default settings.
+    """
+    hop_size = settings.hop_size
+    sample_rate = settings.sample_rate
     update_every_seconds = 300.0
-    src = None
-    count_total_hops = 0
-    count_pitch_values = 0
-    count_zero_values = 0
-    count_low_confidence = 0
-    count_nyquist = 0
+    alignment = segment_alignment(hop_size)
+    warmup_frames = min(start_frame, math.ceil(settings.window_size / alignment) * alignment)
 
-    print(f"\nProcessing {audio_file.name}")
-    destination_filename = audio_file.with_suffix('.hwl')
-    if destination_filename.exists():
-        print(f"Converted file already exists, skipping.")
-        return
+    src = source(str(audio_file), sample_rate, hop_size, channels=2)
     try:
-        src = source(str(audio_file), sample_rate, hop_size, channels=2)
-        print(f"Sample rate={src.samplerate}, Channels={src.channels}, Duration={src.duration}")
-        
-        pitch_detector_left = pitch(pitch_detector_algorithm, window_size, hop_size, sample_rate)
-        pitch_detector_left.set_unit("Hz")
-        pitch_detector_left.set_silence(pitch_detector_silence_threshold)
-        # pitch_detector_left.set_tolerance(pitch_detector_tolerance)
-        pitch_detector_right = pitch(pitch_detector_algorithm, window_size, hop_size, sample_rate)
-        pitch_detector_right.set_unit("Hz")
-        pitch_detector_right.set_silence(pitch_detector_silence_threshold)
-        # pitch_detector_right.set_tolerance(pitch_detector_tolerance)
-        
-        binner = TimeBinner(desired_interval, sample_rate)
-        current_frame = 0
-        last_update_time = 0
-
-        print("Detecting frequencies (this may take some time for long files)")
-        for frames in src:
-            num_frames = len(frames[0])
+        if start_frame > warmup_frames:
+            src.seek(start_frame - warmup_frames)
+        end_frame = stop_frame if stop_frame is not None else src.duration
+        hops = HopBuffer((end_frame - start_frame) // hop_size + 1)
+        analyser = HopAnalyser(settings)
+
+        current_frame = start_frame - warmup_frames
+        last_update_time = start_frame / float(sample_rate)
+        # Hops are read with do_multi() rather than by iterating over the source: leaving aubio's source
+        # iterator early (at stop_frame) crashes spawned worker processes
+        while stop_frame is None or current_frame < stop_frame:
+            frames, num_frames = src.do_multi()
             if num_frames == 0:
                 break
-            count_total_hops += 1
+            frames = frames[:, :num_frames]
+            if current_frame < start_frame:
+                # Warm up only, these hops belong to the previous segment
+                if num_frames == hop_size:
+                    analyser.warm_up(frames[0], frames[1])
+                current_frame += num_frames
+                continue
             current_time = current_frame / float(sample_rate)
             if current_time - last_update_time > update_every_seconds:
                 print(f"  ... still detecting frequencies ({current_time:.0f} seconds processed)")
@@ -300,67 +808,548 @@ def convert_audio_file(audio_file, pulses_per_second = 40, pitch_detector_algori
                 left_pitch = 0.0
                 right_pitch = 0.0
             else:
-                left_pitch = pitch_detector_left(frames[0])[0]
-                right_pitch = pitch_detector_right(frames[1])[0]
-                count_pitch_values += 2
-                count_zero_values += (left_pitch == 0.0) + (right_pitch == 0.0)
-                if discard_low_confidence:
-                    # Set any pitch values we aren't confident in to 0.0
-                    # Our binner will fill these gaps in later using the last valid value
-                    left_confidence = pitch_detector_left.get_confidence()
-                    right_confidence = pitch_detector_right.get_confidence()
-                    if(left_confidence < confidence_threshold and left_pitch != 0.0):
-                        left_pitch = 0.0
-                        count_low_confidence += 1
-                    if(right_confidence < confidence_threshold and right_pitch != 0.0):
-                        right_pitch = 0.0
-                        count_low_confidence += 1
-                # prune some occasional obviously broken frequency detector results
-                if(left_pitch > nyquist_limit):
-                   left_pitch = 0.0
-                   count_nyquist += 1
-                if(right_pitch > nyquist_limit):
-                   right_pitch = 0.0
-                   count_nyquist += 1
-            
-            hop_data = HopData(left_pitch, right_pitch, left_sq, right_sq, num_frames)
-            binner.add_hop(current_frame, hop_data)
+                left_pitch, right_pitch = analyser.detect(frames[0], frames[1])
+
+            hops.append(current_frame, left_pitch, right_pitch, left_sq, right_sq, num_frames)
             current_frame += num_frames
-        
-        binned_samples = binner.finalise_all()
-        if not binned_samples:
+    finally:
+        src.close()
+
+    return hops.to_block(**analyser.counts())
+
+def segment_alignment(hop_size):
+    """
+    Frame multiple that segment boundaries (and warm-up start points) must fall on.
+    Boundaries have to be on whole hops, and aubio's WAV reader only seeks correctly to multiples
+    of its internal 1024 frame read buffer.
+    """
+    return math.lcm(hop_size, 1024)
+
+def plan_segments(total_frames, hop_size, sample_rate, segment_seconds):
+    """
+    Split a file of total_frames frames into (start_frame, stop_frame) segments of roughly
+    segment_seconds each, with boundaries on multiples of segment_alignment(). The last segment
+    always runs to the end of the file (stop_frame None), in case the reported duration is not exact.
+    """
+    alignment = segment_alignment(hop_size)
+    segment_frames = max(1, int(segment_seconds * sample_rate) // alignment) * alignment
+    if segment_seconds <= 0 or total_frames <= segment_frames:
+        return [(0, None)]
+    starts = list(range(0, total_frames, segment_frames))
+    return [(start, start + segment_frames) for start in starts[:-1]] + [(starts[-1], None)]
+
+def stitch_hop_blocks(blocks):
+    """
+    Join the HopBlocks for consecutive segments into one, checking that each segment
+    starts on exactly the frame where the previous one ended.
+    """
+    blocks = [b for b in blocks if len(b.frames)]
+    for previous, block in zip(blocks, blocks[1:]):
+        if block.frames[0] != previous.end_frame:
+            raise ValueError(f"Segment starting at frame {block.frames[0]} does not follow on from frame {previous.end_frame}")
+    if not blocks:
+        return HopBlock.empty()
+    if len(blocks) == 1:
+        return blocks[0]
+    return HopBlock(
+        frames=np.concatenate([b.frames for b in blocks]),
+        left_freq=np.concatenate([b.left_freq for b in blocks]),
+        right_freq=np.concatenate([b.right_freq for b in blocks]),
+        left_sq=np.concatenate([b.left_sq for b in blocks]),
+        right_sq=np.concatenate([b.right_sq for b in blocks]),
+        num_samples=np.concatenate([b.num_samples for b in blocks]),
+        count_pitch_values=sum(b.count_pitch_values for b in blocks),
+        count_zero_values=sum(b.count_zero_values for b in blocks),
+        count_low_confidence=sum(b.count_low_confidence for b in blocks),
+        count_nyquist=sum(b.count_nyquist for b in blocks)
+    )
+
+@dataclass
+class StreamStats:
+    """Totals from a streaming analysis (see stream_analysis)"""
+    num_hops: int = 0
+    num_bins: int = 0
+    end_frame: int = 0
+    counts: dict = field(default_factory=dict)  # HopAnalyser.counts()
+    timings: dict = field(default_factory=dict)  # StageTimings.seconds
+
+def decode_blocks(audio_file, settings, timings, block_hops=STREAM_BLOCK_HOPS):
+    """
+    Streaming stage: decode an audio file, yielding (channels x frames) arrays of block_hops hops each.
+    Only the last block may be shorter. Reading many hops at a time is much cheaper than reading each
+    hop separately, and avoids aubio's WAV reader returning the wrong frames for short multichannel reads.
+    """
+    block_size = settings.hop_size * block_hops
+    src = source(str(audio_file), settings.sample_rate, block_size, channels=2)
+    try:
+        while True:
+            with timings.measure("decode"):
+                frames, num_frames = src.do_multi()
+            if num_frames == 0:
+                break
+            yield frames[:, :num_frames]
+            if num_frames < block_size:
+                break
+    finally:
+        src.close()
+
+def hop_square_sums(frames, hop_size):
+    """Sum of squared frames for each hop of a single channel block, the last hop may be partial"""
+    num_full = len(frames) // hop_size
+    sums = np.sum((frames[:num_full * hop_size]**2).reshape(num_full, hop_size), axis=1)
+    if len(frames) > num_full * hop_size:
+        sums = np.append(sums, np.sum(frames[num_full * hop_size:]**2))
+    return sums
+
+def detect_blocks(blocks, analyser, stats, timings):
+    """
+    Streaming stage: split decoded blocks into hops and analyse them, yielding a HopBlock per block.
+    Updates stats with the number of hops and frames analysed.
+    """
+    hop_size = analyser.settings.hop_size
+    for frames in blocks:
+        with timings.measure("pitch"):
+            left, right = frames[0], frames[1]
+            num_frames = len(left)
+            num_full = num_frames // hop_size
+            num_hops = -(-num_frames // hop_size)
+            left_freq = np.zeros(num_hops, dtype=np.float32)
+            right_freq = np.zeros(num_hops, dtype=np.float32)
+            # Only run pitch detection on full hops
+            for i in range(num_full):
+                hop = slice(i * hop_size, (i + 1) * hop_size)
+                left_freq[i], right_freq[i] = analyser.detect(left[hop], right[hop])
+            num_samples = np.full(num_hops, hop_size, dtype=np.int64)
+            num_samples[num_full:] = num_frames - num_full * hop_size
+            block = HopBlock(
+                frames=stats.end_frame + np.arange(num_hops, dtype=np.int64) * hop_size,
+                left_freq=left_freq,
+                right_freq=right_freq,
+                left_sq=hop_square_sums(left, hop_size),
+                right_sq=hop_square_sums(right, hop_size),
+                num_samples=num_samples
+            )
+            stats.num_hops += num_hops
+            stats.end_frame += num_frames
+        yield block
+
+def bin_blocks(hop_blocks, bin_interval, sample_rate, timings):
+    """
+    Streaming stage: bin hops as soon as each bin is complete, yielding binned samples (see TimeBinner.bin_samples).
+    Only the hops of the bin currently being filled are kept.
+    """
+    pending = HopBuffer()
+    frames_per_bin = int(bin_interval * sample_rate)
+    def bin_pending(count):
+        binner = TimeBinner(bin_interval, sample_rate, count)
+        binner.add_hops(pending.take(count))
+        return binner.bin_samples()
+
+    for block in hop_blocks:
+        if not len(block.frames):
+            continue
+        with timings.measure("binning"):
+            pending.extend(block)
+            # Hops from the bin containing the newest hop may still be followed by more
+            open_bin_start = (block.frames[-1] // frames_per_bin) * frames_per_bin
+            complete = int(np.searchsorted(pending.column("frames"), open_bin_start))
+            samples = bin_pending(complete) if complete else None
+        if samples is not None:
+            yield samples
+    if pending.length:
+        with timings.measure("binning"):
+            samples = bin_pending(pending.length)
+        yield samples
+
+def stream_analysis(audio_file, settings, bin_interval, binned_filename, progress_seconds=10.0):
+    """
+    Analyse an audio file with a pipeline of streaming stages (decode, pitch detection and binning), writing
+    the binned samples to binned_filename as they are completed. The binned file uses the HWL format but
+    holds unnormalised samples, like a sidecar. Memory use is bounded by the block size, not the file length.
+    Returns StreamStats, nothing is written if the file has no audio.
+    """
+    stats = StreamStats()
+    timings = StageTimings()
+    analyser = HopAnalyser(settings)
+    blocks = decode_blocks(audio_file, settings, timings)
+    bins = bin_blocks(detect_blocks(blocks, analyser, stats, timings), bin_interval, settings.sample_rate, timings)
+
+    start_time = time.perf_counter()
+    last_update_time = start_time
+    writer = HwlWriter(binned_filename)
+    try:
+        for samples in bins:
+            with timings.measure("write"):
+                writer.write_array(samples)
+            stats.num_bins += len(samples)
+            now = time.perf_counter()
+            if now - last_update_time >= progress_seconds:
+                audio_seconds = stats.end_frame / float(settings.sample_rate)
+                print(f"  ... {audio_seconds:.0f} seconds processed ({audio_seconds / (now - start_time):.1f}x realtime)")
+                last_update_time = now
+        if stats.num_bins:
+            with timings.measure("write"):
+                writer.close()
+        else:
+            writer.abort()
+    except BaseException:
+        writer.abort()
+        raise
+
+    stats.counts = analyser.counts()
+    stats.timings = timings.seconds
+    return stats
+
+def make_pitch_settings(pitch_detector_algorithm = "yinfft"):
+    """
+    Our pitch detection settings
+    """
+    window_size = 4096
+    hop_size = 128
+    discard_low_confidence = False  # Seems to work with "yin", confidence is broken for most other detectors
+    confidence_threshold = 0.3
+    pitch_detector_tolerance = 0.15
+    pitch_detector_silence_threshold = -50.0  # Docs say the Aubio default is -90, actually seems to be -50
+    sample_rate = 40960  # Gives exactly 8 hops per bin
+    # sample_rate = 44100
+    # sample_rate = 96000
+    return PitchSettings(
+        algorithm=pitch_detector_algorithm,
+        window_size=window_size,
+        hop_size=hop_size,
+        sample_rate=sample_rate,
+        silence_threshold=pitch_detector_silence_threshold,
+        discard_low_confidence=discard_low_confidence,
+        confidence_threshold=confidence_threshold
+    )
+
+def analysis_params(settings, pulses_per_second, stream = False):
+    """
+    Everything that affects our binned analysis data (the contents of a sidecar).
+    Streaming conversions decode in larger blocks, which can change what aubio reads from some files.
+    """
+    return dict(asdict(settings), converter_version=CONVERTER_VERSION, pulses_per_second=pulses_per_second,
+                decode_block_hops=STREAM_BLOCK_HOPS if stream else 1)
+
+def conversion_params(settings, pulses_per_second, stream = False):
+    """Everything that affects the output, for the conversion cache"""
+    return dict(analysis_params(settings, pulses_per_second, stream),
+                max_freq_lower_limit=MAX_FREQ_LOWER_LIMIT, missing_freq_default=MISSING_FREQ_DEFAULT)
+
+def convert_audio_file(audio_file, pulses_per_second = 40, pitch_detector_algorithm = "yinfft",
+                       executor = None, segment_seconds = 300.0, cache = None, force = False, sidecar = True,
+                       stream = False):
+    """
+    Converts a single audio file into an HWL file
+
+    If a process pool executor is supplied, pitch detection runs in it, with files longer than
+    segment_seconds split into segments that are analysed in parallel (see detect_segment).
+
+    With a ConversionCache, files are only converted if their content or the conversion parameters
+    changed since they were last converted. Files that are not in the cache are skipped if their
+    HWL file already exists, as they are without one, and added to the cache as if they were converted
+    with the current parameters, so that later changes to them are noticed. force converts every file regardless.
+
+    With sidecar set, the binned analysis data is also saved next to the audio file (see save_sidecar),
+    so that it can be renormalised later without repeating pitch detection.
+
+    With stream set, the file is analysed by the streaming pipeline instead (see stream_analysis), in a
+    single pass with bounded memory use, and the time spent in each stage is reported.
+    """
+    desired_interval = 1.0/pulses_per_second
+    settings = make_pitch_settings(pitch_detector_algorithm)
+    hop_size = settings.hop_size
+    sample_rate = settings.sample_rate
+    params = conversion_params(settings, pulses_per_second, stream)
+    src = None
+    binned_file = None
+    binned_filename = None
+
+    print(f"\nProcessing {audio_file.name}")
+    start_time = time.perf_counter()
+    destination_filename = audio_file.with_suffix('.hwl')
+    try:
+        in_cache = cache is not None and cache.has_entry(audio_file)
+        if not force and not in_cache and destination_filename.exists():
+            if cache is not None:
+                print("Converted file already exists, adding it to the conversion cache and skipping.")
+                stat = audio_file.stat()
+                cache.record(audio_file, hash_file(audio_file), params, stat)
+            else:
+                print("Converted file already exists, skipping.")
+            return ConversionResult(audio_file, "skipped", "Converted file already exists")
+        if cache is not None:
+            stat = audio_file.stat()
+            content_hash, rehashed = cache.content_hash(audio_file, stat)
+            if not force and in_cache:
+                if cache.is_fresh(audio_file, content_hash, params):
+                    print("Unchanged since it was last converted, skipping.")
+                    if rehashed:
+                        # Touched but not modified, update the size and mtime so it need not be hashed next time
+                        cache.record(audio_file, content_hash, params, stat)
+                    return ConversionResult(audio_file, "skipped", "Unchanged since last conversion")
+                print("Audio or conversion settings changed since it was last converted, rebuilding.")
+
+        src = source(str(audio_file), sample_rate, hop_size, channels=2)
+        print(f"Sample rate={src.samplerate}, Channels={src.channels}, Duration={src.duration}")
+        total_frames = src.duration
+        src.close()
+        src = None
+
+        timings = None
+        if stream:
+            # Binned samples are written to a temporary file as they are completed, then normalised from its
+            # memory mapping a block at a time (the sidecar is saved from the mapping in chunks too)
+            fd, binned_filename = tempfile.mkstemp(suffix=".hwl", dir=destination_filename.parent)
+            os.close(fd)
+            print("Detecting frequencies (streaming)")
+            if executor is None:
+                stats = stream_analysis(audio_file, settings, desired_interval, binned_filename)
+            else:
+                stats = executor.submit(stream_analysis, audio_file, settings, desired_interval, binned_filename).result()
+            timings = StageTimings(stats.timings)
+            if stats.num_bins:
+                binned_file = HwlFile(binned_filename)
+                binned_samples = binned_file.read_array()
+            else:
+                binned_samples = empty_hwl_array(0)
+            num_hops, counts = stats.num_hops, stats.counts
+            audio_seconds = stats.end_frame / float(sample_rate)
+        else:
+            print("Detecting frequencies (this may take some time for long files)")
+            if executor is None:
+                hops = detect_segment(audio_file, settings)
+            else:
+                segments = plan_segments(total_frames, hop_size, sample_rate, segment_seconds)
+                if len(segments) > 1:
+                    print(f"  ... split into {len(segments)} segments for parallel detection")
+                futures = [executor.submit(detect_segment, audio_file, settings, start, stop) for start, stop in segments]
+                hops = stitch_hop_blocks([f.result() for f in futures])
+
+            binner = TimeBinner(desired_interval, sample_rate, len(hops.frames))
+            binner.add_hops(hops)
+            
+            binned_samples = binner.bin_samples()
+            num_hops, counts = len(hops.frames), hops.counts()
+            audio_seconds = (hops.end_frame or 0) / float(sample_rate)
+        if len(binned_samples) == 0:
             print("No data collected, skipping file.")
-            return
+            return ConversionResult(audio_file, "empty", "No data collected", audio_seconds, time.perf_counter() - start_time)
     
-        print(f"Pitch detection stats. Total hops={count_total_hops}, total values={count_pitch_values}, zero values={count_zero_values}, low confidence values={count_low_confidence}, Nyquist limit exceeded={count_nyquist}.")
+        print(f"Pitch detection stats. Total hops={num_hops}, total values={counts['count_pitch_values']}, zero values={counts['count_zero_values']}, low confidence values={counts['count_low_confidence']}, Nyquist limit exceeded={counts['count_nyquist']}.")
         print(f"Binned length {len(binned_samples)}")
+        if sidecar:
+            save_sidecar(audio_file.with_suffix(SIDECAR_SUFFIX), binned_samples, audio_file,
+                         analysis_params(settings, pulses_per_second, stream), content_hash if cache is not None else None)
 
-        max_amp = choose_normalisation_maximum(binned_samples, "amp")
-        max_freq = choose_normalisation_maximum(binned_samples, "freq")
-        if max_freq < max_freq_lower_limit:
-            max_freq = max_freq_lower_limit
-        
-        print(f"Normalising amplitudes using 0-{max_amp:.3f} range, frequencies using 0-{max_freq:.3f}Hz range.")
-        normalised_samples = normalise_samples(binned_samples, 0.0, max_amp, 0.0, max_freq)
-        
-        print(f"Writing output file {destination_filename}")
-        write_output_file(destination_filename, normalised_samples)
+        render_hwl(binned_samples, destination_filename, timings)
+        if timings is not None:
+            print(f"Stage timings: {StageTimings.format(timings.seconds, audio_seconds)}")
+        if cache is not None:
+            cache.record(audio_file, content_hash, params, stat)
+        return ConversionResult(audio_file, "converted", "", audio_seconds, time.perf_counter() - start_time,
+                                timings.seconds if timings is not None else None)
     except Exception as e:
         print(f"Error processing {audio_file.name}: {str(e)}")
+        return ConversionResult(audio_file, "failed", str(e), elapsed_seconds=time.perf_counter() - start_time)
     finally:
         if src is not None:
             src.close()
-        pitch_detector_left = None
-        pitch_detector_right = None
+        binned_samples = None
+        if binned_file is not None:
+            binned_file.close()
+        if binned_filename is not None and os.path.exists(binned_filename):
+            os.unlink(binned_filename)
         gc.collect()
 
-audio_directory = "audio"
-audio_files = get_audio_files(audio_directory)
-print("Files to be processed:")
-print(audio_files)
-for audio_file in audio_files:
+def renormalise_file(sidecar_filename, cache = None):
+    """
+    Regenerate an HWL file from the binned analysis data in its sidecar, applying the current
+    normalisation settings without repeating pitch detection.
+    """
+    print(f"\nRenormalising {sidecar_filename.name}")
+    start_time = time.perf_counter()
+    try:
+        binned_samples, metadata = load_sidecar(sidecar_filename)
+        audio_file = sidecar_filename.parent / metadata["audio_file"]
+        settings = make_pitch_settings(metadata["params"]["algorithm"])
+        pulses_per_second = metadata["params"]["pulses_per_second"]
+        stream = metadata["params"].get("decode_block_hops", 1) != 1
+        audio_seconds = len(binned_samples) / float(pulses_per_second)
+        if metadata["params"] != analysis_params(settings, pulses_per_second, stream):
+            print("Analysis settings have changed since the sidecar was saved, skipping. A full conversion is needed.")
+            return ConversionResult(audio_file, "skipped", "Sidecar is out of date")
+
+        content_hash = metadata.get("sha256")
+        update_cache = cache is not None and content_hash is not None and audio_file.exists()
+        if update_cache:
+            stat = audio_file.stat()
+            if cache.content_hash(audio_file, stat)[0] != content_hash:
+                print("Audio has changed since the sidecar was saved, skipping. A full conversion is needed.")
+                return ConversionResult(audio_file, "skipped", "Sidecar is out of date")
+
+        render_hwl(binned_samples, audio_file.with_suffix('.hwl'))
+        if update_cache:
+            cache.record(audio_file, content_hash, conversion_params(settings, pulses_per_second, stream), stat)
+        return ConversionResult(audio_file, "converted", "Renormalised", audio_seconds, time.perf_counter() - start_time)
+    except Exception as e:
+        print(f"Error renormalising {sidecar_filename.name}: {str(e)}")
+        return ConversionResult(sidecar_filename, "failed", str(e), elapsed_seconds=time.perf_counter() - start_time)
+
+def remove_duplicate_outputs(audio_files):
+    """
+    Drop any audio files that would be converted to the same HWL file as an earlier one
+    (e.g. "song.mp3" and "song.flac"), so that parallel workers never race on one output.
+    """
+    claimed = {}
+    unique_files = []
+    for audio_file in audio_files:
+        destination = audio_file.with_suffix('.hwl').resolve()
+        if destination in claimed:
+            print(f"Ignoring {audio_file}, it would overwrite the output of {claimed[destination]}")
+            continue
+        claimed[destination] = audio_file
+        unique_files.append(audio_file)
+    return unique_files
+
+def convert_audio_files(audio_files, jobs=1, segment_seconds=300.0, **convert_args):
+    """
+    Convert a list of audio files, using a pool of jobs worker processes if jobs > 1.
+    In serial mode segment_seconds is ignored, and every file is analysed in a single pass.
+    Returns a ConversionResult for every file, in the same order as audio_files.
+    """
+    convert_args["segment_seconds"] = segment_seconds
+    if jobs <= 1:
+        results = []
+        for audio_file in audio_files:
+            results.append(convert_audio_file(audio_file, **convert_args))
+            gc.collect()
+        return results
+
+    # Each file is driven from a thread in this process, while all of the pitch detection
+    # (the expensive part) runs in a shared process pool, split into segments for long files.
+    results = []
+    # Worker processes are spawned rather than forked, forking a process that is running threads is unsafe
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as executor, ThreadPoolExecutor(max_workers=jobs) as threads:
+        futures = [
+            threads.submit(convert_audio_file, audio_file, executor=executor, **convert_args)
+            for audio_file in audio_files
+        ]
+        for audio_file, future in zip(audio_files, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error processing {audio_file.name}: {str(e)}")
+                results.append(ConversionResult(audio_file, "failed", str(e)))
+    return results
+
+def print_summary(results, elapsed_seconds):
+    """Print per-file results and overall throughput for a batch"""
+    print("\nSummary:")
+    for result in results:
+        detail = f" ({result.message})" if result.message else ""
+        print(f"  {result.status:<9} {result.audio_file}{detail}")
+
+    counts = {status: sum(r.status == status for r in results) for status in ("converted", "skipped", "empty", "failed")}
+    audio_seconds = sum(r.audio_seconds for r in results)
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    print(f"Processed {audio_seconds:.0f} seconds of audio in {elapsed_seconds:.1f} seconds", end="")
+    if elapsed_seconds > 0:
+        print(f" ({audio_seconds / elapsed_seconds:.1f}x realtime, {len(results) / elapsed_seconds * 60.0:.1f} files/minute)")
+    else:
+        print()
+
+    streamed = [r for r in results if r.timings is not None]
+    if streamed:
+        totals = {stage: sum(r.timings[stage] for r in streamed) for stage in StageTimings.STAGES}
+        print(f"Stage totals: {StageTimings.format(totals, sum(r.audio_seconds for r in streamed))}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert audio files into HWL files.")
+    parser.add_argument(
+        "directory",
+        nargs="?",
+        default="audio",
+        help="The directory containing the audio files, searched recursively (default: 'audio')"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes, 0 to use every CPU core (default: 1)"
+    )
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        default=300.0,
+        help="With more than one job, split files longer than this into segments that are analysed in parallel, 0 to disable (default: 300)"
+    )
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Convert every file, even if it is unchanged since it was last converted."
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Analyse each file in a single streaming pass with bounded memory use, reporting the time spent in each stage. With --jobs, files rather than segments are analysed in parallel."
+    )
+    parser.add_argument(
+        "--no-sidecar",
+        action="store_true",
+        help=f"Don't save each file's binned analysis data to a {SIDECAR_SUFFIX} sidecar."
+    )
+    parser.add_argument(
+        "--renormalise",
+        action="store_true",
+        help=f"Regenerate HWL files from their {SIDECAR_SUFFIX} sidecars using the current normalisation settings, without repeating pitch detection."
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Don't use the conversion cache ({CACHE_FILENAME} in the audio directory), just skip files that already have an HWL file."
+    )
+    args = parser.parse_args()
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+
+    cache = None if args.no_cache else ConversionCache(Path(args.directory) / CACHE_FILENAME)
+
+    if args.renormalise:
+        start_time = time.perf_counter()
+        sidecar_files = sorted(Path(args.directory).rglob(f"*{SIDECAR_SUFFIX}"))
+        try:
+            results = [renormalise_file(sidecar_file, cache) for sidecar_file in sidecar_files]
+        finally:
+            if cache is not None:
+                cache.save()
+        print_summary(results, time.perf_counter() - start_time)
+        if any(r.status == "failed" for r in results):
+            sys.exit(1)
+        return
+
+    audio_files = remove_duplicate_outputs(get_audio_files(args.directory))
+    print("Files to be processed:")
+    print(audio_files)
+
+    start_time = time.perf_counter()
     # Currently pulses_per_second must be 40
     # Other pitch detector options like "yin" or "schmitt" may work better or worse
     # depending on the files
-    convert_audio_file(audio_file, pulses_per_second = 40, pitch_detector_algorithm = "yinfft")
-    gc.collect()
\ No newline at end of file
+    try:
+        results = convert_audio_files(audio_files, jobs, args.segment_seconds, cache = cache, force = args.force,
+                                      sidecar = not args.no_sidecar, stream = args.stream, pulses_per_second = 40, pitch_detector_algorithm = "yinfft")
+        if cache is not None:
+            removed = cache.prune(audio_files)
+            if removed:
+                print(f"Removed {removed} deleted files from the conversion cache")
+    finally:
+        if cache is not None:
+            cache.save()
+    print_summary(results, time.perf_counter() - start_time)
+
+    if any(r.status == "failed" for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 import argparse
-from libhwl import read_hwl_file, write_hwl_file, HWL_PULSES_PER_SECOND, Pulse
+import os
+from contextlib import ExitStack
+from typing import Optional
+from libhwl import (HWL_COMPACT_CODECS, HWL_COMPACT_HEADER, HWL_COMPACT_STRUCT, HWL_HEADER_SIZE, HWL_PULSE_SIZE,
+                    HWL_PULSES_PER_SECOND, HwlFile, HwlWriter, encode_compact_hwl, read_compact_hwl_header,
+                    read_hwl_array, write_hwl_array)
+from libfunscript import FunscriptSettings, render_funscript_file
 
 def parse_time(value: str) -> float:
     """
@@ -61,75 +67,134 @@ def format_duration(seconds: float) -> str:
     else:
         return f"{minutes:02d}:{sec_str}"
 
+def open_input(stack: ExitStack, filename: str):
+    """
+    Open an input file for the editing commands. Standard HWL files are memory mapped (an HwlFile), compact
+    HWL files have to be decoded, so are read into memory (an HwlArray). Either way the output is standard HWL.
+    """
+    if is_compact_file(filename):
+        return read_hwl_array(filename)
+    return stack.enter_context(HwlFile(filename))
+
+def copy_input(writer: HwlWriter, source, start: int = 0, stop: Optional[int] = None):
+    """Append pulses [start, stop) of an input opened by open_input"""
+    if isinstance(source, HwlFile):
+        writer.copy_from(source, start, stop)
+    else:
+        writer.write_array(source[start:stop])
+
 def cmd_silence(args):
     """Silence command"""
-    pulses = read_hwl_file(args.infile)
-
     duration_sec = parse_time(args.duration)
     silence_pulses = int(round(duration_sec * HWL_PULSES_PER_SECOND))
     if silence_pulses <= 0:
         raise ValueError("Silence duration is too short to produce any pulses")
-    
-    # Create silence pulses (all fields zero)
-    silence = [
-        Pulse(0.0, 0.0, 0.0, 0.0)
-        for _ in range(silence_pulses)
-    ]
 
-    output = pulses + silence
-    write_hwl_file(args.out, output)
+    # Copy the base file and add silence pulses (all fields zero)
+    with ExitStack() as stack:
+        base = open_input(stack, args.infile)
+        writer = stack.enter_context(HwlWriter(args.out))
+        copy_input(writer, base)
+        writer.write_silence(silence_pulses)
 
 def cmd_append(args):
     """Append command"""
-    base_pulses = read_hwl_file(args.infile)
-    add_pulses = read_hwl_file(args.add)
+    with ExitStack() as stack:
+        base = open_input(stack, args.infile)
+        add = open_input(stack, args.add)
+        writer = stack.enter_context(HwlWriter(args.out))
+        copy_input(writer, base)
 
-    output = base_pulses[:]
+        for _ in range(args.repeats):
+            copy_input(writer, add)
 
-    for _ in range(args.repeats):
-        output.extend(add_pulses)
-
-    write_hwl_file(args.out, output)
+def cmd_concat(args):
+    """Concat command"""
+    with ExitStack() as stack:
+        # Open (and validate) every input before writing anything
+        inputs = [open_input(stack, f) for f in args.infiles]
+        writer = stack.enter_context(HwlWriter(args.out))
+        for hwl in inputs:
+            copy_input(writer, hwl)
     
 def cmd_extract(args):
     """Extract command"""
-    pulses = read_hwl_file(args.infile)
-
-    start_sec = parse_time(args.start)
-    end_sec = parse_time(args.end) if args.end is not None else None
+    with ExitStack() as stack:
+        hwl = open_input(stack, args.infile)
+        num_pulses = len(hwl)
 
-    # Convert to pulse indices (pulses are 1/40th of a second)
-    # Start time is inclusive and end time is exclusive if specified
-    start_index = int(start_sec * HWL_PULSES_PER_SECOND)
+        start_sec = parse_time(args.start)
+        end_sec = parse_time(args.end) if args.end is not None else None
 
-    if end_sec is not None:
-        end_index = int(end_sec * HWL_PULSES_PER_SECOND) - 1
-    else:
-        end_index = len(pulses) - 1
-
-    if start_index < 0 or start_index >= len(pulses):
-        raise ValueError("Start time is outside the source file")
-        
-    if end_index < 0 or end_index >= len(pulses):
-        raise ValueError("End time is outside the source file")
+        # Convert to pulse indices (pulses are 1/40th of a second)
+        # Start time is inclusive and end time is exclusive if specified
+        start_index = int(start_sec * HWL_PULSES_PER_SECOND)
 
-    if end_index < start_index:
-        raise ValueError("End time is earlier than start time")
+        if end_sec is not None:
+            end_index = int(end_sec * HWL_PULSES_PER_SECOND) - 1
+        else:
+            end_index = num_pulses - 1
 
-    extracted = pulses[start_index : end_index + 1]
+        if start_index < 0 or start_index >= num_pulses:
+            raise ValueError("Start time is outside the source file")
+            
+        if end_index < 0 or end_index >= num_pulses:
+            raise ValueError("End time is outside the source file")
 
-    if not extracted:
-        raise ValueError("No pulses extracted (empty range)")
+        if end_index < start_index:
+            raise ValueError("End time is earlier than start time")
 
-    write_hwl_file(args.out, extracted)
+        # Only the extracted range is read from a standard HWL source file
+        with HwlWriter(args.out) as writer:
+            copy_input(writer, hwl, start_index, end_index + 1)
     
     
+# Pulses compressed by info --estimate-ratio (10 minutes)
+RATIO_SAMPLE_PULSES = 10 * 60 * HWL_PULSES_PER_SECOND
+
+
+def is_compact_file(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(HWL_HEADER_SIZE) == HWL_COMPACT_HEADER
+
+
+def describe_compact(bits: int, delta: bool, codec: str) -> str:
+    return f"{bits} bit{', delta' if delta else ''}, {codec}"
+
+
+def cmd_compress(args):
+    """Compress command"""
+    pulses = read_hwl_array(args.infile)
+    if len(pulses) == 0:
+        raise ValueError("No pulses to write")
+    delta = not args.no_delta
+    data = encode_compact_hwl(pulses, args.bits, delta, args.codec)
+    with open(args.out, 'wb') as f:
+        f.write(data)
+    original_size = os.path.getsize(args.infile)
+    print(f"{args.infile}: {original_size} -> {len(data)} bytes ({describe_compact(args.bits, delta, args.codec)}), "
+          f"ratio {original_size / len(data):.2f}")
+
+
+def cmd_decompress(args):
+    """Decompress command"""
+    write_hwl_array(args.out, read_hwl_array(args.infile))
+
+
 def cmd_info(args):
     """Info command"""
-    pulses = read_hwl_file(args.infile)
-    
+    file_size = os.path.getsize(args.infile)
+    compact = None
+    if is_compact_file(args.infile):
+        with open(args.infile, 'rb') as f:
+            compact = read_compact_hwl_header(f.read(HWL_COMPACT_STRUCT.size), args.infile)
+        duration_pulses = compact["num_pulses"]
+    else:
+        # Pulse count comes from the file size, no pulse data needs to be read
+        with HwlFile(args.infile) as hwl:
+            duration_pulses = len(hwl)
+
     # Calculate durations
-    duration_pulses = len(pulses)
     duration_seconds = duration_pulses / HWL_PULSES_PER_SECOND
     human_duration = format_duration(duration_seconds)
     
@@ -141,6 +206,37 @@ def cmd_info(args):
     print(f"Duration (seconds): {duration_seconds:.2f}")
     print(f"Duration (readable): {human_duration}")
 
+    plain_size = HWL_HEADER_SIZE + duration_pulses * HWL_PULSE_SIZE
+    if compact is not None:
+        print(f"Format: compact HWL ({describe_compact(compact['bits'], compact['delta'], compact['codec'])})")
+        print(f"Compression ratio: {plain_size / file_size:.2f} ({file_size} bytes, {plain_size} uncompressed)")
+    else:
+        print("Format: HWL")
+        if args.estimate_ratio and duration_pulses:
+            # Compress (at most) the start of the file in memory, to estimate what the compress command would save
+            sample_pulses = min(duration_pulses, RATIO_SAMPLE_PULSES)
+            with HwlFile(args.infile) as hwl:
+                sample_size = len(encode_compact_hwl(hwl.read_array(0, sample_pulses)))
+            print(f"Estimated compression ratio: {sample_pulses * HWL_PULSE_SIZE / sample_size:.2f} "
+                  f"(as compact HWL, {describe_compact(16, True, 'zlib')}, "
+                  f"from the first {format_duration(sample_pulses / HWL_PULSES_PER_SECOND)})")
+
+
+def cmd_render(args):
+    """Render command"""
+    settings = FunscriptSettings(
+        volume=args.volume,
+        positional_effect_strength=args.positional_effect_strength,
+        directional_freq_shift=args.directional_freq_shift,
+        freq_energy_proportion=args.freq_energy_proportion,
+        flip_directional_freq_shift=args.flip_directional_freq_shift,
+        normalise_axes=not args.no_normalise,
+        smoothing_sigma=args.smoothing_sigma,
+        positional_effect_curve=args.positional_effect_curve,
+    )
+    num_pulses = render_funscript_file(args.infile, args.out, settings)
+    print(f"{args.infile}: {num_pulses} pulses ({format_duration(num_pulses / HWL_PULSES_PER_SECOND)})")
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -152,33 +248,82 @@ def main():
 
     # silence command
     silence_parser = subparsers.add_parser("silence", help="Append silence to an HWL file")
-    silence_parser.add_argument("--in", dest="infile", required=True, help="Base HWL file")
+    silence_parser.add_argument("--in", dest="infile", required=True, help="Base HWL file (standard or compact)")
     silence_parser.add_argument("--duration", required=True, help="Duration of silence to add (e.g. 1.5, 2, 1:00)")
     silence_parser.add_argument("--out", required=True, help="Output HWL file")
     silence_parser.set_defaults(func=cmd_silence)
     
     # append command
     append_parser = subparsers.add_parser("append", help="Append one HWL file to another")
-    append_parser.add_argument("--in", dest="infile", required=True, help="Base HWL file")
-    append_parser.add_argument("--add", required=True, help="HWL file to append")
+    append_parser.add_argument("--in", dest="infile", required=True, help="Base HWL file (standard or compact)")
+    append_parser.add_argument("--add", required=True, help="HWL file to append (standard or compact)")
     append_parser.add_argument("--out", required=True, help="Output HWL file")
     append_parser.add_argument(
         "--repeats", "-r", type=int, default=1,
         help="Number of times to append the add file (default: 1)"
     )
     append_parser.set_defaults(func=cmd_append)
+
+    # concat command
+    concat_parser = subparsers.add_parser("concat", help="Join several HWL files together in order")
+    concat_parser.add_argument("infiles", nargs="+", help="HWL files to join (standard or compact)")
+    concat_parser.add_argument("--out", required=True, help="Output HWL file")
+    concat_parser.set_defaults(func=cmd_concat)
     
     # extract command
     extract_parser = subparsers.add_parser("extract", help="Extract a section of an HWL file")
-    extract_parser.add_argument("--in", dest="infile", required=True, help="Source HWL file")
+    extract_parser.add_argument("--in", dest="infile", required=True, help="Source HWL file (standard or compact)")
     extract_parser.add_argument("--start", required=True, help="Start time (e.g. 20, 32.25, 5:25)")
     extract_parser.add_argument("--end", help="End time (uses end of file if not supplied)")
     extract_parser.add_argument("--out", required=True, help="Output HWL file")
     extract_parser.set_defaults(func=cmd_extract)
     
+    # compress command
+    compress_parser = subparsers.add_parser("compress", help="Convert an HWL file to a smaller compact HWL file")
+    compress_parser.add_argument("--in", dest="infile", required=True, help="Source HWL file")
+    compress_parser.add_argument("--out", required=True, help="Output compact HWL file")
+    compress_parser.add_argument(
+        "--bits", type=int, choices=[8, 16], default=16,
+        help="Bits per value, 16 is indistinguishable from the original (default: 16)"
+    )
+    compress_parser.add_argument("--codec", choices=list(HWL_COMPACT_CODECS), default="zlib",
+                                 help="Compression applied to the quantised values (default: zlib)")
+    compress_parser.add_argument("--no-delta", action="store_true", help="Store values rather than differences")
+    compress_parser.set_defaults(func=cmd_compress)
+
+    # decompress command
+    decompress_parser = subparsers.add_parser("decompress", help="Convert a compact HWL file back to a standard HWL file")
+    decompress_parser.add_argument("--in", dest="infile", required=True, help="Source compact HWL file")
+    decompress_parser.add_argument("--out", required=True, help="Output HWL file")
+    decompress_parser.set_defaults(func=cmd_decompress)
+
+    # render command
+    defaults = FunscriptSettings()
+    render_parser = subparsers.add_parser("render", help="Render a funscript to an HWL file, as the app would play it")
+    render_parser.add_argument("--in", dest="infile", required=True, help="Source funscript file")
+    render_parser.add_argument("--out", required=True, help="Output HWL file")
+    render_parser.add_argument("--volume", type=float, default=defaults.volume,
+                               help=f"Funscript volume (default: {defaults.volume})")
+    render_parser.add_argument("--positional-effect-strength", type=float, default=defaults.positional_effect_strength,
+                               help=f"Positional effect strength (default: {defaults.positional_effect_strength})")
+    render_parser.add_argument("--positional-effect-curve", type=float, default=defaults.positional_effect_curve,
+                               help=f"Positional effect curve (default: {defaults.positional_effect_curve})")
+    render_parser.add_argument("--directional-freq-shift", type=float, default=defaults.directional_freq_shift,
+                               help=f"Directional frequency shift (default: {defaults.directional_freq_shift})")
+    render_parser.add_argument("--flip-directional-freq-shift", action="store_true",
+                               help="Flip the direction of the directional frequency shift")
+    render_parser.add_argument("--freq-energy-proportion", type=float, default=defaults.freq_energy_proportion,
+                               help=f"Proportion of frequency from energy (default: {defaults.freq_energy_proportion})")
+    render_parser.add_argument("--smoothing-sigma", type=float, default=defaults.smoothing_sigma,
+                               help=f"Energy smoothing in seconds (default: {defaults.smoothing_sigma})")
+    render_parser.add_argument("--no-normalise", action="store_true", help="Don't normalise the range of each axis")
+    render_parser.set_defaults(func=cmd_render)
+
     # info command
     info_parser = subparsers.add_parser("info", help="Get information about an HWL file")
     info_parser.add_argument("--in", dest="infile", required=True, help="HWL file to get info on")
+    info_parser.add_argument("--estimate-ratio", action="store_true",
+                             help="For a standard HWL file, estimate how much the compress command would shrink it")
     info_parser.set_defaults(func=cmd_info)
 
     args = parser.parse_args()
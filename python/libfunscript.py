@@ -0,0 +1,703 @@
+"""
+Render (multi-axis) funscripts to HWL pulses, the same way the Howl app plays them.
+
+The app turns a funscript into pulses as it plays (FunscriptPulseSource), looking up each axis
+one time at a time. This module does the same calculation for a whole funscript at once with
+NumPy: each axis's Fritsch-Carlson tangents are computed for the whole action array, and the
+position, velocity and acceleration are evaluated on the 40Hz HWL pulse grid using
+np.searchsorted. A pre-rendered HWL is quicker and cheaper for the device to load than a
+funscript, and plays the same (for the same funscript settings).
+
+    render_funscript_file("example.funscript", "example.hwl")
+
+Funscripts are parsed straight into NumPy arrays of each axis's action times and positions,
+without building a dict for every action, and read_funscript reads files a chunk at a time,
+so that very long multi-axis scripts can be loaded without using much memory.
+"""
+import io
+import json
+import math
+import re
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from libhwl import HWL_PULSES_PER_SECOND, HwlArray, HwlWriter, empty_hwl_array
+
+# Approximate maximum speed of a stroker device (used for normalisation)
+MAX_SPEED = 5.0
+# Arbitrarily chosen maximum acceleration magnitude (used for normalisation)
+MAX_MAGNITUDE = 80.0
+# Funscript axes that the app is able to utilise
+SUPPORTED_AXES = ("L0", "L1", "L2", "R0", "R1", "R2")
+# Axes that are balanced around the central position when normalising
+BALANCED_AXES = ("L1", "L2", "R0", "R1", "R2")
+# Axes whose speed counts towards the energy (amplitude) calculation
+ENERGY_AXES = ("L0", "L1", "L2", "R0", "R1", "R2")
+# Backward-looking smoothing window shape: the window extends this many
+# sigmas into the past, and energy is sampled this many times per sigma
+WINDOW_WIDTH_SIGMAS = 3.0
+SAMPLES_PER_SIGMA = 4
+# Smoothed amplitudes below this are silence
+AMPLITUDE_THRESHOLD = 0.005
+# Pulses rendered at a time. Every pulse's smoothing window is evaluated on every axis at once,
+# so this bounds the memory used however long the funscript is.
+RENDER_BLOCK_PULSES = 4096
+
+# Characters read at a time when parsing a funscript file
+FUNSCRIPT_CHUNK_SIZE = 1 << 16
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Runs of consecutive actions, each followed by a comma, in the layouts funscripts are usually
+# written in (compact, and Python's json.dumps default). Numbers are loosely matched here and
+# checked when decoded, after the replacements turn the run into a list of numbers.
+_NUMBER = r"-?[0-9][0-9.eE+-]*"
+_ACTION_RUNS = [
+    (re.compile(r'(?:\{"at":' + _NUMBER + r',"pos":' + _NUMBER + r"\},)*"),
+     (('{"at":', ""), (',"pos":', ","), ("},", ","))),
+    (re.compile(r'(?:\{"at": ' + _NUMBER + r', "pos": ' + _NUMBER + r"\}, )*"),
+     (('{"at": ', ""), (', "pos": ', ","), ("}, ", ","))),
+]
+
+# Axis normalisation types, see FunscriptAxis.create
+NORMALISATION_OFF = "off"
+NORMALISATION_FULL_RANGE = "full_range"
+NORMALISATION_BALANCED = "balanced"
+
+
+@dataclass
+class FunscriptSettings:
+    """
+    The app's funscript settings (with the same defaults). The app holds these as 32 bit floats,
+    and they are rounded the same way here so that rendered pulses match the app's.
+    """
+    volume: float = 0.8
+    positional_effect_strength: float = 1.0
+    directional_freq_shift: float = 0.15
+    freq_energy_proportion: float = 0.2
+    flip_directional_freq_shift: bool = False
+    normalise_axes: bool = True
+    smoothing_sigma: float = 0.2
+    # Calibration setting, 1.0 = linear panning, 0.5 = constant power panning
+    positional_effect_curve: float = 0.5
+
+    def value(self, name: str) -> float:
+        return float(np.float32(getattr(self, name)))
+
+
+@dataclass
+class FunscriptActions:
+    """One axis's actions as parsed, "at" times in milliseconds and "pos" positions (nominally 0-100)"""
+    axis_id: str
+    at: np.ndarray
+    pos: np.ndarray
+
+
+def sort_actions(at: np.ndarray, pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort actions by time as the app does: actions with a duplicate time are dropped (keeping the
+    first in the file), then positions are clamped to 0-100.
+    """
+    at = np.asarray(at, dtype=np.float64)
+    pos = np.asarray(pos, dtype=np.float64)
+    # np.unique sorts, and gives the index of the first occurrence of each time
+    unique_at, first = np.unique(at, return_index=True)
+    return unique_at, np.clip(pos[first], 0.0, 100.0)
+
+
+class FunscriptAxis:
+    """
+    One funscript axis, as times (seconds), normalised positions (0.0 to 1.0) and the velocities
+    at those points, for monotone cubic (Hermite) interpolation between them.
+    """
+    def __init__(self, axis_id: str, times: np.ndarray, positions: np.ndarray, velocities: np.ndarray):
+        self.id = axis_id
+        self.times = times
+        self.positions = positions
+        self.velocities = velocities
+
+    @classmethod
+    def create(cls, axis_id: str, at: np.ndarray, pos: np.ndarray,
+               normalisation: str = NORMALISATION_OFF) -> "FunscriptAxis":
+        """
+        Create an axis from its actions' "at" (milliseconds) and "pos" (0-100) values.
+
+        Duplicate times are dropped (keeping the first), actions are sorted by time and positions
+        clamped to 0-100. Positions are then scaled to 0.0-1.0: with NORMALISATION_FULL_RANGE the
+        axis is expanded to fill the range, with NORMALISATION_BALANCED it is expanded as much as
+        possible while keeping the same balance around the central position.
+        Raises ValueError if the axis has fewer than 2 actions (or positions, when normalising).
+        """
+        unique_at, pos = sort_actions(at, pos)
+        if len(unique_at) < 2:
+            raise ValueError(f"Funscript axis {axis_id} must have at least 2 actions")
+
+        raw_min, raw_max = pos.min(), pos.max()
+        if normalisation == NORMALISATION_FULL_RANGE:
+            min_pos, max_pos = raw_min, raw_max
+        elif normalisation == NORMALISATION_BALANCED:
+            max_dist = max(50.0 - raw_min, raw_max - 50.0)
+            min_pos, max_pos = 50.0 - max_dist, 50.0 + max_dist
+        elif normalisation == NORMALISATION_OFF:
+            min_pos, max_pos = 0.0, 100.0
+        else:
+            raise ValueError(f"Unknown normalisation: {normalisation}")
+        value_range = max_pos - min_pos
+        if normalisation != NORMALISATION_OFF:
+            if raw_min == raw_max or value_range <= 0.0:
+                raise ValueError(f"Funscript axis {axis_id} must contain at least 2 different positions")
+            positions = (pos - min_pos) / value_range
+        else:
+            positions = pos / 100.0
+
+        times = unique_at / 1000.0
+        # Secant slopes (average velocity between points)
+        dt = np.diff(times)
+        secants = np.diff(positions) / dt
+
+        # Fritsch-Carlson (monotone cubic interpolation) tangents
+        velocities = np.empty_like(positions)
+        velocities[0] = secants[0]
+        velocities[-1] = secants[-1]
+        m_left, m_right = secants[:-1], secants[1:]
+        dt_left, dt_right = dt[:-1], dt[1:]
+        common = dt_left + dt_right
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Weighted harmonic mean: strictly prevents overshoot while maintaining C1 continuity
+            harmonic = 3.0 * common / ((common + dt_right) / m_left + (common + dt_left) / m_right)
+        # Where adjacent slopes have different signs (or either is 0.0) this is a local peak/valley,
+        # the velocity is 0.0 to flatten the curve and prevent overshoot
+        velocities[1:-1] = np.where(m_left * m_right <= 0.0, 0.0, harmonic)
+        return cls(axis_id, times, positions, velocities)
+
+    @property
+    def duration(self) -> float:
+        return float(self.times[-1])
+
+    def evaluate(self, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the (position, velocity, acceleration) arrays at an array of times in seconds.
+        Before the first action and after the last, the position holds and the velocity and
+        acceleration are 0.0, as they are between two actions at the same position.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        # Index of the last action at or before each time
+        before = np.searchsorted(self.times, times, side="right") - 1
+        outside = (before < 0) | (before >= len(self.times) - 1)
+        i0 = np.clip(before, 0, len(self.times) - 2)
+        i1 = i0 + 1
+
+        t0, t1 = self.times[i0], self.times[i1]
+        p0, p1 = self.positions[i0], self.positions[i1]
+        m0, m1 = self.velocities[i0], self.velocities[i1]
+        dt = t1 - t0
+        h = (times - t0) / dt
+        h_sq = h * h
+        h_cu = h_sq * h
+
+        position = (p0 * (2 * h_cu - 3 * h_sq + 1) +
+                    m0 * (h_cu - 2 * h_sq + h) * dt +
+                    p1 * (-2 * h_cu + 3 * h_sq) +
+                    m1 * (h_cu - h_sq) * dt)
+        dpdh = ((6 * h_sq - 6 * h) * p0 +
+                (3 * h_sq - 4 * h + 1) * m0 * dt +
+                (-6 * h_sq + 6 * h) * p1 +
+                (3 * h_sq - 2 * h) * m1 * dt)
+        d2pdh2 = ((12 * h - 6) * p0 +
+                  (6 * h - 4) * m0 * dt +
+                  (-12 * h + 6) * p1 +
+                  (6 * h - 2) * m1 * dt)
+        velocity = dpdh / dt
+        acceleration = d2pdh2 / (dt * dt)
+
+        flat = outside | (p0 == p1)
+        held = np.where(before < 0, self.positions[0], np.where(outside, self.positions[-1], p0))
+        position = np.where(flat, held, np.clip(position, 0.0, 1.0))
+        velocity = np.where(flat, 0.0, velocity)
+        acceleration = np.where(flat, 0.0, acceleration)
+        return position, velocity, acceleration
+
+
+class _FunscriptReader:
+    """
+    Incremental funscript parser, reading text in chunks and collecting actions straight into
+    compact arrays rather than building a dict per action. Only the "actions" and "axes" parts
+    of the funscript are kept, everything else is checked and skipped.
+    """
+    def __init__(self, read, chunk_size: int = FUNSCRIPT_CHUNK_SIZE):
+        self.read = read
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, needed: int) -> bool:
+        """Read until needed characters are buffered past the offset (or the end). False at the end."""
+        while len(self.buffer) - self.offset < needed and not self.eof:
+            chunk = self.read(max(self.chunk_size, len(self.buffer) - self.offset))
+            if not chunk:
+                self.eof = True
+            self.buffer = self.buffer[self.offset:] + chunk
+            self.offset = 0
+        return len(self.buffer) - self.offset >= needed
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ("" at the end)"""
+        while True:
+            self.offset = _WHITESPACE.match(self.buffer, self.offset).end()
+            if self.offset < len(self.buffer) or not self._fill(1):
+                return self.buffer[self.offset:self.offset + 1]
+
+    def _next(self) -> str:
+        char = self._peek()
+        self.offset += 1
+        return char
+
+    def _expect(self, char: str):
+        if self._next() != char:
+            raise ValueError(f"Expected '{char}'")
+
+    def _value(self) -> Any:
+        """Decode the next JSON value, whatever its size"""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.offset)
+                # A number ending at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.offset = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(len(self.buffer) - self.offset + 1)
+
+    def _items(self, close: str):
+        """Iterate over the items of an object or array once its opening character has been read"""
+        if self._peek() == close:
+            self.offset += 1
+            return
+        while True:
+            yield
+            char = self._next()
+            if char == close:
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or '{close}'")
+
+    def _key(self) -> str:
+        key = self._value()
+        if not isinstance(key, str):
+            raise ValueError("Expected an object key")
+        self._expect(":")
+        return key
+
+    def _actions(self) -> Tuple[np.ndarray, np.ndarray]:
+        at, pos = array("d"), array("d")
+        self._expect("[")
+        if self._peek() == "]":
+            self.offset += 1
+        else:
+            while True:
+                # Nearly every action is a plain {"at": ..., "pos": ...}, so runs of those are converted
+                # to a list of numbers and decoded in one go, without decoding each action as an object
+                self._fill(self.chunk_size)
+                for run_pattern, replacements in _ACTION_RUNS:
+                    run_end = run_pattern.match(self.buffer, self.offset).end()
+                    if run_end > self.offset:
+                        break
+                if run_end > self.offset:
+                    numbers = self.buffer[self.offset:run_end]
+                    for old, new in replacements:
+                        numbers = numbers.replace(old, new)
+                    values = json.loads("[" + numbers[:-1] + "]")
+                    at.extend(values[0::2])
+                    pos.extend(values[1::2])
+                    self.offset = run_end
+                    continue
+                # The last action, or one in another layout
+                action = self._value()
+                at.append(_action_value(action, "at"))
+                pos.append(_action_value(action, "pos"))
+                char = self._next()
+                if char == "]":
+                    break
+                if char != ",":
+                    raise ValueError("Expected ',' or ']'")
+        return np.frombuffer(at, dtype=np.float64), np.frombuffer(pos, dtype=np.float64)
+
+    def _axis(self) -> FunscriptActions:
+        axis_id, actions = None, None
+        self._expect("{")
+        for _ in self._items("}"):
+            key = self._key()
+            if key == "actions":
+                actions = self._actions()
+            elif key == "id":
+                axis_id = self._value()
+            else:
+                self._value()
+        if not isinstance(axis_id, str) or actions is None:
+            raise ValueError("Funscript axes must have an id and actions")
+        return FunscriptActions(axis_id, *actions)
+
+    def parse(self) -> List[FunscriptActions]:
+        main, axes = None, []
+        self._expect("{")
+        for _ in self._items("}"):
+            key = self._key()
+            if key == "actions":
+                main = FunscriptActions("L0", *self._actions())
+            elif key == "axes" and self._peek() == "[":
+                self.offset += 1
+                axes = [self._axis() for _ in self._items("]")]
+            else:
+                self._value()
+        if main is None:
+            raise ValueError("Funscript has no actions")
+        if self._peek() != "":
+            raise ValueError("Extra data after funscript")
+        return [main] + axes
+
+
+def _action_value(action: Any, key: str) -> float:
+    value = action[key]
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Funscript action {key} must be a number")
+    return float(value)
+
+
+def parse_funscript(content: Union[str, bytes, Dict[str, Any]]) -> List[FunscriptActions]:
+    """
+    Parse a funscript (JSON text or already decoded) into the actions of each of its axes, in
+    file order. The main actions come first as axis "L0", followed by the "axes" list (which
+    could contain duplicate or unsupported axes, see load_funscript_axes).
+    Actions are left unsorted, see sort_actions. Raises ValueError if the funscript is not valid.
+    """
+    try:
+        if isinstance(content, dict):
+            axes = [("L0", content["actions"])] + [(axis["id"], axis["actions"])
+                                                   for axis in content.get("axes") or []]
+            return [FunscriptActions(axis_id,
+                                     np.fromiter((_action_value(a, "at") for a in actions), np.float64, len(actions)),
+                                     np.fromiter((_action_value(a, "pos") for a in actions), np.float64, len(actions)))
+                    for axis_id, actions in axes]
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        return _FunscriptReader(io.StringIO(content).read, chunk_size=len(content) + 1).parse()
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Funscript decoding failed") from e
+
+
+def read_funscript(filename: str, chunk_size: int = FUNSCRIPT_CHUNK_SIZE) -> List[FunscriptActions]:
+    """
+    Read a funscript file as parse_funscript does, a chunk at a time. Memory use is a small
+    multiple of the number of actions (16 bytes each), however large the file.
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        try:
+            return _FunscriptReader(f.read, chunk_size).parse()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Funscript decoding failed: {filename}") from e
+
+
+def axis_normalisation(axis_id: str, normalise: bool = True) -> str:
+    """The normalisation the app uses for an axis, with its normalise axes setting on or off"""
+    if not normalise:
+        return NORMALISATION_OFF
+    if axis_id == "L0":
+        return NORMALISATION_FULL_RANGE
+    return NORMALISATION_BALANCED if axis_id in BALANCED_AXES else NORMALISATION_OFF
+
+
+def load_funscript_axes(actions: List[FunscriptActions], normalise: bool = True) -> Dict[str, FunscriptAxis]:
+    """
+    Create the axes the app would use from a parsed funscript, {axis id: FunscriptAxis}.
+    The main axis (L0) must be valid, other axes are skipped if unsupported or invalid
+    (and a valid axis replaces an earlier one with the same id).
+    """
+    main, extra = actions[0], actions[1:]
+    axes = {"L0": FunscriptAxis.create("L0", main.at, main.pos, axis_normalisation("L0", normalise))}
+    for axis in extra:
+        if axis.axis_id == "L0" or axis.axis_id not in SUPPORTED_AXES:
+            continue
+        try:
+            axes[axis.axis_id] = FunscriptAxis.create(axis.axis_id, axis.at, axis.pos,
+                                                      axis_normalisation(axis.axis_id, normalise))
+        except ValueError:
+            pass
+    return axes
+
+
+def _equal_velocity_fractions(difference: np.ndarray) -> np.ndarray:
+    """
+    Given an (n, 3) array of a quadratic's values at fractions 0, 1/3 and 2/3 of a segment, return
+    an (n, 2) array of the fractions where it is 0, or 0.0 for roots outside the segment.
+    """
+    # As a quadratic a*x^2 + b*x + c in x = 3 * fraction
+    a = (difference[:, 2] - 2.0 * difference[:, 1] + difference[:, 0]) / 2.0
+    b = difference[:, 1] - difference[:, 0] - a
+    c = difference[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # The numerically stable form, with no cancellation between -b and the square root
+        q = -(b + np.copysign(np.sqrt(b * b - 4.0 * a * c), b)) / 2.0
+        roots = np.where((a == 0.0)[:, np.newaxis], (-c / b)[:, np.newaxis], np.stack([q / a, c / q], axis=1))
+        fractions = roots / 3.0
+        return np.where((fractions > 0.0) & (fractions < 1.0), fractions, 0.0)
+
+
+def simplify_actions(at: np.ndarray, pos: np.ndarray, max_error: float,
+                     normalisation: str = NORMALISATION_OFF) -> Tuple[np.ndarray, float]:
+    """
+    Choose a subset of an axis's actions that plays within max_error of the whole axis.
+
+    Error is the largest difference between the curves the app plays (monotone cubic interpolation,
+    after normalisation) from all of the actions and from the subset, in position units (0-100).
+    Starting from the first and last actions, and the lowest and highest positions (so that
+    normalisation is unchanged), every part of the curve that is out by more than max_error
+    gets the action nearest its worst point added, until none are.
+
+    :return: (the indices into at and pos of the actions to keep in time order, the max error).
+             Duplicate times are dropped as in sort_actions. Raises ValueError as FunscriptAxis.create.
+    """
+    at = np.asarray(at, dtype=np.float64)
+    pos = np.asarray(pos, dtype=np.float64)
+    _, order = np.unique(at, return_index=True)
+    sorted_at, sorted_pos = at[order], pos[order]
+    original = FunscriptAxis.create("", sorted_at, sorted_pos, normalisation)
+    count = len(order)
+
+    # Both curves are monotone between their actions (so never clipped), and the subset's action times
+    # are some of the original's, so between each pair of original actions the difference between the
+    # curves is a cubic. Its largest value is at an action or where the two velocities are equal, found
+    # from the velocity difference (a quadratic) at 3 points in the segment. Each segment has 3 samples:
+    # its first action, then the 2 points where the velocities are equal (or the first action again).
+    starts, durations = original.times[:-1, np.newaxis], np.diff(original.times)[:, np.newaxis]
+    velocity_times = starts + durations * (np.arange(3) / 3.0)
+    _, original_velocities, _ = original.evaluate(velocity_times)
+    nearest_actions = np.repeat(np.arange(count - 1)[:, np.newaxis], 3, axis=1)
+    sample_segments = np.repeat(np.arange(count - 1), 3)
+
+    kept = np.zeros(count, dtype=bool)
+    kept[[0, -1, np.argmin(original.positions), np.argmax(original.positions)]] = True
+    tolerance = max_error / 100.0
+    error = np.zeros(nearest_actions.shape)
+    changed = np.ones(count - 1, dtype=bool)
+    while True:
+        indices = np.flatnonzero(kept)
+        simplified = FunscriptAxis.create("", sorted_at[indices], sorted_pos[indices], normalisation)
+        positions, velocities, _ = simplified.evaluate(velocity_times[changed])
+        fractions = _equal_velocity_fractions(original_velocities[changed] - velocities)
+        nearest_actions[changed, 1:] = np.flatnonzero(changed)[:, np.newaxis] + (fractions >= 0.5)
+        extrema = starts[changed] + durations[changed] * fractions
+        expected, _, _ = original.evaluate(extrema)
+        actual, _, _ = simplified.evaluate(extrema)
+        error[changed, 0] = np.abs(positions[:, 0] - original.positions[:-1][changed])
+        error[changed, 1:] = np.abs(actual - expected)
+        worst = float(error.max())
+        if worst <= tolerance:
+            break
+
+        # The worst sample in each segment between kept actions that is out by too much
+        flat_error = error.ravel()
+        segments = (np.cumsum(kept) - 1)[sample_segments]
+        segment_starts = np.searchsorted(segments, np.arange(len(indices) - 1))
+        segment_errors = np.maximum.reduceat(flat_error, segment_starts)
+        worst_samples = np.flatnonzero((segment_errors[segments] > tolerance) &
+                                       (flat_error == segment_errors[segments]))
+        _, first = np.unique(segments[worst_samples], return_index=True)
+        worst_samples = worst_samples[first]
+        start = indices[segments[worst_samples]]
+        end = indices[segments[worst_samples] + 1]
+
+        previous = kept.copy()
+        interior = end - start > 1
+        kept[np.clip(nearest_actions.ravel()[worst_samples], start + 1, end - 1)[interior]] = True
+        # Between adjacent actions only the velocities can differ, and they depend on the neighbouring actions
+        kept[np.maximum(start[~interior] - 1, 0)] = True
+        kept[np.minimum(end[~interior] + 1, count - 1)] = True
+        if np.array_equal(kept, previous):
+            break
+
+        # An added action changes the velocities of the kept actions either side of it, so the curve
+        # changes from two kept actions before it to two after, and only segments there need evaluating
+        new_indices = np.flatnonzero(kept)
+        added = np.flatnonzero(~previous[new_indices])
+        low = new_indices[np.maximum(added - 2, 0)]
+        high = new_indices[np.minimum(added + 2, len(new_indices) - 1)]
+        bounds = np.zeros(count, dtype=np.int64)
+        np.add.at(bounds, low, 1)
+        np.add.at(bounds, high, -1)
+        changed = np.cumsum(bounds[:-1]) > 0
+    return order[indices], worst * 100.0
+
+
+def pulse_count(duration: float) -> int:
+    """Number of HWL pulses covering a duration, from 0.0 up to and including the end"""
+    return int(math.ceil(duration * HWL_PULSES_PER_SECOND)) + 1
+
+
+def pulse_times(duration: float, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+    """Times of the HWL pulses covering a duration (or of pulses [start, stop) of them)"""
+    if stop is None:
+        stop = pulse_count(duration)
+    return np.arange(start, stop, dtype=np.float64) / HWL_PULSES_PER_SECOND
+
+
+def _energy(axes: Dict[str, FunscriptAxis], times: np.ndarray) -> np.ndarray:
+    """
+    Instantaneous (unsmoothed) energy: the squared magnitude of the velocity vector across all
+    present axes, with each axis normalised by MAX_SPEED
+    """
+    energy = np.zeros_like(times)
+    for axis_id in ENERGY_AXES:
+        if axis_id in axes:
+            _, velocity, _ = axes[axis_id].evaluate(times)
+            energy += np.clip(np.abs(velocity) / MAX_SPEED, 0.0, 1.0) ** 2
+    return energy
+
+
+def _total_amplitude(axes: Dict[str, FunscriptAxis], times: np.ndarray, settings: FunscriptSettings) -> np.ndarray:
+    """
+    Backward-looking (causal) Gaussian smoothing of the energy, sigma = smoothing_sigma seconds,
+    over a window extending WINDOW_WIDTH_SIGMAS * sigma into the past. Returns the RMS velocity.
+    """
+    sigma = max(settings.value("smoothing_sigma"), 0.01)
+    step = sigma / SAMPLES_PER_SIGMA
+    total_steps = int(WINDOW_WIDTH_SIGMAS * SAMPLES_PER_SIGMA)
+    offsets = np.arange(-total_steps, 1) * step
+    weights = np.exp(-(offsets * offsets) / (2.0 * sigma * sigma))
+
+    # Every pulse's window evaluated in one go, one row per offset
+    energy = _energy(axes, (times[np.newaxis, :] + offsets[:, np.newaxis]).ravel()).reshape(len(offsets), -1)
+    smoothed = (weights @ energy) / weights.sum()
+    amplitude = np.clip(np.sqrt(smoothed), 0.0, 1.0)
+    return np.where(amplitude < AMPLITUDE_THRESHOLD, 0.0, amplitude)
+
+
+def _frequencies(axes: Dict[str, FunscriptAxis], times: np.ndarray, position: np.ndarray,
+                 amplitude: np.ndarray, settings: FunscriptSettings) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Frequencies from a blend of the L0 position and the amplitude, shifted by the stroke direction
+    so that upward and downward strokes feel a little different, then adjusted by any other axes
+    """
+    proportion = settings.value("freq_energy_proportion")
+    _, l0_velocity, _ = axes["L0"].evaluate(times)
+    core_base = position * (1.0 - proportion) + amplitude * proportion
+    # Faster strokes have a larger shift
+    directional_shift = np.clip(l0_velocity / MAX_SPEED, -1.0, 1.0) * settings.value("directional_freq_shift")
+    if settings.flip_directional_freq_shift:
+        directional_shift = -directional_shift
+    freq_a = np.clip(core_base - directional_shift, 0.0, 1.0)
+    freq_b = np.clip(core_base + directional_shift, 0.0, 1.0)
+
+    # Twist (R0): both frequencies rise with the speed of rotation (friction)
+    if "R0" in axes:
+        _, twist_velocity, _ = axes["R0"].evaluate(times)
+        friction_buzz = np.clip(np.abs(twist_velocity) / MAX_SPEED, 0.0, 1.0) * 0.5
+        freq_a = freq_a + friction_buzz
+        freq_b = freq_b + friction_buzz
+    # Roll (R1): lateral spread, symmetrical around the centre, affecting B more than A
+    if "R1" in axes:
+        roll_position, _, _ = axes["R1"].evaluate(times)
+        lateral_spread = np.abs(roll_position - 0.5) * 0.4
+        freq_a = freq_a + lateral_spread * 0.2
+        freq_b = freq_b - lateral_spread * 0.8
+    # Pitch (R2): a frequency spread depending on bending towards or away
+    if "R2" in axes:
+        pitch_position, _, _ = axes["R2"].evaluate(times)
+        pitch_offset = (pitch_position - 0.5) * 0.4
+        freq_a = freq_a + pitch_offset
+        freq_b = freq_b - pitch_offset
+    # Surge and sway (L1, L2): an "impact" from the acceleration that lowers both frequencies
+    impact_acc_sq = np.zeros_like(times)
+    for axis_id in ("L1", "L2"):
+        if axis_id in axes:
+            _, _, acceleration = axes[axis_id].evaluate(times)
+            impact_acc_sq += (acceleration / MAX_MAGNITUDE) ** 2
+    impact_drop = np.clip(np.sqrt(impact_acc_sq), 0.0, 1.0) * 0.4
+    freq_a = freq_a - impact_drop
+    freq_b = freq_b - impact_drop
+
+    silent = amplitude <= 0.0
+    return (np.where(silent, 0.0, np.clip(freq_a, 0.0, 1.0)),
+            np.where(silent, 0.0, np.clip(freq_b, 0.0, 1.0)))
+
+
+def _render_times(axes: Dict[str, FunscriptAxis], times: np.ndarray, settings: FunscriptSettings) -> HwlArray:
+    raw_amplitude = _total_amplitude(axes, times, settings)
+    # A higher volume boosts slow movements more, but reduces dynamic range
+    scaling_exponent = max(1.0 - settings.value("volume"), 0.001)
+    amplitude = np.clip(raw_amplitude ** scaling_exponent, 0.0, 1.0)
+    position, _, _ = axes["L0"].evaluate(times)
+
+    # Positional effect, panning between the channels with the L0 position
+    strength = settings.value("positional_effect_strength")
+    curve = max(settings.value("positional_effect_curve"), 0.01)
+    effective_position = 0.5 * (1 - strength) + position * strength
+    amp_a = amplitude * np.clip(1.0 - effective_position, 0.0, 1.0) ** curve
+    amp_b = amplitude * np.clip(effective_position, 0.0, 1.0) ** curve
+
+    freq_a, freq_b = _frequencies(axes, times, position, raw_amplitude, settings)
+
+    pulses = empty_hwl_array(len(times))
+    pulses["left_amp"] = amp_a
+    pulses["right_amp"] = amp_b
+    pulses["left_freq"] = freq_a
+    pulses["right_freq"] = freq_b
+    return pulses
+
+
+def render_blocks(axes: Dict[str, FunscriptAxis], settings: Optional[FunscriptSettings] = None,
+                  times: Optional[np.ndarray] = None, block_pulses: int = RENDER_BLOCK_PULSES) -> Iterator[HwlArray]:
+    """
+    Render funscript axes as render_axes does, yielding HwlArrays of up to block_pulses pulses in order.
+    Each pulse only depends on its own time, so the blocks join up exactly.
+    """
+    if settings is None:
+        settings = FunscriptSettings()
+    if times is None:
+        duration = max(axis.duration for axis in axes.values())
+        count = pulse_count(duration)
+        for start in range(0, count, block_pulses):
+            yield _render_times(axes, pulse_times(duration, start, min(start + block_pulses, count)), settings)
+    else:
+        for start in range(0, len(times), block_pulses):
+            yield _render_times(axes, times[start:start + block_pulses], settings)
+
+
+def render_axes(axes: Dict[str, FunscriptAxis], settings: Optional[FunscriptSettings] = None,
+                times: Optional[np.ndarray] = None) -> HwlArray:
+    """
+    Render funscript axes (from load_funscript_axes) to an HwlArray, by default covering the
+    whole funscript. Equivalent to the app's FunscriptPulseSource.getPulseAtTime at each time.
+    """
+    blocks = list(render_blocks(axes, settings, times))
+    return np.concatenate(blocks) if blocks else empty_hwl_array(0)
+
+
+def render_funscript(content: Union[str, bytes, Dict[str, Any]],
+                     settings: Optional[FunscriptSettings] = None) -> HwlArray:
+    """
+    Render a funscript (JSON text or already decoded) to an HwlArray of its whole duration.
+    Raises ValueError if the funscript is not valid.
+    """
+    if settings is None:
+        settings = FunscriptSettings()
+    return render_axes(load_funscript_axes(parse_funscript(content), settings.normalise_axes), settings)
+
+
+def render_funscript_file(funscript_filename: str, destination_filename: str,
+                          settings: Optional[FunscriptSettings] = None):
+    """
+    Render a funscript file to an HWL file, a block at a time, returning the number of pulses written
+    """
+    if settings is None:
+        settings = FunscriptSettings()
+    axes = load_funscript_axes(read_funscript(funscript_filename), settings.normalise_axes)
+    with HwlWriter(destination_filename) as writer:
+        for block in render_blocks(axes, settings):
+            writer.write_array(block)
+    return writer.num_pulses
@@ -1,6 +1,13 @@
+import lzma
+import mmap
+import os
+import stat
 import struct
+import tempfile
+import zlib
+import numpy as np
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Tuple
 
 # ============================================================
 #  HWL format constants
@@ -14,6 +21,26 @@ HWL_PULSE_SIZE = 16
 HWL_PULSES_PER_SECOND = 40
 HWL_PULSE_TIME = 1.0/HWL_PULSES_PER_SECOND
 
+# Pulse layout as a NumPy structured dtype, in on-disk field order
+HWL_DTYPE = np.dtype([
+    ("left_amp", "<f4"),
+    ("right_amp", "<f4"),
+    ("left_freq", "<f4"),
+    ("right_freq", "<f4"),
+])
+
+# A structured array of HWL_DTYPE, holding one element per pulse
+HwlArray = np.ndarray
+
+# Compact HWL: quantised pulses, optionally delta and entropy coded (see encode_compact_hwl)
+HWL_COMPACT_HEADER = b"YEAHBOIZ"
+HWL_COMPACT_VERSION = 1
+# Header, version, bits per value, flags, codec, number of pulses
+HWL_COMPACT_STRUCT = struct.Struct("<8sBBBBQ")
+HWL_COMPACT_FLAG_DELTA = 0x01
+HWL_COMPACT_CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+HWL_COMPACT_BITS = {8: np.dtype("<u1"), 16: np.dtype("<u2")}
+
 
 # ============================================================
 #  Pulse definition
@@ -31,6 +58,484 @@ class Pulse:
     right_amp: float
 
 
+# ============================================================
+#  HWL array read/write functions
+# ============================================================
+
+def empty_hwl_array(count: int) -> HwlArray:
+    """
+    Return a zero filled (silent) array of the given number of pulses.
+    """
+    return np.zeros(count, dtype=HWL_DTYPE)
+
+
+def hwl_array_from_bytes(data: bytes, name: str = "HWL data") -> HwlArray:
+    """
+    Interpret the complete contents of an HWL file (header included) as an HwlArray.
+    No copy is made, the returned array is a read only view of the supplied buffer.
+    """
+    view = memoryview(data)
+    if view[:HWL_HEADER_SIZE] != HWL_HEADER:
+        raise ValueError(f"{name} is not a valid HWL file (bad header)")
+    if (len(view) - HWL_HEADER_SIZE) % HWL_PULSE_SIZE != 0:
+        raise ValueError(f"Corrupted HWL file: truncated pulse data in {name}")
+    return np.frombuffer(view, dtype=HWL_DTYPE, offset=HWL_HEADER_SIZE)
+
+
+def hwl_array_to_bytes(pulses: HwlArray) -> bytes:
+    """
+    Return the complete contents of an HWL file (header included) for an HwlArray.
+    """
+    return HWL_HEADER + np.ascontiguousarray(pulses, dtype=HWL_DTYPE).tobytes()
+
+
+def read_hwl_array(filename: str, mmap: bool = False) -> HwlArray:
+    """
+    Read an HWL file (or compact HWL file) into an HwlArray.
+
+    With mmap=True the file is memory mapped read only rather than loaded, so pulses are
+    only paged in from disk when they are actually accessed. Compact files are always decoded in full.
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(HWL_HEADER_SIZE)
+        if header == HWL_COMPACT_HEADER:
+            f.seek(0)
+            return decode_compact_hwl(f.read(), filename)
+        if header != HWL_HEADER:
+            raise ValueError(f"{filename} is not a valid HWL file (bad header)")
+
+        data_size = f.seek(0, 2) - HWL_HEADER_SIZE
+        if data_size % HWL_PULSE_SIZE != 0:
+            raise ValueError(f"Corrupted HWL file: truncated pulse data in {filename}")
+
+        if data_size == 0:
+            # np.memmap refuses to map an empty region
+            return empty_hwl_array(0)
+        if mmap:
+            return np.memmap(f, dtype=HWL_DTYPE, mode='r', offset=HWL_HEADER_SIZE)
+
+        f.seek(HWL_HEADER_SIZE)
+        return np.fromfile(f, dtype=HWL_DTYPE)
+
+
+def write_hwl_array(destination_filename: str, pulses: HwlArray):
+    """
+    Write an HwlArray to an HWL file using a single buffer write
+    """
+    if len(pulses) == 0:
+        raise ValueError("No pulses to write")
+
+    data = np.ascontiguousarray(pulses, dtype=HWL_DTYPE)
+    with open(destination_filename, 'wb') as file:
+        file.write(HWL_HEADER)
+        file.write(data.data)
+
+
+def pulses_to_array(pulses: List[Pulse]) -> HwlArray:
+    """
+    Convert a list of Pulses (or any objects with the same attributes) to an HwlArray
+    """
+    return np.array(
+        [(p.left_amp, p.right_amp, p.left_freq, p.right_freq) for p in pulses],
+        dtype=HWL_DTYPE
+    )
+
+
+def array_to_pulses(pulses: HwlArray) -> List[Pulse]:
+    """
+    Convert an HwlArray to a list of Pulses
+    """
+    return [
+        Pulse(left_freq, right_freq, left_amp, right_amp)
+        for left_amp, right_amp, left_freq, right_freq in pulses.tolist()
+    ]
+
+
+# ============================================================
+#  Compact HWL encoding
+# ============================================================
+
+def quantise_hwl_array(pulses: HwlArray, bits: int = 16) -> np.ndarray:
+    """
+    Quantise an HwlArray to unsigned integers of the given number of bits (8 or 16), returning a
+    (4, pulses) array in field order. Values are clipped to 0.0-1.0 and rounded to the nearest step.
+    """
+    if bits not in HWL_COMPACT_BITS:
+        raise ValueError(f"Unsupported quantisation: {bits} bits")
+    scale = (1 << bits) - 1
+    values = np.ascontiguousarray(pulses, dtype=HWL_DTYPE).view("<f4").reshape(-1, 4).T
+    return np.rint(np.clip(values, 0.0, 1.0) * scale).astype(HWL_COMPACT_BITS[bits])
+
+
+def dequantise_hwl_array(quantised: np.ndarray, bits: int = 16) -> HwlArray:
+    """
+    Convert a (4, pulses) array from quantise_hwl_array back to an HwlArray.
+    Quantising the result again gives back exactly the same values.
+    """
+    scale = np.float32((1 << bits) - 1)
+    pulses = empty_hwl_array(quantised.shape[1])
+    pulses.view("<f4").reshape(-1, 4)[:] = (quantised.astype("<f4") / scale).T
+    return pulses
+
+
+def encode_compact_hwl(pulses: HwlArray, bits: int = 16, delta: bool = True, codec: str = "zlib") -> bytes:
+    """
+    Return the complete contents of a compact HWL file for an HwlArray.
+
+    Each field is quantised (see quantise_hwl_array) and stored as its own plane rather than
+    interleaved, since the values of one field change smoothly from pulse to pulse. With delta=True
+    each value is stored as the difference from the previous one (wrapping around, so it stays
+    lossless), which leaves mostly small numbers for the codec ("zlib", "lzma" or "none") to compress.
+    """
+    if codec not in HWL_COMPACT_CODECS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    quantised = quantise_hwl_array(pulses, bits)
+    if delta:
+        quantised = np.diff(quantised, axis=1, prepend=np.zeros((4, 1), dtype=quantised.dtype))
+    payload = quantised.tobytes()
+    if codec == "zlib":
+        payload = zlib.compress(payload, 9)
+    elif codec == "lzma":
+        payload = lzma.compress(payload)
+
+    flags = HWL_COMPACT_FLAG_DELTA if delta else 0
+    header = HWL_COMPACT_STRUCT.pack(HWL_COMPACT_HEADER, HWL_COMPACT_VERSION, bits, flags,
+                                     HWL_COMPACT_CODECS[codec], quantised.shape[1])
+    return header + payload
+
+
+def read_compact_hwl_header(data: bytes, name: str = "HWL data") -> dict:
+    """
+    Read the header of a compact HWL file, returning a dict of version, bits, delta, codec and num_pulses.
+    """
+    if len(data) < HWL_COMPACT_STRUCT.size or data[:HWL_HEADER_SIZE] != HWL_COMPACT_HEADER:
+        raise ValueError(f"{name} is not a valid compact HWL file (bad header)")
+    _, version, bits, flags, codec_id, num_pulses = HWL_COMPACT_STRUCT.unpack_from(data)
+    if version != HWL_COMPACT_VERSION:
+        raise ValueError(f"{name} is compact HWL version {version}, which is not supported")
+    codecs = {value: key for key, value in HWL_COMPACT_CODECS.items()}
+    if bits not in HWL_COMPACT_BITS or codec_id not in codecs:
+        raise ValueError(f"Corrupted compact HWL file: bad header in {name}")
+    return {
+        "version": version,
+        "bits": bits,
+        "delta": bool(flags & HWL_COMPACT_FLAG_DELTA),
+        "codec": codecs[codec_id],
+        "num_pulses": num_pulses,
+    }
+
+
+def decode_compact_hwl(data: bytes, name: str = "HWL data") -> HwlArray:
+    """
+    Decode the complete contents of a compact HWL file (header included) to an HwlArray.
+    """
+    header = read_compact_hwl_header(data, name)
+    payload = memoryview(data)[HWL_COMPACT_STRUCT.size:]
+    try:
+        if header["codec"] == "zlib":
+            payload = zlib.decompress(payload)
+        elif header["codec"] == "lzma":
+            payload = lzma.decompress(payload)
+    except (zlib.error, lzma.LZMAError):
+        raise ValueError(f"Corrupted compact HWL file: bad compressed data in {name}")
+
+    dtype = HWL_COMPACT_BITS[header["bits"]]
+    num_pulses = header["num_pulses"]
+    if len(payload) != 4 * num_pulses * dtype.itemsize:
+        raise ValueError(f"Corrupted compact HWL file: truncated pulse data in {name}")
+    quantised = np.frombuffer(payload, dtype=dtype).reshape(4, num_pulses)
+    if header["delta"]:
+        # Integer overflow wraps around, undoing the wrapped differences exactly
+        quantised = np.cumsum(quantised, axis=1, dtype=dtype)
+    return dequantise_hwl_array(quantised, header["bits"])
+
+
+def write_compact_hwl_file(destination_filename: str, pulses: HwlArray, bits: int = 16,
+                           delta: bool = True, codec: str = "zlib"):
+    """
+    Write an HwlArray to a compact HWL file, see encode_compact_hwl
+    """
+    if len(pulses) == 0:
+        raise ValueError("No pulses to write")
+
+    data = encode_compact_hwl(pulses, bits, delta, codec)
+    with open(destination_filename, 'wb') as file:
+        file.write(data)
+
+
+# ============================================================
+#  Lazy HWL file access
+# ============================================================
+
+class HwlFile:
+    """
+    Lazy, memory mapped view of an HWL file.
+
+    The pulse count is derived from the file size, and pulses are located by offset
+    arithmetic (pulse i starts at byte 8 + 16*i), so opening a file and reading any
+    part of it costs the same regardless of how long the file is.
+
+    Arrays returned by read_array are views onto the mapping, so they must not be used
+    after the file is closed. Use as a context manager to ensure the file is closed.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._mmap = None
+        try:
+            header = self._file.read(HWL_HEADER_SIZE)
+            if header != HWL_HEADER:
+                raise ValueError(f"{filename} is not a valid HWL file (bad header)")
+
+            data_size = os.fstat(self._file.fileno()).st_size - HWL_HEADER_SIZE
+            if data_size % HWL_PULSE_SIZE != 0:
+                raise ValueError(f"Corrupted HWL file: truncated pulse data in {filename}")
+
+            self.num_pulses = data_size // HWL_PULSE_SIZE
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_pulses
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(*index.indices(self.num_pulses))
+            if not indexes:
+                return empty_hwl_array(0)
+            # Read the covered range (which runs backwards for a negative step), then step through it
+            low, high = min(indexes[0], indexes[-1]), max(indexes[0], indexes[-1]) + 1
+            return self.read_array(low, high)[indexes[0] - low::indexes.step]
+        return self.read_pulse(index)
+
+    def close(self):
+        """Close the mapping and the underlying file"""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Arrays returned by read_array are still alive, the mapping is
+                # released once they are garbage collected.
+                pass
+            self._mmap = None
+        self._file.close()
+
+    @property
+    def duration(self) -> float:
+        """Duration of the file in seconds"""
+        return self.num_pulses * HWL_PULSE_TIME
+
+    @staticmethod
+    def pulse_offset(index: int) -> int:
+        """Byte offset of the given pulse within an HWL file"""
+        return HWL_HEADER_SIZE + HWL_PULSE_SIZE * index
+
+    def _check_range(self, start: int, stop: int):
+        if not 0 <= start <= stop <= self.num_pulses:
+            raise IndexError(f"Pulse range {start}-{stop} is outside {self.filename} ({self.num_pulses} pulses)")
+
+    def read_pulse(self, index: int) -> Pulse:
+        """Read a single pulse (negative indexes count back from the end)"""
+        if index < 0:
+            index += self.num_pulses
+        if not 0 <= index < self.num_pulses:
+            raise IndexError(f"Pulse {index} is outside {self.filename} ({self.num_pulses} pulses)")
+        left_amp, right_amp, left_freq, right_freq = np.frombuffer(
+            self._mmap, dtype="<f4", count=4, offset=self.pulse_offset(index)
+        ).tolist()
+        return Pulse(left_freq, right_freq, left_amp, right_amp)
+
+    def read_array(self, start: int = 0, stop: Optional[int] = None) -> HwlArray:
+        """Return pulses [start, stop) as a read only HwlArray view of the mapping"""
+        if stop is None:
+            stop = self.num_pulses
+        self._check_range(start, stop)
+        return np.frombuffer(self._mmap, dtype=HWL_DTYPE, count=stop - start, offset=self.pulse_offset(start))
+
+    def read_bytes(self, start: int = 0, stop: Optional[int] = None) -> memoryview:
+        """Return the raw pulse data for pulses [start, stop) without copying it"""
+        if stop is None:
+            stop = self.num_pulses
+        self._check_range(start, stop)
+        return memoryview(self._mmap)[self.pulse_offset(start):self.pulse_offset(stop)]
+
+    def time_range(self, start_sec: float, end_sec: Optional[float] = None) -> Tuple[int, int]:
+        """
+        Convert a time range in seconds to a pulse range [start, stop).
+        Start time is inclusive and end time is exclusive, end defaults to the end of the file.
+        """
+        start = int(start_sec * HWL_PULSES_PER_SECOND)
+        stop = int(end_sec * HWL_PULSES_PER_SECOND) if end_sec is not None else self.num_pulses
+        return start, stop
+
+    def read_time_range(self, start_sec: float, end_sec: Optional[float] = None) -> HwlArray:
+        """Return the pulses between two times (in seconds) as an HwlArray view"""
+        return self.read_array(*self.time_range(start_sec, end_sec))
+
+    def write_range(self, destination_filename: str, start: int = 0, stop: Optional[int] = None):
+        """
+        Write pulses [start, stop) to a new HWL file, copying only that part of this file
+        """
+        with HwlWriter(destination_filename) as writer:
+            writer.copy_from(self, start, stop)
+
+
+# ============================================================
+#  Streaming HWL writer
+# ============================================================
+
+def set_default_permissions(filename: str):
+    """
+    Give a file created by tempfile.mkstemp (which only we can read) the permissions a newly
+    created file would normally have, before it is moved into place.
+    Those permissions are taken from a file created next to it and removed again, as the umask can
+    only be read by setting it, which would briefly change it for every thread in the process.
+    """
+    probe_filename = f"{filename}.mode"
+    fd = os.open(probe_filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        mode = stat.S_IMODE(os.fstat(fd).st_mode)
+    finally:
+        os.close(fd)
+        os.unlink(probe_filename)
+    os.chmod(filename, mode)
+
+
+class HwlWriter:
+    """
+    Streaming HWL writer that never needs to hold more than one block of pulses in memory.
+
+    Output goes to a temporary file in the destination directory, which replaces the
+    destination when the writer is closed. This means the destination may safely be one
+    of the files being read from, and a failed write never leaves a partial file behind.
+    Use as a context manager, the output is discarded if the block raises.
+    """
+    # Maximum number of bytes handled per write or copy call
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, destination_filename: str):
+        self.destination_filename = destination_filename
+        self.num_pulses = 0
+        fd, self._temp_filename = tempfile.mkstemp(
+            suffix=".hwl", dir=os.path.dirname(os.path.abspath(destination_filename))
+        )
+        # Unbuffered, so the file descriptor position always matches what we have written
+        self._file = os.fdopen(fd, 'wb', buffering=0)
+        self._use_copy_file_range = hasattr(os, "copy_file_range")
+        self._use_sendfile = hasattr(os, "sendfile")
+        try:
+            self._write(HWL_HEADER)
+        except Exception:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self._file.write(view):]
+
+    def write_array(self, pulses: HwlArray):
+        """Append an HwlArray"""
+        data = np.ascontiguousarray(pulses, dtype=HWL_DTYPE)
+        self._write(data.view(np.uint8))
+        self.num_pulses += len(data)
+
+    def write_pulses(self, pulses: List[Pulse]):
+        """Append a list of Pulses"""
+        if pulses:
+            self.write_array(pulses_to_array(pulses))
+
+    def write_silence(self, count: int):
+        """Append the given number of silent (all zero) pulses"""
+        block = bytes(min(count * HWL_PULSE_SIZE, self.BLOCK_SIZE))
+        remaining = count * HWL_PULSE_SIZE
+        while remaining > 0:
+            size = min(remaining, len(block))
+            self._write(memoryview(block)[:size])
+            remaining -= size
+        self.num_pulses += count
+
+    def copy_from(self, source: HwlFile, start: int = 0, stop: Optional[int] = None):
+        """
+        Append pulses [start, stop) of an open HwlFile, copying the raw pulse data.
+        The copy is done in the kernel using os.copy_file_range or os.sendfile where the
+        OS supports it, otherwise in blocks straight from the source's memory mapping.
+        """
+        if stop is None:
+            stop = len(source)
+        source._check_range(start, stop)
+        offset = source.pulse_offset(start)
+        remaining = (stop - start) * HWL_PULSE_SIZE
+        src_fd = source._file.fileno()
+        dst_fd = self._file.fileno()
+
+        if self._use_copy_file_range:
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src_fd, dst_fd, min(remaining, self.BLOCK_SIZE), offset)
+                    if copied == 0:
+                        raise OSError("copy_file_range made no progress")
+                    offset += copied
+                    remaining -= copied
+            except OSError:
+                # Not supported for this pair of files (e.g. across filesystems on older kernels)
+                self._use_copy_file_range = False
+
+        if self._use_sendfile and remaining > 0:
+            try:
+                while remaining > 0:
+                    copied = os.sendfile(dst_fd, src_fd, offset, min(remaining, self.BLOCK_SIZE))
+                    if copied == 0:
+                        raise OSError("sendfile made no progress")
+                    offset += copied
+                    remaining -= copied
+            except OSError:
+                # Many platforms only support sendfile to sockets
+                self._use_sendfile = False
+
+        while remaining > 0:
+            size = min(remaining, self.BLOCK_SIZE)
+            block = source._mmap[offset:offset + size]
+            self._write(block)
+            offset += size
+            remaining -= size
+
+        self.num_pulses += stop - start
+
+    def close(self):
+        """Finish writing and move the output file into place"""
+        if self.num_pulses == 0:
+            self.abort()
+            raise ValueError("No pulses to write")
+        self._file.close()
+        set_default_permissions(self._temp_filename)
+        os.replace(self._temp_filename, self.destination_filename)
+
+    def abort(self):
+        """Discard the output"""
+        self._file.close()
+        if os.path.exists(self._temp_filename):
+            os.unlink(self._temp_filename)
+
+
 # ============================================================
 #  HWL read/write functions
 # ============================================================
@@ -48,24 +553,7 @@ def read_hwl_file(filename: str) -> List[Pulse]:
     left_channel_frequency: 0.0 to 1.0
     right_channel_frequency: 0.0 to 1.0
     """
-    pulses = []
-
-    with open(filename, 'rb') as f:
-        header = f.read(HWL_HEADER_SIZE)
-        if header != HWL_HEADER:
-            raise ValueError(f"{filename} is not a valid HWL file (bad header)")
-
-        while True:
-            chunk = f.read(HWL_PULSE_SIZE)
-            if len(chunk) == 0:
-                break
-            if len(chunk) != HWL_PULSE_SIZE:
-                raise ValueError(f"Corrupted HWL file: truncated pulse data in {filename}")
-
-            left_amp, right_amp, left_freq, right_freq = struct.unpack('<ffff', chunk)
-            pulses.append(Pulse(left_freq, right_freq, left_amp, right_amp))
-
-    return pulses
+    return array_to_pulses(read_hwl_array(filename))
 
 
 def write_hwl_file(destination_filename: str, pulses: List[Pulse]):
@@ -75,14 +563,4 @@ def write_hwl_file(destination_filename: str, pulses: List[Pulse]):
     if not pulses:
         raise ValueError("No pulses to write")
 
-    with open(destination_filename, 'wb') as file:
-        file.write(HWL_HEADER)
-
-        for p in pulses:
-            file.write(struct.pack(
-                '<ffff',
-                p.left_amp,
-                p.right_amp,
-                p.left_freq,
-                p.right_freq
-            ))
\ No newline at end of file
+    write_hwl_array(destination_filename, pulses_to_array(pulses))
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from funscript_combiner import AXIS_ORDER, combine_scripts, scan_and_group_files
+from libfunscript import load_funscript_axes, parse_funscript
+from test_libfunscript import dense_error
+
+ACTIONS = [{"at": 0, "pos": 0}, {"at": 500, "pos": 100}, {"at": 1000, "pos": 20}]
+
+
+def write_funscript(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content if isinstance(content, str) else json.dumps(content))
+
+
+def combine(scripts_dir, recursive=True, **kwargs):
+    all_files, groups = scan_and_group_files(scripts_dir, recursive)
+    combine_scripts(groups, AXIS_ORDER, jobs=2, **kwargs)
+
+
+def test_combine(tmp_path):
+    write_funscript(tmp_path / "a.funscript", {"version": "1.0", "actions": ACTIONS})
+    write_funscript(tmp_path / "a.roll.funscript", {"actions": ACTIONS[:2]})
+    write_funscript(tmp_path / "a.twist.funscript", {"actions": ACTIONS[1:]})
+    write_funscript(tmp_path / "sub" / "b.funscript", {"actions": ACTIONS})
+    write_funscript(tmp_path / "sub" / "b.surge.funscript", {"actions": ACTIONS})
+    combine(tmp_path)
+
+    combined = json.loads((tmp_path / "a.combined.funscript").read_text())
+    assert combined["version"] == "1.0" and combined["actions"] == ACTIONS
+    assert combined["axes"] == [{"id": "R0", "actions": ACTIONS[1:]}, {"id": "R1", "actions": ACTIONS[:2]}]
+    # Actions are written compactly, one line per list
+    assert json.dumps(ACTIONS, separators=(",", ":")) in (tmp_path / "a.combined.funscript").read_text()
+    assert json.loads((tmp_path / "sub" / "b.combined.funscript").read_text())["axes"][0]["id"] == "L1"
+
+
+@pytest.mark.parametrize("content", ["[1, 2]", "{", '"actions"'])
+@pytest.mark.parametrize("bad_file", ["c.funscript", "c.pitch.funscript"])
+def test_bad_set_does_not_stop_others(tmp_path, capsys, content, bad_file):
+    write_funscript(tmp_path / "a.funscript", {"actions": ACTIONS})
+    write_funscript(tmp_path / "a.sway.funscript", {"actions": ACTIONS})
+    write_funscript(tmp_path / "c.funscript", {"actions": ACTIONS})
+    write_funscript(tmp_path / "c.pitch.funscript", {"actions": ACTIONS})
+    write_funscript(tmp_path / bad_file, content)
+    with pytest.raises(SystemExit) as e:
+        combine(tmp_path)
+
+    assert e.value.code == 1
+    assert bad_file in capsys.readouterr().out
+    assert (tmp_path / "a.combined.funscript").exists()
+    assert not (tmp_path / "c.combined.funscript").exists()
+
+
+def test_up_to_date_sets_are_skipped(tmp_path, capsys):
+    main, axis = tmp_path / "a.funscript", tmp_path / "a.vib.funscript"
+    write_funscript(main, {"actions": ACTIONS})
+    write_funscript(axis, {"actions": ACTIONS})
+    combine(tmp_path)
+    output = tmp_path / "a.combined.funscript"
+    assert output.exists()
+    capsys.readouterr()
+
+    output.write_text("unchanged")
+    combine(tmp_path)
+    assert "Up to date" in capsys.readouterr().out
+    assert output.read_text() == "unchanged"
+
+    combine(tmp_path, force=True)
+    assert json.loads(output.read_text())["axes"][0]["id"] == "V0"
+
+    output.write_text("unchanged")
+    stat = output.stat()
+    os.utime(axis, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    combine(tmp_path)
+    assert json.loads(output.read_text())["axes"][0]["id"] == "V0"
+
+
+def test_simplify_keeps_played_axes_within_max_error(tmp_path, capsys):
+    rng = np.random.default_rng(0)
+    at = np.arange(0, 60000, 15)
+    def dense_actions(period):
+        pos = 50.0 + 45.0 * np.sin(at / period) + rng.normal(0.0, 0.2, len(at))
+        return [{"at": int(a), "pos": round(float(p), 1)} for a, p in zip(at, pos)]
+    main = {"actions": dense_actions(400.0)}
+    axes = {"surge": dense_actions(900.0), "twist": dense_actions(250.0), "vib": dense_actions(300.0)}
+    write_funscript(tmp_path / "a.funscript", main)
+    for name, actions in axes.items():
+        write_funscript(tmp_path / f"a.{name}.funscript", {"actions": actions})
+    combine(tmp_path, simplify=1.0)
+
+    output = capsys.readouterr().out
+    combined = json.loads((tmp_path / "a.combined.funscript").read_text())
+    unsimplified = dict(main, axes=[{"id": "L1", "actions": axes["surge"]}, {"id": "R0", "actions": axes["twist"]}])
+    original_axes = load_funscript_axes(parse_funscript(unsimplified))
+    simplified_axes = load_funscript_axes(parse_funscript(combined))
+    for axis_id, original in original_axes.items():
+        reported = float(output.split(f"{axis_id}: ")[1].split("max error ")[1].split()[0])
+        assert len(simplified_axes[axis_id].times) < len(original.times) / 4
+        assert dense_error(original, simplified_axes[axis_id]) <= min(reported + 0.005, 1.0)
+    # Axes Howl doesn't play are left alone
+    assert combined["axes"][-1] == {"id": "V0", "actions": axes["vib"]}
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+
+import numpy as np
+import pytest
+
+from howlapi import AsyncHowlAPI, HowlAPI, HowlAPIError, HowlWebSocketAPI
+from libhwl import empty_hwl_array, hwl_array_to_bytes
+from howlstub import StubDevice, StubServer
+
+API_KEY = "test"
+
+
+class DroppingDevice(StubDevice):
+    """Carries out commands, but drops the connection instead of answering the next drop_count of them"""
+    drop_count = 0
+
+    def handle_request(self, endpoint, params):
+        result = super().handle_request(endpoint, params)
+        if self.drop_count:
+            self.drop_count -= 1
+            raise ConnectionResetError("Connection dropped by test")
+        return result
+
+
+@pytest.fixture
+def server():
+    with StubServer(API_KEY, port=0, ws_port=None, device=DroppingDevice()) as server:
+        yield server
+
+
+@pytest.fixture
+def api(server):
+    with HowlAPI(server.host, API_KEY, port=server.port) as api:
+        yield api
+
+
+@pytest.fixture
+def hwl_data():
+    pulses = empty_hwl_array(400)
+    pulses["left_amp"] = np.linspace(0.0, 1.0, 400)
+    pulses["right_freq"] = 0.5
+    return hwl_array_to_bytes(pulses)
+
+
+def test_commands(api, server):
+    status = api.set_power(power_a=30, power_b=40)
+    assert (status.options.power_a, status.options.power_b) == (30, 40)
+    assert api.increment_power(1, 5).options.power_b == 45
+    assert [a.name for a in api.available_activities()] == [name for name, _ in StubDevice.ACTIVITIES]
+    assert api.get_status().options.power_a == 30
+
+
+def test_idle_connection_closed_by_device_is_replaced(api, server):
+    api.get_status()
+    server.close_connections()
+    time.sleep(0.1)
+    assert api.increment_power(0, 5).options.power_a == 5
+    assert server.device.request_counts["increment_power"] == 1
+
+
+def test_dropped_command_is_not_repeated(api, server):
+    api.get_status()
+    server.device.drop_count = 1
+    with pytest.raises(urllib.error.URLError):
+        api.increment_power(0, 5)
+    assert server.device.request_counts["increment_power"] == 1
+    assert api.get_status().options.power_a == 5
+
+
+def test_dropped_idempotent_command_is_retried(api, server):
+    api.get_status()
+    server.device.drop_count = 1
+    assert api.set_power(power_a=7).options.power_a == 7
+    assert server.device.request_counts["set_power"] == 2
+
+
+def test_dropped_batch_is_only_retried_if_idempotent(api, server):
+    api.get_status()
+    server.device.drop_count = 1
+    with api.batch() as b:
+        b.set_power(power_a=10)
+        b.set_mute(True)
+    assert b.status().options.power_a == 10
+    assert server.device.request_counts["set_power"] == 2
+
+    server.device.drop_count = 1
+    with pytest.raises(urllib.error.URLError):
+        with api.batch() as b:
+            b.set_power(power_a=20)
+            b.set_mute()
+    # Sent once, the device dropped the connection after carrying out set_power
+    assert server.device.request_counts["set_power"] == 3
+
+
+def test_async_dropped_commands(server):
+    async def run():
+        async with AsyncHowlAPI(server.host, API_KEY, port=server.port) as api:
+            await api.get_status()
+            server.device.drop_count = 1
+            with pytest.raises(urllib.error.URLError):
+                await api.decrement_power(0, 1)
+            assert server.device.request_counts["decrement_power"] == 1
+
+            await api.get_status()
+            server.device.drop_count = 1
+            assert (await api.set_power(power_a=9)).options.power_a == 9
+            assert server.device.request_counts["set_power"] == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("source", ["bytes", "file", "filename"])
+@pytest.mark.parametrize("compress", [True, False])
+def test_upload_hwl(api, server, hwl_data, tmp_path, source, compress):
+    filename = tmp_path / "test.hwl"
+    filename.write_bytes(hwl_data)
+    if source == "file":
+        with open(filename, "rb") as f:
+            status = api.upload_hwl(f, title="Upload", play=True, compress=compress, chunk_size=1000)
+    else:
+        hwl = hwl_data if source == "bytes" else str(filename)
+        status = api.upload_hwl(hwl, title="Upload", play=True, compress=compress, chunk_size=1000)
+
+    assert (status.player.title, status.player.playing, status.player.duration) == ("Upload", True, 10.0)
+    received, size = server.device.uploads[-1]
+    assert size == len(hwl_data)
+    assert received < size if compress else received == size
+
+
+@pytest.mark.parametrize("source", ["bytes", "file", "filename"])
+def test_async_upload_hwl(server, hwl_data, tmp_path, source):
+    filename = tmp_path / "test.hwl"
+    filename.write_bytes(hwl_data)
+
+    async def run():
+        async with AsyncHowlAPI(server.host, API_KEY, port=server.port) as api:
+            if source == "file":
+                with open(filename, "rb") as f:
+                    return await api.upload_hwl(f, title="Async")
+            return await api.upload_hwl(hwl_data if source == "bytes" else str(filename), title="Async")
+
+    status = asyncio.run(run())
+    assert (status.player.title, status.player.duration) == ("Async", 10.0)
+    assert server.device.uploads == [(server.device.uploads[0][0], len(hwl_data))]
+
+
+@pytest.fixture
+def ws_server():
+    with StubServer(API_KEY, port=0, ws_port=0, latency=0.002) as server:
+        yield server
+
+
+@pytest.fixture
+def ws_api(ws_server):
+    with HowlWebSocketAPI(ws_server.host, API_KEY, port=ws_server.ws_port, http_port=ws_server.port) as api:
+        yield api
+
+
+def test_websocket_responses_match_requests_under_concurrent_callers(ws_api, ws_server):
+    errors = []
+
+    def caller(power):
+        try:
+            for _ in range(20):
+                # The status in each response is the device state just after its own command
+                assert ws_api.set_power(power_a=power).options.power_a == power
+                assert ws_api.get_status().player is not None
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller, args=(power,)) for power in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert ws_server.device.request_counts["set_power"] == 8 * 20
+
+
+def test_websocket_auth_failure(ws_server):
+    with HowlWebSocketAPI(ws_server.host, "wrong", port=ws_server.ws_port) as api:
+        with pytest.raises(HowlAPIError) as e:
+            api.get_status()
+    assert e.value.status_code == 401
+    assert ws_server.device.request_counts.get("status", 0) == 0
+
+
+def test_websocket_batch(ws_api, ws_server):
+    with ws_api.batch() as b:
+        b.set_power(power_a=10, power_b=20)
+        b.increment_power(0, 5)
+        b.set_mute(True)
+    assert len(b.results) == 3
+    status = b.status()
+    assert (status.options.power_a, status.options.power_b, status.options.mute) == (15, 20, True)
+
+    with pytest.raises(HowlAPIError) as e:
+        with ws_api.batch() as b:
+            b.increment_power(0, 1)
+            b.set_power(power_a="loud")
+            b.increment_power(0, 1)
+    assert e.value.status_code == 400
+    # Later commands are still carried out, in order
+    assert isinstance(b.results[1], HowlAPIError)
+    assert b.status().options.power_a == 17
+
+
+def test_websocket_large_frame(ws_api, ws_server):
+    actions = [{"at": i * 10, "pos": i % 101} for i in range(100000)]
+    funscript = json.dumps({"actions": actions})
+    assert len(funscript) > 1 << 21
+    status = ws_api.load_funscript(funscript, title="Large", play=True)
+    assert (status.player.title, status.player.duration) == ("Large", 999.99)
+    # The connection is still in step afterwards
+    assert ws_api.set_power(power_b=3).options.power_b == 3
+
+
+def test_websocket_reconnects_after_drop(ws_api, ws_server):
+    ws_api.set_power(power_a=1)
+    session = ws_api._session
+    ws_server.close_connections()
+    deadline = time.monotonic() + 5.0
+    while ws_api._session is session and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ws_api._session is None
+
+    assert ws_api.increment_power(0, 2).options.power_a == 3
+    assert ws_api._session is not session
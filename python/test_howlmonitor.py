@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from howlapi import HowlAPI
+from howlmonitor import StatusMonitor
+from howlstub import StubServer
+
+API_KEY = "test"
+
+
+@pytest.fixture
+def server():
+    with StubServer(API_KEY, port=0, ws_port=None) as server:
+        yield server
+
+
+@pytest.fixture
+def api(server):
+    """The client that changes the device, the monitor polls with its own"""
+    with HowlAPI(server.host, API_KEY, port=server.port) as api:
+        yield api
+
+
+@pytest.fixture
+def monitor(server):
+    with HowlAPI(server.host, API_KEY, port=server.port) as poll_api:
+        monitor = StatusMonitor(poll_api, interval=0.01)
+        yield monitor
+        monitor.stop()
+
+
+def settle(monitor, timeout=5.0):
+    """
+    Wait until a poll started after now has finished, callbacks included. A poll may already be
+    waiting for an older status, and polls are counted before their callbacks run, so that's 3 more.
+    """
+    target = monitor.polls + 3
+    deadline = time.monotonic() + timeout
+    while monitor.polls < target:
+        assert time.monotonic() < deadline, "Monitor stopped polling"
+        time.sleep(0.005)
+
+
+def test_on_change_only_for_subscribed_fields(api, monitor):
+    power_calls, all_calls = [], []
+    monitor.on_change(lambda changes, status: power_calls.append(changes), fields=["power_a", "options.mute"])
+    monitor.on_change(lambda changes, status: all_calls.append(changes))
+    monitor.start()
+    settle(monitor)
+    # The first poll is a change from None
+    assert power_calls == [{"options.power_a": (None, 0), "options.mute": (None, False)}]
+    assert len(all_calls) == 1 and "player.position" not in all_calls[0]
+    del power_calls[:], all_calls[:]
+
+    api.set_power(power_b=5)
+    settle(monitor)
+    assert power_calls == []
+    assert all_calls == [{"options.power_b": (0, 5)}]
+
+    api.set_power(power_a=7)
+    settle(monitor)
+    api.seek(3.0)
+    settle(monitor)
+    assert power_calls == [{"options.power_a": (0, 7)}]
+    # Position changes are left to on_position
+    assert all_calls[1:] == [{"options.power_a": (0, 7)}]
+
+    with pytest.raises(ValueError):
+        monitor.on_change(print, fields=["volume"])
+
+
+def test_on_position_crossings(api, monitor):
+    crossings = []
+    monitor.on_position(10.0, lambda status: crossings.append(status.player.position))
+    monitor.start()
+    settle(monitor)
+
+    for position, expected in [(5.0, []), (10.0, [10.0]), (12.0, [10.0]),
+                               # Going back over the threshold doesn't fire, passing it forwards again does
+                               (2.0, [10.0]), (15.0, [10.0, 15.0]), (9.5, [10.0, 15.0])]:
+        api.seek(position)
+        settle(monitor)
+        assert crossings == expected, position
+
+
+def test_wait_for_update(api, monitor):
+    monitor.start()
+    settle(monitor)
+    start = time.monotonic()
+    assert monitor.wait_for_update(timeout=0.2) is None
+    assert time.monotonic() - start >= 0.2
+
+    timer = threading.Timer(0.1, api.set_power, kwargs={"power_a": 42})
+    timer.start()
+    try:
+        status = monitor.wait_for_update(timeout=5.0)
+    finally:
+        timer.join()
+    assert status is not None and status.options.power_a == 42
+    assert monitor.status is status
+
+
+def test_stop_joins_poller(monitor):
+    monitor.start()
+    settle(monitor)
+    thread = monitor._thread
+    monitor.stop()
+    assert not thread.is_alive() and monitor._thread is None
+    polls = monitor.polls
+    time.sleep(0.05)
+    assert monitor.polls == polls
+
+    # Stopping again does nothing, and the monitor can be restarted
+    monitor.stop()
+    monitor.start()
+    settle(monitor)
+    assert monitor.polls > polls
@@ -0,0 +1,85 @@
+import urllib.error
+
+import pytest
+
+from howlapi import HowlAPIError
+from howlretry import CircuitBreaker, CircuitOpenError, ResilientHowlAPI, RetryPolicy
+
+
+class FakeAPI:
+    """Answers _request with each of its outcomes in turn, raising those that are exceptions"""
+    timeout = 5
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def _request(self, endpoint, payload=None):
+        self.requests.append(endpoint)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def resilient(api, reset_timeout=0.0):
+    return ResilientHowlAPI(api, RetryPolicy(max_attempts=3, base_delay=0.0),
+                            CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout))
+
+
+def unreachable():
+    return urllib.error.URLError("unreachable")
+
+
+def test_idempotent_commands_are_retried():
+    api = FakeAPI(unreachable(), {"ok": 1})
+    assert resilient(api)._request("status") == {"ok": 1}
+    assert api.requests == ["status", "status"]
+
+
+def test_non_idempotent_commands_are_not_retried():
+    api = FakeAPI(unreachable())
+    with pytest.raises(urllib.error.URLError):
+        resilient(api)._request("increment_power", {"channel": 0})
+    assert api.requests == ["increment_power"]
+
+
+def test_breaker_opens_and_recovers():
+    api = FakeAPI(unreachable(), unreachable(), {"ok": 1})
+    client = resilient(api, reset_timeout=60.0)
+    with pytest.raises(urllib.error.URLError):
+        client._request("status")
+    assert client.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client._request("status")
+    assert len(api.requests) == 2
+
+    client.breaker.reset_timeout = 0.0
+    assert client._request("status") == {"ok": 1}
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize("interruption", [KeyboardInterrupt(), SystemExit()])
+def test_interrupted_trial_does_not_block_the_breaker(interruption):
+    api = FakeAPI(unreachable(), unreachable(), interruption, {"ok": 1})
+    client = resilient(api)
+    with pytest.raises(urllib.error.URLError):
+        client._request("status")
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(type(interruption)):
+        client._request("status")
+    # The next call is the trial instead
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client._request("status") == {"ok": 1}
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_device_errors_close_the_breaker():
+    api = FakeAPI(unreachable(), unreachable(), HowlAPIError(400, "Invalid parameters"))
+    client = resilient(api)
+    with pytest.raises(urllib.error.URLError):
+        client._request("status")
+    with pytest.raises(HowlAPIError):
+        client._request("status")
+    assert client.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,48 @@
+import pytest
+
+import howlstream
+from howlapi import HowlAPI
+from howlstream import PulseStreamer, SyncedPulseStreamer
+from howlstub import StubDevice, StubServer
+
+API_KEY = "test"
+PULSES = 120  # 3 seconds
+# The device clock is only fitted once its observations span DeviceClock.MIN_FIT_SECONDS
+SYNCED_PULSES = 360
+
+
+def pulses(count):
+    for i in range(count):
+        yield (i / count, 1.0 - i / count, 0.5, 0.5)
+
+
+def stream(streamer_class, device, count, **kwargs):
+    with StubServer(API_KEY, port=0, ws_port=None, device=device) as server:
+        with HowlAPI(server.host, API_KEY, port=server.port) as api:
+            return streamer_class(api, **kwargs).stream(pulses(count))
+
+
+def test_stream(monkeypatch):
+    monkeypatch.setattr(howlstream, "STATS_SAMPLES", 10)
+    device = StubDevice()
+    stats = stream(PulseStreamer, device, PULSES, buffer_size=16, batch_size=4)
+
+    assert stats.pulses_sent == PULSES
+    assert stats.batches_sent > 10
+    assert device.stream_stats["overwritten"] == 0
+    # Only recent batches are kept, the maximum covers them all
+    assert len(stats.jitter) == 10
+    assert stats.max_jitter >= max(stats.jitter)
+
+
+def test_synced_stream_follows_device_clock(monkeypatch):
+    monkeypatch.setattr(howlstream, "STATS_SAMPLES", 10)
+    clock_ppm = 20000.0
+    device = StubDevice(clock_ppm=clock_ppm)
+    stats = stream(SyncedPulseStreamer, device, SYNCED_PULSES, buffer_size=16, target_depth=6)
+
+    assert stats.pulses_sent == SYNCED_PULSES
+    assert device.stream_stats["overwritten"] == 0
+    assert stats.drift_ppm == pytest.approx(clock_ppm, abs=5000.0)
+    assert len(stats.latencies) == 10
+    assert len(stats.jitter) <= 10
@@ -0,0 +1,56 @@
+import socket
+import threading
+
+import pytest
+
+from howlws import OP_CONTINUATION, OP_PING, OP_PONG, OP_TEXT, WebSocketConnection, WebSocketError
+
+
+@pytest.fixture
+def pair():
+    client_sock, server_sock = socket.socketpair()
+    client = WebSocketConnection(client_sock, client_sock.makefile("rb"), mask=True)
+    server = WebSocketConnection(server_sock, server_sock.makefile("rb"), mask=False)
+    yield client, server
+    client.close()
+    server.close()
+
+
+def send_in_background(connection, text):
+    """Large messages don't fit in the socket buffers, so are sent while the other end receives"""
+    thread = threading.Thread(target=connection.send_text, args=(text,))
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize("length", [0, 125, 126, 65535, 65536, 300000])
+def test_message_lengths(pair, length):
+    client, server = pair
+    text = "".join(chr(ord("a") + i % 26) for i in range(length))
+    sender = send_in_background(client, text)
+    assert server.recv_text() == text
+    sender.join()
+    sender = send_in_background(server, text + "é")
+    assert client.recv_text() == text + "é"
+    sender.join()
+
+
+def test_fragments_and_pings(pair):
+    client, server = pair
+    server.send_frame(OP_PING, b"ping")
+    server.sock.sendall(b"\x01\x03abc")  # unfinished text frame, then its continuation
+    server.send_frame(OP_CONTINUATION, b"def")
+    assert client.recv_text() == "abcdef"
+    # The ping was answered
+    assert server._read_frame() == (True, OP_PONG, b"ping")
+    server.send_frame(OP_TEXT, b"next")
+    assert client.recv_text() == "next"
+
+
+def test_close(pair):
+    client, server = pair
+    server.close()
+    assert client.recv_text() is None
+    assert client.closed
+    with pytest.raises(WebSocketError):
+        client.send_text("after close")
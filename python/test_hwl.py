@@ -0,0 +1,402 @@
+import os
+import stat
+import subprocess
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+aubio = pytest.importorskip("aubio")
+
+from hwl import (ConversionCache, CACHE_FILENAME, SIDECAR_SUFFIX, SampleBlocks, StageTimings, choose_normalisation_maximum,
+                 convert_audio_file, convert_audio_files, detect_segment, fill_missing_frequencies, fill_missing_sample_frequencies, load_sidecar,
+                 make_pitch_settings, normalise_values, plan_segments, render_hwl, save_sidecar, select_ranks, stitch_hop_blocks,
+                 TimeBinner)
+from libhwl import HwlFile, read_hwl_array, write_hwl_array, empty_hwl_array
+
+SEGMENT_SECONDS = 1.0
+# See detect_segment: after a seek, only the first window_size frames of a segment may differ
+BOUNDARY_BINS = 5
+
+
+def write_wav(filename, sample_rate, seconds=5.0):
+    """A stereo WAV with a different rising tone on each channel, and some quieter parts"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    envelope = 0.2 + 0.6 * np.abs(np.sin(np.pi * t / 1.3))
+    left = envelope * np.sin(2 * np.pi * (200.0 * t + 40.0 * t ** 2))
+    right = envelope * np.sin(2 * np.pi * (500.0 * t - 30.0 * t ** 2))
+    frames = (np.stack([left, right], axis=1) * 32767).astype("<i2")
+    with wave.open(str(filename), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(frames.tobytes())
+
+
+def bin_hops(hops, settings):
+    binner = TimeBinner(1.0 / 40, settings.sample_rate, len(hops.frames))
+    binner.add_hops(hops)
+    return binner.bin_samples()
+
+
+def detect_in_segments(audio_file, settings):
+    src = aubio.source(str(audio_file), settings.sample_rate, settings.hop_size, channels=2)
+    total_frames = src.duration
+    src.close()
+    segments = plan_segments(total_frames, settings.hop_size, settings.sample_rate, SEGMENT_SECONDS)
+    assert len(segments) > 1
+    return stitch_hop_blocks([detect_segment(audio_file, settings, start, stop) for start, stop in segments]), segments
+
+
+def test_segments_match_single_pass(tmp_path):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones.wav"
+    write_wav(audio_file, settings.sample_rate)
+
+    single = detect_segment(audio_file, settings)
+    segmented, _ = detect_in_segments(audio_file, settings)
+
+    for column in ("frames", "left_freq", "right_freq", "left_sq", "right_sq", "num_samples"):
+        assert np.array_equal(getattr(segmented, column), getattr(single, column)), column
+    assert segmented.counts() == single.counts()
+
+
+def test_segments_in_worker_processes(tmp_path):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones.wav"
+    # Not a whole number of hops, so the last segment ends on a short hop
+    write_wav(audio_file, settings.sample_rate, seconds=5.001)
+    hwl_file = audio_file.with_suffix(".hwl")
+
+    [result] = convert_audio_files([audio_file], jobs=1, sidecar=False)
+    assert result.status == "converted"
+    single = hwl_file.read_bytes()
+    hwl_file.unlink()
+
+    [result] = convert_audio_files([audio_file], jobs=2, segment_seconds=SEGMENT_SECONDS, sidecar=False)
+    assert result.status == "converted", result.message
+    assert hwl_file.read_bytes() == single
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_parallel_conversion_matches_serial(tmp_path, stream):
+    settings = make_pitch_settings()
+    audio_files = []
+    for i, seconds in enumerate([0.5, 3.0, 4.2, 2.001]):
+        audio_file = tmp_path / f"tones{i}.wav"
+        write_wav(audio_file, settings.sample_rate, seconds=seconds)
+        audio_files.append(audio_file)
+
+    results = convert_audio_files(audio_files, jobs=1, sidecar=False, stream=stream)
+    assert [r.status for r in results] == ["converted"] * len(audio_files)
+    serial = [f.with_suffix(".hwl").read_bytes() for f in audio_files]
+    for f in audio_files:
+        f.with_suffix(".hwl").unlink()
+
+    results = convert_audio_files(audio_files, jobs=2, segment_seconds=SEGMENT_SECONDS, sidecar=False, stream=stream)
+    assert [r.audio_file for r in results] == audio_files
+    assert [r.status for r in results] == ["converted"] * len(audio_files)
+    assert [f.with_suffix(".hwl").read_bytes() for f in audio_files] == serial
+
+
+def test_segments_in_worker_processes_from_command_line(tmp_path):
+    settings = make_pitch_settings()
+    write_wav(tmp_path / "tones.wav", settings.sample_rate, seconds=30.0)
+    hwl = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hwl.py")
+    completed = subprocess.run([sys.executable, hwl, "-j", "2", "--segment-seconds", "7", "--no-cache", str(tmp_path)],
+                               capture_output=True, text=True, timeout=300)
+    assert completed.returncode == 0, completed.stdout + completed.stderr
+    assert "1 converted" in completed.stdout
+    assert "Fatal Python error" not in completed.stderr
+
+
+def test_resampled_segments_within_tolerance(tmp_path):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones_44100.wav"
+    write_wav(audio_file, 44100)
+
+    try:
+        single = bin_hops(detect_segment(audio_file, settings), settings)
+    except RuntimeError as e:
+        pytest.skip(f"aubio cannot resample here: {e}")
+    segmented_hops, segments = detect_in_segments(audio_file, settings)
+    segmented = bin_hops(segmented_hops, settings)
+    assert len(segmented) == len(single)
+
+    # Bins at the start of each segment (after the first) may differ, all others must be identical
+    frames_per_bin = settings.sample_rate // 40
+    near_boundary = np.zeros(len(single), dtype=bool)
+    for start, _ in segments[1:]:
+        first_bin = start // frames_per_bin
+        near_boundary[first_bin:first_bin + BOUNDARY_BINS] = True
+    for name in single.dtype.names:
+        assert np.array_equal(segmented[name][~near_boundary], single[name][~near_boundary]), name
+
+
+def test_existing_conversions_join_the_cache(tmp_path):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones.wav"
+    write_wav(audio_file, settings.sample_rate, seconds=1.0)
+    placeholder = empty_hwl_array(1)
+    write_hwl_array(str(audio_file.with_suffix(".hwl")), placeholder)
+
+    cache = ConversionCache(tmp_path / CACHE_FILENAME)
+    result = convert_audio_file(audio_file, cache=cache, sidecar=False)
+    assert result.status == "skipped"
+    assert cache.has_entry(audio_file)
+    assert convert_audio_file(audio_file, cache=cache, sidecar=False).status == "skipped"
+
+    # Once it is in the cache, a change to the audio is noticed
+    write_wav(audio_file, settings.sample_rate, seconds=1.5)
+    assert convert_audio_file(audio_file, cache=cache, sidecar=False).status == "converted"
+    assert len(read_hwl_array(str(audio_file.with_suffix(".hwl")))) == 60
+
+
+def test_cache_saves_and_prunes(tmp_path):
+    kept, deleted = tmp_path / "kept.wav", tmp_path / "deleted.wav"
+    for audio_file in (kept, deleted):
+        audio_file.write_bytes(audio_file.name.encode())
+
+    cache = ConversionCache(tmp_path / CACHE_FILENAME)
+    for audio_file in (kept, deleted):
+        cache.record(audio_file, "hash " + audio_file.name, {"version": 1}, audio_file.stat())
+    # Saves are batched
+    assert not cache.filename.exists()
+    cache.save()
+    assert ConversionCache(cache.filename).entries == cache.entries
+
+    assert cache.prune([kept]) == 1
+    cache.save()
+    reloaded = ConversionCache(cache.filename)
+    assert reloaded.has_entry(kept) and not reloaded.has_entry(deleted)
+
+    if os.name == "posix":
+        plain = tmp_path / "plain"
+        plain.touch()
+        assert stat.S_IMODE(cache.filename.stat().st_mode) == stat.S_IMODE(plain.stat().st_mode)
+
+
+def test_sidecar_round_trip(tmp_path):
+    audio_file = tmp_path / "tones.wav"
+    sidecar_filename = audio_file.with_suffix(SIDECAR_SUFFIX)
+    samples = empty_hwl_array(10)
+    samples["left_amp"] = np.arange(10)
+    save_sidecar(sidecar_filename, samples, audio_file, {"pulses_per_second": 40}, "abc")
+
+    loaded, metadata = load_sidecar(sidecar_filename)
+    assert np.array_equal(loaded, samples)
+    assert metadata == {"audio_file": "tones.wav", "params": {"pulses_per_second": 40}, "sha256": "abc"}
+    if os.name == "posix":
+        plain = tmp_path / "plain"
+        plain.touch()
+        assert stat.S_IMODE(sidecar_filename.stat().st_mode) == stat.S_IMODE(plain.stat().st_mode)
+
+
+def test_stream_matches_default_mode(tmp_path):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones.wav"
+    # Default mode reads a hop at a time, and aubio's WAV reader can return the wrong (earlier) hops for reads
+    # that short (see decode_blocks). Steady tones whose periods divide the hop size make every hop hold the
+    # same frames, so both modes must agree exactly. Not a whole number of hops, so the last one is short.
+    seconds = 5.001
+    t = np.arange(int(settings.sample_rate * seconds)) / settings.sample_rate
+    left = 0.5 * np.sin(2 * np.pi * settings.sample_rate / settings.hop_size * t)
+    right = 0.25 * np.sin(2 * np.pi * 2 * settings.sample_rate / settings.hop_size * t)
+    with wave.open(str(audio_file), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(settings.sample_rate)
+        f.writeframes((np.stack([left, right], axis=1) * 32767).astype("<i2").tobytes())
+    hwl_file, sidecar_filename = audio_file.with_suffix(".hwl"), audio_file.with_suffix(SIDECAR_SUFFIX)
+
+    assert convert_audio_file(audio_file).status == "converted"
+    default_bins, _ = load_sidecar(sidecar_filename)
+    default_hwl = hwl_file.read_bytes()
+    hwl_file.unlink()
+
+    assert convert_audio_file(audio_file, stream=True).status == "converted"
+    stream_bins, _ = load_sidecar(sidecar_filename)
+    assert stream_bins.tobytes() == default_bins.tobytes()
+    assert hwl_file.read_bytes() == default_hwl
+    # Nothing is left behind by the streaming pipeline
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["tones.bins.npz", "tones.hwl", "tones.wav"]
+
+
+def test_stream_timings_cover_every_stage(tmp_path, capsys):
+    settings = make_pitch_settings()
+    audio_file = tmp_path / "tones.wav"
+    write_wav(audio_file, settings.sample_rate, seconds=2.0)
+
+    result = convert_audio_file(audio_file, sidecar=False, stream=True)
+    assert result.status == "converted"
+    assert list(result.timings) == list(StageTimings.STAGES)
+    assert all(seconds > 0.0 for seconds in result.timings.values()), result.timings
+    report = capsys.readouterr().out.split("Stage timings: ")[1].splitlines()[0]
+    assert report == StageTimings.format(result.timings, result.audio_seconds)
+    for stage in StageTimings.STAGES:
+        assert f"{stage} " in report
+
+    # Default mode conversions aren't timed
+    assert convert_audio_file(audio_file, sidecar=False, force=True).timings is None
+
+
+def test_normalised_in_blocks(tmp_path):
+    rng = np.random.default_rng(0)
+    samples = empty_hwl_array(50)
+    for name in samples.dtype.names:
+        samples[name] = rng.uniform(1.0, 1000.0, len(samples)).astype(np.float32)
+    # A leading gap longer than a block, and gaps that span blocks
+    samples["left_freq"][:9] = 0.0
+    samples["left_freq"][20:33] = 0.0
+    samples["left_freq"][45:] = 0.0
+    # No valid frequencies at all
+    samples["right_freq"] = 0.0
+
+    filled = fill_missing_sample_frequencies(samples)
+    for block_size in (1, 7, 50, 64):
+        blocks = list(SampleBlocks(samples, block_size=block_size).blocks())
+        assert np.concatenate(blocks).tobytes() == filled.tobytes()
+
+    # Rendering from a memory mapped binned file is the same as from an array
+    binned_filename = tmp_path / "binned.hwl"
+    write_hwl_array(str(binned_filename), samples)
+    render_hwl(samples, tmp_path / "from_array.hwl")
+    with HwlFile(str(binned_filename)) as binned_file:
+        render_hwl(binned_file.read_array(), tmp_path / "from_file.hwl")
+    assert (tmp_path / "from_file.hwl").read_bytes() == (tmp_path / "from_array.hwl").read_bytes()
+
+
+@pytest.mark.parametrize("values", [
+    np.array([3.0, -1.5, 0.0, -0.0, 2.5e-40, 1e30, -np.inf, np.inf, 7.0, 7.0], dtype=np.float32),
+    np.random.default_rng(1).lognormal(0.0, 3.0, 5000).astype(np.float32),
+    # Many values sharing a sort key bucket
+    np.repeat(np.float32([440.0, 440.00003, 441.0]), [3000, 1, 2000]),
+])
+def test_select_ranks(values):
+    ranks = [0, 1, len(values) // 2, len(values) - 2, len(values) - 1]
+    read_blocks = lambda: (values[start:start + 333] for start in range(0, len(values), 333))
+    assert np.array_equal(select_ranks(read_blocks, ranks), np.sort(values)[ranks])
+
+
+def reference_bins(hops, frames_per_bin):
+    """Bin hops one bin at a time: the median of each bin's non zero frequencies, and the RMS of its amplitudes"""
+    bins = {}
+    for hop in hops:
+        bins.setdefault(hop[0] // frames_per_bin, []).append(hop)
+    left_freq, right_freq, left_amp, right_amp = [], [], [], []
+    for bin_hops in bins.values():
+        for freqs, column in ((left_freq, 1), (right_freq, 2)):
+            valid = np.array([hop[column] for hop in bin_hops if hop[column] != 0.0], dtype=np.float32)
+            freqs.append(np.median(valid) if len(valid) else np.float32(0.0))
+        num_samples = np.float32(sum(hop[5] for hop in bin_hops))
+        for amps, column in ((left_amp, 3), (right_amp, 4)):
+            total = np.float32(0.0)
+            for hop in bin_hops:
+                total += np.float32(hop[column])
+            amps.append(np.sqrt(total / num_samples))
+    return [np.array(values, dtype=np.float32) for values in (left_freq, right_freq, left_amp, right_amp)]
+
+
+def test_bin_hops_match_reference():
+    rng = np.random.default_rng(0)
+    frames_per_bin = 1024
+    # Hops of varying length give bins with both odd and even numbers of hops, and the last hop is short
+    lengths = np.append(rng.integers(60, 400, 600), 17)
+    frames = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    left_freq = rng.uniform(100.0, 900.0, len(frames)).astype(np.float32)
+    right_freq = rng.uniform(100.0, 900.0, len(frames)).astype(np.float32)
+    # Some missing frequencies, and whole bins without any
+    left_freq[rng.random(len(frames)) < 0.3] = 0.0
+    right_freq[(frames // frames_per_bin) % 7 == 3] = 0.0
+    left_freq[(frames // frames_per_bin) % 11 == 5] = 0.0
+    left_sq = rng.uniform(0.0, 50.0, len(frames)).astype(np.float32)
+    right_sq = rng.uniform(0.0, 0.01, len(frames)).astype(np.float32)
+    hops = list(zip(frames, left_freq, right_freq, left_sq, right_sq, lengths))
+
+    hops_per_bin = np.bincount(frames // frames_per_bin)
+    assert (hops_per_bin % 2 == 0).any() and (hops_per_bin % 2 == 1).any()
+
+    binner = TimeBinner(1.0 / 40, 40960, expected_hops=16)
+    for hop in hops:
+        binner.add_hop(*hop)
+    binned = binner.bin_hops()
+    expected = reference_bins(hops, frames_per_bin)
+    for name, values, expected_values in zip(("left_freq", "right_freq", "left_amp", "right_amp"), binned, expected):
+        assert values.dtype == np.float32, name
+        assert np.array_equal(values, expected_values), name
+    assert (binned[0] == 0.0).any() and (binned[1] == 0.0).any()
+
+    empty = TimeBinner(1.0 / 40, 40960).bin_hops()
+    assert [len(values) for values in empty] == [0, 0, 0, 0]
+
+
+def reference_fill(freqs, default):
+    """Fill gaps with the last valid frequency, or the first valid one before there is one"""
+    valid = [f for f in freqs if f != 0.0]
+    last = valid[0] if valid else default
+    filled = []
+    for f in freqs:
+        if f != 0.0:
+            last = f
+        filled.append(last)
+    return np.array(filled, dtype=freqs.dtype)
+
+
+@pytest.mark.parametrize("freqs", [
+    [0.0, 0.0, 0.0, 300.0, 0.0, 310.0, 0.0, 0.0, 290.0, 0.0],
+    [250.0, 0.0, 260.0, 270.0],
+    [0.0, 0.0, 0.0],
+    [0.0],
+    [123.0],
+    [],
+])
+def test_fill_missing_frequencies(freqs):
+    freqs = np.array(freqs, dtype=np.float32)
+    filled = fill_missing_frequencies(freqs, default=400.0)
+    assert filled.dtype == np.float32
+    assert np.array_equal(filled, reference_fill(freqs, np.float32(400.0)))
+
+
+def stepped_normalisation_maximum(samples, attr_name):
+    """The original search: one np.percentile call per channel for each percentile, stepping down by 0.5"""
+    def percentile_maximum(percent):
+        return np.maximum(np.percentile(samples[f"left_{attr_name}"], percent),
+                          np.percentile(samples[f"right_{attr_name}"], percent))
+    known_good_max = percentile_maximum(98.0)
+    percentile = 100.0
+    while percentile > 98.0:
+        percentile_max = percentile_maximum(percentile)
+        if percentile_max <= known_good_max * 1.1:
+            return percentile_max
+        percentile -= 0.5
+    return known_good_max * 1.1
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 150, 1999, 5000])
+@pytest.mark.parametrize("outliers", [0, 1, 30, 200])
+def test_normalisation_maximum_matches_stepped_search(capsys, count, outliers):
+    rng = np.random.default_rng(count + outliers)
+    samples = empty_hwl_array(count)
+    for name in samples.dtype.names:
+        samples[name] = rng.uniform(0.0, 1.0, count).astype(np.float32)
+    # Outliers well above the rest, so the search steps down (or gives up at the known good maximum)
+    for name in ("left_amp", "right_freq"):
+        samples[name][rng.choice(count, min(outliers, count), replace=False)] = rng.uniform(2.0, 50.0, min(outliers, count))
+    for attr_name in ("amp", "freq"):
+        chosen = choose_normalisation_maximum(samples, attr_name)
+        expected = stepped_normalisation_maximum(samples, attr_name)
+        assert chosen == expected and chosen.dtype == expected.dtype, (attr_name, chosen, expected)
+    assert "98th percentile=" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("min_val, max_val", [(0.5, 0.5), (0.0, 0.0), (2.0, 1.0)])
+def test_normalise_values_empty_range(min_val, max_val):
+    normalised = normalise_values(np.array([0.0, 1.0, 5.0], dtype=np.float32), min_val, max_val)
+    assert np.array_equal(normalised, [0.0, 0.0, 0.0])
+    assert len(normalise_values(np.zeros(0, dtype=np.float32), min_val, max_val)) == 0
+
+
+def test_normalise_values_clamps():
+    values = np.array([-1.0, 0.0, 100.0, 400.0, 900.0], dtype=np.float32)
+    assert np.allclose(normalise_values(values, 0.0, 800.0), [0.0, 0.0, 0.125, 0.5, 1.0])
@@ -0,0 +1,80 @@
+import sys
+
+import numpy as np
+import pytest
+
+import hwltools
+from libhwl import empty_hwl_array, quantise_hwl_array, read_hwl_array, write_hwl_array
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["hwltools", *args])
+    hwltools.main()
+
+
+@pytest.fixture
+def hwl_filename(tmp_path):
+    pulses = empty_hwl_array(2400)
+    pulses["left_amp"] = np.linspace(0.0, 1.0, len(pulses))
+    pulses["right_amp"] = 0.25
+    pulses["left_freq"] = 0.5 + 0.5 * np.sin(np.arange(len(pulses)) / 10.0)
+    pulses["right_freq"] = 0.75
+    filename = tmp_path / "test.hwl"
+    write_hwl_array(str(filename), pulses)
+    return str(filename)
+
+
+@pytest.mark.parametrize("bits", ["8", "16"])
+def test_compress_decompress(monkeypatch, tmp_path, hwl_filename, bits):
+    compact, restored = str(tmp_path / "test.hwlz"), str(tmp_path / "restored.hwl")
+    run(monkeypatch, "compress", "--in", hwl_filename, "--out", compact, "--bits", bits)
+    run(monkeypatch, "decompress", "--in", compact, "--out", restored)
+    original = read_hwl_array(hwl_filename)
+    assert np.array_equal(quantise_hwl_array(read_hwl_array(restored), int(bits)),
+                          quantise_hwl_array(original, int(bits)))
+
+
+def test_info(monkeypatch, capsys, tmp_path, hwl_filename):
+    run(monkeypatch, "info", "--in", hwl_filename)
+    output = capsys.readouterr().out
+    assert "Number of pulses: 2400" in output
+    assert "Format: HWL" in output and "compression ratio" not in output.lower()
+
+    run(monkeypatch, "info", "--in", hwl_filename, "--estimate-ratio")
+    assert "Estimated compression ratio" in capsys.readouterr().out
+
+    compact = str(tmp_path / "test.hwlz")
+    run(monkeypatch, "compress", "--in", hwl_filename, "--out", compact)
+    capsys.readouterr()
+    run(monkeypatch, "info", "--in", compact)
+    output = capsys.readouterr().out
+    assert "Number of pulses: 2400" in output
+    assert "Format: compact HWL (16 bit, delta, zlib)" in output
+    assert "Compression ratio" in output
+
+
+def test_edit_compact_inputs(monkeypatch, tmp_path, hwl_filename):
+    compact = str(tmp_path / "test.hwlz")
+    run(monkeypatch, "compress", "--in", hwl_filename, "--out", compact)
+    original, pulses = read_hwl_array(hwl_filename), read_hwl_array(compact)
+    assert not np.array_equal(pulses, original)
+
+    out = str(tmp_path / "out.hwl")
+    run(monkeypatch, "append", "--in", compact, "--add", hwl_filename, "--out", out, "-r", "2")
+    assert np.array_equal(read_hwl_array(out), np.concatenate([pulses, original, original]))
+
+    run(monkeypatch, "concat", hwl_filename, compact, compact, "--out", out)
+    assert np.array_equal(read_hwl_array(out), np.concatenate([original, pulses, pulses]))
+
+    run(monkeypatch, "extract", "--in", compact, "--start", "10", "--end", "20.5", "--out", out)
+    assert np.array_equal(read_hwl_array(out), pulses[400:820])
+
+    run(monkeypatch, "silence", "--in", compact, "--duration", "1.5", "--out", out)
+    assert np.array_equal(read_hwl_array(out), np.concatenate([pulses, empty_hwl_array(60)]))
+    # The output is always a standard HWL file
+    with open(out, "rb") as f:
+        assert f.read(8) == b"YEAHBOI!"
+
+    # The output may replace a compact input
+    run(monkeypatch, "extract", "--in", compact, "--start", "0", "--end", "1", "--out", compact)
+    assert np.array_equal(read_hwl_array(compact), pulses[:40])
@@ -0,0 +1,284 @@
+import bisect
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+from libfunscript import (NORMALISATION_BALANCED, NORMALISATION_FULL_RANGE, NORMALISATION_OFF, SUPPORTED_AXES,
+                          FunscriptAxis, FunscriptSettings, load_funscript_axes, parse_funscript, read_funscript,
+                          render_blocks, render_funscript, render_funscript_file, simplify_actions, sort_actions)
+from libhwl import read_hwl_array
+
+
+# A scalar port of the app's FunscriptAxis and FunscriptPulseSource (Funscript.kt), one pulse at a time
+
+class ScalarAxis:
+    def __init__(self, actions, normalisation):
+        unique = {}
+        for action in actions:
+            unique.setdefault(action["at"], action["pos"])
+        actions = [(at, min(max(pos, 0.0), 100.0)) for at, pos in sorted(unique.items())]
+        if len(actions) < 2:
+            raise ValueError("Too few actions")
+        raw_min, raw_max = min(p for _, p in actions), max(p for _, p in actions)
+        if normalisation == "full_range":
+            min_pos, max_pos = raw_min, raw_max
+        elif normalisation == "balanced":
+            max_dist = max(50.0 - raw_min, raw_max - 50.0)
+            min_pos, max_pos = 50.0 - max_dist, 50.0 + max_dist
+        else:
+            min_pos, max_pos = 0.0, 100.0
+        value_range = max_pos - min_pos
+        if normalisation != "off" and (raw_min == raw_max or value_range <= 0.0):
+            raise ValueError("Too few positions")
+
+        self.times = [at / 1000.0 for at, _ in actions]
+        self.positions = [(p - min_pos) / value_range if normalisation != "off" else p / 100.0 for _, p in actions]
+        t, p = self.times, self.positions
+        last = len(t) - 1
+        secants = [(p[i + 1] - p[i]) / (t[i + 1] - t[i]) for i in range(last)]
+        self.velocities = []
+        for i in range(len(t)):
+            if i == 0:
+                velocity = secants[0]
+            elif i == last:
+                velocity = secants[last - 1]
+            elif secants[i - 1] * secants[i] <= 0.0:
+                velocity = 0.0
+            else:
+                dt_left, dt_right = t[i] - t[i - 1], t[i + 1] - t[i]
+                common = dt_left + dt_right
+                velocity = 3.0 * common / ((common + dt_right) / secants[i - 1] + (common + dt_left) / secants[i])
+            self.velocities.append(velocity)
+
+    def evaluate(self, time):
+        i = bisect.bisect_right(self.times, time) - 1
+        if i < 0:
+            return self.positions[0], 0.0, 0.0
+        if i >= len(self.times) - 1:
+            return self.positions[-1], 0.0, 0.0
+        t0, t1 = self.times[i], self.times[i + 1]
+        p0, p1 = self.positions[i], self.positions[i + 1]
+        m0, m1 = self.velocities[i], self.velocities[i + 1]
+        if p0 == p1:
+            return p0, 0.0, 0.0
+        dt = t1 - t0
+        h = (time - t0) / dt
+        h2, h3 = h * h, h * h * h
+        position = p0 * (2 * h3 - 3 * h2 + 1) + m0 * (h3 - 2 * h2 + h) * dt + p1 * (-2 * h3 + 3 * h2) + m1 * (h3 - h2) * dt
+        dpdh = (6 * h2 - 6 * h) * p0 + (3 * h2 - 4 * h + 1) * m0 * dt + (-6 * h2 + 6 * h) * p1 + (3 * h2 - 2 * h) * m1 * dt
+        d2pdh2 = (12 * h - 6) * p0 + (6 * h - 4) * m0 * dt + (-12 * h + 6) * p1 + (6 * h - 2) * m1 * dt
+        return min(max(position, 0.0), 1.0), dpdh / dt, d2pdh2 / (dt * dt)
+
+
+def clamp(value, low=0.0, high=1.0):
+    return min(max(value, low), high)
+
+
+def scalar_render(funscript, settings):
+    pref = lambda name: float(np.float32(getattr(settings, name)))
+    normalise = settings.normalise_axes
+    axes = {"L0": ScalarAxis(funscript["actions"], "full_range" if normalise else "off")}
+    for axis in funscript.get("axes", []):
+        if axis["id"] == "L0" or axis["id"] not in SUPPORTED_AXES:
+            continue
+        try:
+            axes[axis["id"]] = ScalarAxis(axis["actions"], "balanced" if normalise else "off")
+        except ValueError:
+            pass
+
+    def energy(time):
+        return sum(clamp(abs(axis.evaluate(time)[1]) / 5.0) ** 2 for axis in axes.values())
+
+    pulses = []
+    duration = max(axis.times[-1] for axis in axes.values())
+    for index in range(int(math.ceil(duration * 40)) + 1):
+        time = index / 40
+        sigma = max(pref("smoothing_sigma"), 0.01)
+        step = sigma / 4
+        weighted_sum = weight_sum = 0.0
+        for i in range(-12, 1):
+            offset = i * step
+            weight = math.exp(-(offset * offset) / (2.0 * sigma * sigma))
+            weighted_sum += weight * energy(time + offset)
+            weight_sum += weight
+        raw_amplitude = clamp(math.sqrt(weighted_sum / weight_sum))
+        if raw_amplitude < 0.005:
+            raw_amplitude = 0.0
+        amplitude = clamp(raw_amplitude ** max(1.0 - pref("volume"), 0.001))
+
+        position, l0_velocity, _ = axes["L0"].evaluate(time)
+        strength = pref("positional_effect_strength")
+        curve = max(pref("positional_effect_curve"), 0.01)
+        effective_position = 0.5 * (1 - strength) + position * strength
+        amp_a = amplitude * clamp(1.0 - effective_position) ** curve
+        amp_b = amplitude * clamp(effective_position) ** curve
+
+        freq_a = freq_b = 0.0
+        if raw_amplitude > 0.0:
+            proportion = pref("freq_energy_proportion")
+            core_base = position * (1.0 - proportion) + raw_amplitude * proportion
+            shift = clamp(l0_velocity / 5.0, -1.0, 1.0) * pref("directional_freq_shift")
+            if settings.flip_directional_freq_shift:
+                shift = -shift
+            freq_a, freq_b = clamp(core_base - shift), clamp(core_base + shift)
+            if "R0" in axes:
+                buzz = clamp(abs(axes["R0"].evaluate(time)[1]) / 5.0) * 0.5
+                freq_a, freq_b = freq_a + buzz, freq_b + buzz
+            if "R1" in axes:
+                spread = abs(axes["R1"].evaluate(time)[0] - 0.5) * 0.4
+                freq_a, freq_b = freq_a + spread * 0.2, freq_b - spread * 0.8
+            if "R2" in axes:
+                pitch = (axes["R2"].evaluate(time)[0] - 0.5) * 0.4
+                freq_a, freq_b = freq_a + pitch, freq_b - pitch
+            impact = sum((axes[a].evaluate(time)[2] / 80.0) ** 2 for a in ("L1", "L2") if a in axes)
+            if impact > 0.0:
+                drop = clamp(math.sqrt(impact)) * 0.4
+                freq_a, freq_b = freq_a - drop, freq_b - drop
+            freq_a, freq_b = clamp(freq_a), clamp(freq_b)
+        pulses.append((amp_a, amp_b, freq_a, freq_b))
+    return np.array(pulses, dtype=np.float32)
+
+
+def random_actions(rng, count, low=0.0, high=100.0):
+    at, actions = 0, []
+    for _ in range(count):
+        at += rng.choice([0, 50, 120, 300, 700])
+        actions.append({"at": at, "pos": rng.uniform(low - 10.0, high + 10.0)})
+    return actions
+
+
+@pytest.fixture
+def funscript():
+    rng = random.Random(1)
+    funscript = {
+        "actions": random_actions(rng, 300, 20.0, 80.0),
+        "axes": [
+            {"id": "R0", "actions": random_actions(rng, 100)},
+            {"id": "R1", "actions": random_actions(rng, 80, 40.0, 70.0)},
+            {"id": "R2", "actions": random_actions(rng, 120)},
+            {"id": "L1", "actions": random_actions(rng, 90)},
+            {"id": "L2", "actions": random_actions(rng, 200)},
+            # Not played: an L0 in the axes list, an unsupported axis, and an invalid one
+            {"id": "L0", "actions": random_actions(rng, 5)},
+            {"id": "A1", "actions": random_actions(rng, 5)},
+            {"id": "L1", "actions": []},
+        ],
+    }
+    # An out of order action
+    funscript["actions"].append({"at": 5000, "pos": 40})
+    return funscript
+
+
+SETTINGS = [
+    FunscriptSettings(),
+    FunscriptSettings(volume=0.3, flip_directional_freq_shift=True, normalise_axes=False, smoothing_sigma=0.05,
+                      positional_effect_curve=1.0, positional_effect_strength=0.6),
+]
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+def test_render_matches_app(funscript, settings):
+    pulses = render_funscript(json.dumps(funscript), settings)
+    expected = scalar_render(funscript, settings)
+    rendered = np.stack([pulses["left_amp"], pulses["right_amp"], pulses["left_freq"], pulses["right_freq"]], axis=1)
+    assert rendered.shape == expected.shape
+    assert np.array_equal(rendered, expected)
+
+
+def test_render_blocks_join_exactly(funscript, tmp_path):
+    axes = load_funscript_axes(parse_funscript(funscript))
+    whole = np.concatenate(list(render_blocks(axes, block_pulses=1 << 20)))
+    assert np.array_equal(np.concatenate(list(render_blocks(axes, block_pulses=7))), whole)
+
+    funscript_filename, hwl_filename = tmp_path / "test.funscript", tmp_path / "test.hwl"
+    funscript_filename.write_text(json.dumps(funscript))
+    assert render_funscript_file(str(funscript_filename), str(hwl_filename)) == len(whole)
+    assert np.array_equal(read_hwl_array(str(hwl_filename)), whole)
+
+
+def assert_same_actions(parsed, expected):
+    assert [a.axis_id for a in parsed] == [a.axis_id for a in expected]
+    for a, b in zip(parsed, expected):
+        assert np.array_equal(a.at, b.at) and np.array_equal(a.pos, b.pos)
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_streaming_parse_matches_json(funscript, tmp_path, indent, chunk_size):
+    # Other layouts and extra fields among the actions
+    funscript["actions"][10] = {"pos": 12.5, "at": 510}
+    funscript["actions"][20]["note"] = {"text": "[1, 2]"}
+    funscript["actions"][30]["at"] = 1.5e3
+    funscript["metadata"] = {"title": "Test \"actions\"", "tags": ["a", "b"]}
+    expected = parse_funscript(funscript)
+
+    filename = tmp_path / "test.funscript"
+    filename.write_text(json.dumps(funscript, indent=indent))
+    assert_same_actions(read_funscript(str(filename), chunk_size=chunk_size), expected)
+    assert_same_actions(parse_funscript(filename.read_bytes()), expected)
+
+
+def test_sort_actions():
+    at, pos = sort_actions(np.array([300.0, 100.0, 200.0, 100.0]), np.array([150.0, 10.0, -5.0, 90.0]))
+    assert at.tolist() == [100.0, 200.0, 300.0]
+    # The first action at a time is kept
+    assert pos.tolist() == [10.0, 0.0, 100.0]
+
+
+def test_later_valid_axis_replaces_earlier():
+    actions = [{"at": 0, "pos": 0}, {"at": 1000, "pos": 100}]
+    funscript = {"actions": actions, "axes": [{"id": "R0", "actions": actions},
+                                              {"id": "R0", "actions": [{"at": 0, "pos": 50}, {"at": 2000, "pos": 0}]},
+                                              {"id": "R0", "actions": []}]}
+    axes = load_funscript_axes(parse_funscript(funscript))
+    assert sorted(axes) == ["L0", "R0"]
+    assert axes["R0"].duration == 2.0
+
+
+@pytest.mark.parametrize("content", [
+    "",
+    "[]",
+    '{"axes": []}',
+    '{"actions": [{"at": 0, "pos": 0}]} []',
+    '{"actions": [{"at": 0}]}',
+    '{"actions": [{"at": "0", "pos": 0}]}',
+    '{"actions": [{"at": true, "pos": 0}]}',
+    '{"actions": [{"at": 0, "pos": 0} {"at": 1, "pos": 0}]}',
+    '{"actions": [], "axes": [{"actions": []}]}',
+    '{"actions": [{"at": 0, "pos": 0}',
+])
+def test_invalid_funscripts(content, tmp_path):
+    with pytest.raises(ValueError):
+        parse_funscript(content)
+    filename = tmp_path / "test.funscript"
+    filename.write_text(content)
+    with pytest.raises(ValueError):
+        read_funscript(str(filename), chunk_size=4)
+
+
+def dense_error(original, simplified, points=200):
+    """The largest position difference (0-100) between two axes, at many points between each original action"""
+    times = (original.times[:-1, np.newaxis] + np.diff(original.times)[:, np.newaxis] * np.linspace(0.0, 1.0, points))
+    return 100.0 * float(np.abs(original.evaluate(times.ravel())[0] - simplified.evaluate(times.ravel())[0]).max())
+
+
+@pytest.mark.parametrize("normalisation", [NORMALISATION_OFF, NORMALISATION_FULL_RANGE, NORMALISATION_BALANCED])
+@pytest.mark.parametrize("max_error", [0.5, 2.0])
+@pytest.mark.parametrize("seed", range(4))
+def test_simplify_error_is_a_bound(normalisation, max_error, seed):
+    rng = np.random.default_rng(seed)
+    at = np.cumsum(rng.choice([10.0, 20.0, 50.0, 300.0], 2000))
+    pos = np.clip(50.0 + np.cumsum(rng.normal(0.0, 6.0, len(at))), 0.0, 100.0)
+    if seed % 2:
+        # Repeated positions give flat segments
+        pos = np.round(pos / 10.0) * 10.0
+    kept, error = simplify_actions(at, pos, max_error, normalisation)
+
+    assert 1 < len(kept) < len(at) and np.all(np.diff(at[kept]) > 0)
+    original = FunscriptAxis.create("", at, pos, normalisation)
+    simplified = FunscriptAxis.create("", at[kept], pos[kept], normalisation)
+    assert error <= max_error
+    assert dense_error(original, simplified) <= error + 1e-9
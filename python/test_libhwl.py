@@ -0,0 +1,108 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from libhwl import (HWL_COMPACT_BITS, HWL_COMPACT_CODECS, HwlFile, HwlWriter, decode_compact_hwl,
+                    dequantise_hwl_array, empty_hwl_array, encode_compact_hwl, quantise_hwl_array,
+                    read_compact_hwl_header, write_hwl_array)
+
+
+@pytest.fixture
+def pulses():
+    pulses = empty_hwl_array(20)
+    pulses["left_amp"] = np.linspace(0.0, 1.0, 20)
+    pulses["right_amp"] = np.linspace(1.0, 0.0, 20)
+    pulses["left_freq"] = np.arange(20)
+    pulses["right_freq"] = np.arange(20, 40)
+    return pulses
+
+
+@pytest.fixture
+def hwl_file(tmp_path, pulses):
+    filename = tmp_path / "test.hwl"
+    write_hwl_array(str(filename), pulses)
+    with HwlFile(str(filename)) as f:
+        yield f
+
+
+@pytest.mark.parametrize("index", [
+    slice(None), slice(3, 11), slice(2, 17, 3), slice(None, None, -1), slice(15, 4, -2),
+    slice(-1, -21, -1), slice(None, None, -7), slice(5, 5), slice(8, 2), slice(2, 8, -1), slice(-100, 100),
+])
+def test_slices_match_numpy(hwl_file, pulses, index):
+    assert np.array_equal(hwl_file[index], pulses[index])
+
+
+def test_single_pulses(hwl_file, pulses):
+    assert len(hwl_file) == len(pulses)
+    first, last = hwl_file[0], hwl_file[-1]
+    assert (first.left_amp, first.right_amp, first.left_freq, first.right_freq) == (0.0, 1.0, 0.0, 20.0)
+    assert (last.left_amp, last.right_amp, last.left_freq, last.right_freq) == (1.0, 0.0, 19.0, 39.0)
+    with pytest.raises(IndexError):
+        hwl_file[20]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+def test_writer_uses_default_permissions(tmp_path, pulses):
+    filename = tmp_path / "written.hwl"
+    with HwlWriter(str(filename)) as writer:
+        writer.write_array(pulses)
+    # Compare with a normally created file, rather than mkstemp's owner only permissions
+    plain = tmp_path / "plain"
+    plain.touch()
+    assert stat.S_IMODE(filename.stat().st_mode) == stat.S_IMODE(plain.stat().st_mode)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="POSIX permissions")
+@pytest.mark.parametrize("umask", [0o077, 0o022, 0o002])
+def test_writer_follows_current_umask(tmp_path, pulses, umask):
+    # The umask is read when each file is written, not when libhwl was imported
+    old_umask = os.umask(umask)
+    try:
+        filename = tmp_path / "written.hwl"
+        with HwlWriter(str(filename)) as writer:
+            writer.write_array(pulses)
+    finally:
+        os.umask(old_umask)
+    assert stat.S_IMODE(filename.stat().st_mode) == 0o666 & ~umask
+    assert [p.name for p in tmp_path.iterdir()] == ["written.hwl"]
+
+
+def noisy_pulses(count):
+    """Smooth values with noise, out of range values and steps that wrap the delta coding around"""
+    rng = np.random.default_rng(1)
+    pulses = empty_hwl_array(count)
+    t = np.arange(count) / 40.0
+    pulses["left_amp"] = 0.5 + 0.5 * np.sin(t)
+    pulses["right_amp"] = rng.random(count)
+    pulses["left_freq"] = np.where(np.arange(count) % 7 < 3, 0.0, 1.0)
+    pulses["right_freq"] = rng.normal(0.5, 0.6, count)
+    return pulses
+
+
+@pytest.mark.parametrize("bits", list(HWL_COMPACT_BITS))
+@pytest.mark.parametrize("codec", list(HWL_COMPACT_CODECS))
+@pytest.mark.parametrize("delta", [True, False])
+def test_compact_round_trip_is_lossless_to_quantisation(bits, codec, delta):
+    pulses = noisy_pulses(5000)
+    data = encode_compact_hwl(pulses, bits, delta, codec)
+    header = read_compact_hwl_header(data)
+    assert header == {"version": 1, "bits": bits, "delta": delta, "codec": codec, "num_pulses": len(pulses)}
+
+    decoded = decode_compact_hwl(data)
+    assert np.array_equal(quantise_hwl_array(decoded, bits), quantise_hwl_array(pulses, bits))
+    assert np.array_equal(decoded, dequantise_hwl_array(quantise_hwl_array(pulses, bits), bits))
+    # Every value is within half a quantisation step of the (clipped) original
+    original = np.clip(pulses.view("<f4"), 0.0, 1.0)
+    assert np.abs(decoded.view("<f4") - original).max() <= 0.5 / ((1 << bits) - 1) + 1e-7
+
+
+def test_compact_empty_and_corrupt():
+    assert len(decode_compact_hwl(encode_compact_hwl(empty_hwl_array(0)))) == 0
+    data = encode_compact_hwl(noisy_pulses(100))
+    with pytest.raises(ValueError):
+        decode_compact_hwl(data[:-10])
+    with pytest.raises(ValueError):
+        decode_compact_hwl(b"YEAHBOI!" + data[8:])